@@ -1,17 +1,153 @@
 from flask import Response
-import requests
+import functools
+import logging
+import os
+import queue
+import threading
+import time
 from flask import Flask, render_template, request, jsonify
+import metrics
+import profiling
+import cursors
+import image_proxy as images
+import listing_details
+from blocking import breaker
+from governor import GovernorBusyError, governor
+from responses import json_response, not_modified, version_etag
+from results import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, ResultStore
+from scheduler import RefreshScheduler, ResultCache
+from price_history import BUCKETS, PriceHistoryStore
+from stats import DEFAULT_QUANTILES, DIMENSIONS, MarketStats
 from zameen_scraper import scrape_zameen_city as scrape_zameen
 from property1_scraper import scrape_property1_city as scrape_property1
 from olx_scraper import scrape_olx_city as scrape_olx 
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
 # Available cities for each source
 ZAMEEN_CITIES = ['Lahore', 'Karachi', 'Rawalpindi', 'Islamabad']
 PROPERTY1_CITIES = ['Islamabad', 'Rawalpindi', 'Lahore', 'Karachi']
 OLX_CITIES = ['Lahore', 'Karachi', 'Islamabad', 'Rawalpindi'] 
 
+# Most result pages one /scrape may crawl
+MAX_PAGES = 10
+
+PREFETCH_NEXT_PAGE = os.environ.get('PREFETCH_NEXT_PAGE', '1') != '0'
+# Fetch result images into the proxy cache before the browser asks for them
+WARM_IMAGES = os.environ.get('WARM_IMAGES', '0') != '0'
+# Skip OLX property pages during the crawl; the grid loads them via /listing/details
+LAZY_OLX_DETAILS = os.environ.get('LAZY_OLX_DETAILS', '1') != '0'
+
+SCRAPERS = {
+    'zameen': scrape_zameen,
+    'property1': scrape_property1,
+    'olx': functools.partial(scrape_olx, lazy_details=True) if LAZY_OLX_DETAILS else scrape_olx,
+}
+
+SOURCE_CITIES = {
+    'zameen': ZAMEEN_CITIES,
+    'property1': PROPERTY1_CITIES,
+    'olx': OLX_CITIES,
+}
+
+# Every live crawl appends its prices here; set PRICE_HISTORY_DIR= to turn it off
+PRICE_HISTORY_DIR = os.environ.get('PRICE_HISTORY_DIR', 'price_history')
+price_history = None
+if PRICE_HISTORY_DIR:
+    try:
+        price_history = PriceHistoryStore(PRICE_HISTORY_DIR)
+    except RuntimeError as e:
+        logger.warning("Price history disabled: %s", e)
+    except Exception:
+        logger.exception("Price history disabled: could not open %s", PRICE_HISTORY_DIR)
+
+# Crawls hand their listings to one writer thread, so a crawl holding a governor
+# slot never waits on the fsync'd append or a compaction
+_price_history_queue = queue.Queue(maxsize=100)
+
+def _write_price_history():
+    while True:
+        properties, ts = _price_history_queue.get()
+        try:
+            price_history.record_crawl(properties, ts=ts)
+        except Exception:
+            logger.exception("Could not record price history")
+
+if price_history is not None:
+    threading.Thread(target=_write_price_history, name='price-history', daemon=True).start()
+
+# Price per sqft aggregates behind /stats, snapshotted to STATS_PATH now and then
+STATS_PATH = os.environ.get('STATS_PATH', 'market_stats.json')
+STATS_SAVE_INTERVAL = 60
+market_stats = MarketStats.load(STATS_PATH) if STATS_PATH else MarketStats()
+_stats_saved_at = time.time()
+_stats_saving = threading.Lock()
+
+def save_market_stats():
+    # One snapshot at a time, off the request thread
+    if not _stats_saving.acquire(blocking=False):
+        return
+    try:
+        market_stats.save(STATS_PATH)
+    except OSError as e:
+        logger.warning("Could not save market stats: %s", e)
+    finally:
+        _stats_saving.release()
+
+def record_listings(source, properties):
+    global _stats_saved_at
+    if not properties:
+        return
+    if price_history is not None:
+        try:
+            _price_history_queue.put_nowait((properties, time.time()))
+        except queue.Full:
+            logger.warning("Price history writer is behind; dropped %d listings", len(properties))
+    market_stats.add_many(properties, source)
+    if STATS_PATH and time.time() - _stats_saved_at > STATS_SAVE_INTERVAL:
+        _stats_saved_at = time.time()
+        threading.Thread(target=save_market_stats, daemon=True).start()
+
+def crawl(source, city, start_page, pages):
+    """The crawl behind every governed /scrape, refresh and prefetch; records what it finds"""
+    # Identical crawls in flight, prefetches included, are shared by the governor,
+    # so a crawl holding a slot does not also wait on the page cache for them
+    properties = cursors.crawl_pages(SCRAPERS[source], source, city, start_page, pages, wait=False)
+    record_listings(source, properties)
+    if start_page == 1 and properties:
+        result_cache.put((source, city, pages), properties)
+    return properties
+
+def governed_crawl(source, city, start_page, pages, ticket=None, wait=True):
+    """crawl() under the governor; identical crawls already in flight share one run
+
+    Returns (properties, info) with the governor's info about the crawl.
+    """
+    return governor.run(source, (source, city, start_page, pages), crawl, source, city, start_page, pages,
+                        ticket=ticket, wait=wait)
+
+def refresh_crawl(source, city, pages):
+    # Background refreshes never queue in front of users' crawls
+    properties, _ = governed_crawl(source, city, 1, pages, wait=False)
+    return properties
+
+def prefetch_crawl(source, city, pages, start_page=1):
+    properties, _ = governed_crawl(source, city, start_page, pages, wait=False)
+    return properties
+
+# Whole results for popular (source, city, pages) queries, kept warm in the background
+result_cache = ResultCache(ttl=int(os.environ.get('RESULT_CACHE_TTL', 900)))
+refresh_scheduler = RefreshScheduler(
+    result_cache,
+    refresh_crawl,
+    budget_per_hour=int(os.environ.get('REFRESH_BUDGET_PER_HOUR', 30)),
+)
+REFRESH_SCHEDULER = os.environ.get('REFRESH_SCHEDULER', '1') != '0'
+
+# Listings of each /scrape (plus its "load more" crawls), served a page at a time by /results
+result_store = ResultStore()
+
 @app.route('/')
 def index():
     return render_template('index.html', 
@@ -24,31 +160,238 @@ def scrape():
     data = request.json
     source = data.get('source')
     city = data.get('city')
-    pages = int(data.get('pages', 1))
+    try:
+        pages = int(data.get('pages', 1))
+    except (TypeError, ValueError):
+        pages = 0
+    if not 1 <= pages <= MAX_PAGES:
+        return jsonify({'error': f'pages must be between 1 and {MAX_PAGES}'}), 400
+    start_page = 1
+    # With page_size only the first page_size listings are returned; the rest come from /results
+    page_size = data.get('page_size')
+    if page_size is not None:
+        try:
+            page_size = int(page_size)
+        except (TypeError, ValueError):
+            page_size = 0
+        if not 1 <= page_size <= MAX_PAGE_SIZE:
+            return jsonify({'error': f'page_size must be between 1 and {MAX_PAGE_SIZE}'}), 400
+    
+    # A cursor from a previous response continues that crawl
+    if data.get('cursor'):
+        try:
+            source, city, start_page = cursors.decode_cursor(data['cursor'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
     
     if not source or not city:
         return jsonify({'error': 'Missing source or city'}), 400
     
+    if source not in SCRAPERS:
+        return jsonify({'error': 'Invalid source'}), 400
+    
+    # Checked before the crawl takes a governor slot; cursors are decoded, not trusted
+    if city not in SOURCE_CITIES[source]:
+        return jsonify({'error': f"Unknown city '{city}' for {source}"}), 400
+    
+    scraper = SCRAPERS[source]
+    cache_key = (source, city, pages)
+    profile = profiling.profile_requested(request)
+    # Fresh queries from page 1 are counted and served from the result cache
+    cacheable = start_page == 1 and not profile
     try:
-        if source == 'zameen':
-            properties = scrape_zameen(city, pages)
-        elif source == 'property1':
-            properties = scrape_property1(city, pages)
-        elif source == 'olx':  
-            properties = scrape_olx(city, pages) 
-        else:
-            return jsonify({'error': 'Invalid source'}), 400
+        report = None
+        cached = None
+        crawl_info = None
+        if cacheable:
+            if REFRESH_SCHEDULER:
+                refresh_scheduler.start()
+                refresh_scheduler.record_request(cache_key)
+            cached = result_cache.get(cache_key)
         
-        return jsonify({
+        if cached:
+            properties = cached['properties']
+        elif profile:
+            (properties, report), crawl_info = governor.run(
+                source, (source, city, start_page, pages, 'profile'), profiling.run_profiled,
+                f"{source}/{city}/{start_page}+{pages}", cursors.crawl_pages, scraper, source, city, start_page, pages,
+                ticket=data.get('ticket'))
+        else:
+            properties, crawl_info = governed_crawl(source, city, start_page, pages, data.get('ticket'))
+        next_page = start_page + pages
+        if properties and data.get('warm_images', WARM_IMAGES):
+            images.warmer.warm(properties)
+        payload = {
             'success': True,
             'source': source,
             'city': city,
             'total': len(properties),
-            'properties': properties
-        })
+            'properties': properties if page_size is None else properties[:page_size],
+            'next_page': next_page,
+            'cursor': cursors.encode_cursor(source, city, next_page),
+            'cached': bool(cached),
+        }
+        # Only clients that page through /results get a result set; "load more"
+        # passes the result_id back to extend it
+        if page_size is not None or data.get('result_id'):
+            result_id, offset, result_total = result_store.add(properties, data.get('result_id'))
+            payload.update(result_id=result_id, offset=offset, result_total=result_total)
+        if page_size is not None:
+            payload['page_size'] = page_size
+        if crawl_info:
+            payload['governor'] = crawl_info
+        headers = {}
+        if report:
+            payload['profile_id'] = report.id
+            headers['X-Profile-Id'] = report.id
+        with metrics.timed('serialize', source, city):
+            response = json_response(payload, headers=headers)
+        
+        # Warm the next page while the client renders this one
+        if PREFETCH_NEXT_PAGE and properties:
+            response.call_on_close(lambda: cursors.prefetch_next_page(
+                functools.partial(prefetch_crawl, source), source, city, next_page))
+        return response
+    except GovernorBusyError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
     except Exception as e:
+        logger.exception("Scrape failed for %s/%s", source, city)
         return jsonify({'error': str(e)}), 500
     
+@app.route('/scheduler')
+def scheduler_state():
+    return json_response(refresh_scheduler.state())
+
+@app.route('/governor')
+def governor_state():
+    return json_response(governor.state())
+
+@app.route('/governor/tickets/<ticket>')
+def governor_ticket(ticket):
+    position = governor.position(ticket)
+    if position is None:
+        return jsonify({'error': 'No crawl waiting for this ticket'}), 404
+    return json_response(position)
+
+def _int_arg(name, default=None):
+    value = request.args.get(name)
+    return int(value) if value not in (None, '') else default
+
+@app.route('/results/<result_id>')
+def results_page(result_id):
+    try:
+        body = result_store.page(result_id, _int_arg('page', 1), _int_arg('page_size', DEFAULT_PAGE_SIZE))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if body is None:
+        return jsonify({'error': 'Result set not found or expired'}), 404
+    # Result sets never change under their id
+    return json_response(body, etag=version_etag(0))
+
+@app.route('/price-history')
+def price_history_listing():
+    if price_history is None:
+        return jsonify({'error': 'Price history is disabled'}), 404
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'error': 'Missing url'}), 400
+    etag = version_etag(price_history.version)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    return json_response({'url': url, 'history': [
+        {'ts': ts, 'price': price} for ts, price in price_history.history(url)
+    ]}, etag=etag)
+
+@app.route('/price-history/changes')
+def price_history_changes():
+    if price_history is None:
+        return jsonify({'error': 'Price history is disabled'}), 404
+    etag = version_etag(price_history.version)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    try:
+        changes = price_history.price_changes(
+            city=request.args.get('city'), since=_int_arg('since'),
+            min_change=float(request.args.get('min_change', 0)), limit=_int_arg('limit', 50))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return json_response({'changes': changes}, etag=etag)
+
+@app.route('/price-history/median-per-marla')
+def price_history_median():
+    if price_history is None:
+        return jsonify({'error': 'Price history is disabled'}), 404
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in BUCKETS:
+        return jsonify({'error': f"bucket must be one of {', '.join(BUCKETS)}"}), 400
+    etag = version_etag(price_history.version)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    try:
+        series = price_history.median_price_per_marla(
+            city=request.args.get('city'), since=_int_arg('since'), bucket=bucket)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return json_response({'bucket': bucket, 'series': series}, etag=etag)
+
+@app.route('/stats')
+def stats():
+    try:
+        quantiles = [float(q) for q in request.args['q'].split(',')] if request.args.get('q') else DEFAULT_QUANTILES
+    except ValueError:
+        return jsonify({'error': 'q must be a comma-separated list of numbers'}), 400
+    if any(not 0 <= q <= 1 for q in quantiles):
+        return jsonify({'error': 'q values must be between 0 and 1'}), 400
+    etag = version_etag(market_stats.version)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    filters = {name: request.args.get(name) for name in DIMENSIONS}
+    summary = market_stats.query(quantiles, **filters)
+    summary['unit'] = 'PKR per sqft'
+    return json_response(summary, etag=etag)
+
+@app.route('/listing/details')
+def listing_details_endpoint():
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'error': 'Missing url'}), 400
+    try:
+        details, cached = listing_details.get_details(url)
+    except listing_details.DisallowedURLError as e:
+        return jsonify({'error': str(e)}), 400
+    return json_response({'url': url, 'image': details['image'],
+                          'description': details['description'], 'cached': cached})
+
+@app.route('/circuit-breakers')
+def circuit_breakers():
+    return json_response(breaker.state())
+
+@app.route('/profiles')
+def profiles():
+    return json_response({'profiles': profiling.list_profiles()})
+
+@app.route('/profiles/<profile_id>')
+def profile_report(profile_id):
+    report = profiling.get_profile(profile_id)
+    if report is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return Response(report.text(), mimetype='text/plain')
+
+@app.route('/profiles/<profile_id>/flamegraph')
+def profile_flamegraph(profile_id):
+    report = profiling.get_profile(profile_id)
+    if report is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return Response(report.collapsed, mimetype='text/plain')
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 
 @app.route("/image-proxy")
 def image_proxy():
@@ -57,35 +400,16 @@ def image_proxy():
     if not image_url:
         return "No URL provided", 400
 
+    headers = {
+        "Cache-Control": "public, max-age=86400",  # Cache for 24 hours
+        "Access-Control-Allow-Origin": "*"
+    }
     try:
-        # Determine referer based on domain
-        referer = "https://www.google.com/"
-        if "zameen.com" in image_url:
-            referer = "https://www.zameen.com/"
-        elif "property1.pk" in image_url:
-            referer = "https://www.property1.pk/"
-        elif "olx.com.pk" in image_url: 
-            referer = "https://www.olx.com.pk/"
-
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Referer": referer,
-            "Accept": "image/webp,image/apng,image/*,*/*;q=0.8",
-            "Accept-Language": "en-US,en;q=0.9",
-            "Connection": "keep-alive",
-        }
-
-        r = requests.get(image_url, headers=headers, timeout=15, stream=True)
+        # Concurrent requests for the same image share one upstream fetch
+        status, content, content_type = images.get_image(image_url)
 
-        if r.status_code == 200:
-            return Response(
-                r.content,
-                content_type=r.headers.get("Content-Type", "image/jpeg"),
-                headers={
-                    "Cache-Control": "public, max-age=86400",  # Cache for 24 hours
-                    "Access-Control-Allow-Origin": "*"
-                }
-            )
+        if status == 200:
+            return Response(content, content_type=content_type, headers=headers)
         else:
             # Return a placeholder image if fetch fails
             return Response(
@@ -96,6 +420,10 @@ def image_proxy():
     except Exception as e:
         return str(e), 500
 
+@app.route("/image-proxy/stats")
+def image_proxy_stats():
+    return json_response(images.stats())
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
@@ -106,4 +434,6 @@ def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
 if __name__ == '__main__':
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     app.run(debug=True, port=5000, host='0.0.0.0')
\ No newline at end of file
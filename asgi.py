@@ -0,0 +1,174 @@
+"""
+ASGI entry point for serving many concurrent connections on a few threads.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+    python asgi.py
+
+/image-proxy is served natively on the event loop: upstream images are
+fetched with an httpx.AsyncClient, concurrent requests for the same URL
+await one fetch, and results land in the same cache and metrics as the
+Flask route. Waiting on the network costs no thread, so thousands of
+proxy connections can be open at once.
+
+Every other route, /scrape included, is the Flask app run through a2wsgi
+on a pool of WSGI_THREADS threads. The scrapers are blocking requests +
+BeautifulSoup code, so a running crawl still occupies one pool thread,
+but connections waiting for a free thread cost nothing and the pool size
+caps how many crawls run at once.
+
+Needs a2wsgi and an ASGI server (pip install a2wsgi uvicorn). httpx is
+optional (pip install httpx); without it image fetches run on threads.
+"""
+import asyncio
+import logging
+import os
+from urllib.parse import parse_qs
+
+import image_proxy as images
+from app import app as flask_app
+from singleflight import AsyncSingleFlight
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    WSGIMiddleware = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 32))
+MAX_UPSTREAM_CONNECTIONS = 100
+
+if WSGIMiddleware is None:
+    raise RuntimeError("ASGI mode needs a2wsgi: pip install a2wsgi uvicorn")
+
+wsgi_app = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+in_flight = AsyncSingleFlight()
+client = None
+
+
+def _client():
+    global client
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=images.FETCH_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=MAX_UPSTREAM_CONNECTIONS),
+        )
+    return client
+
+
+async def fetch_image(image_url):
+    """Async images.fetch_image"""
+    try:
+        r = await _client().get(image_url, headers=images.request_headers(image_url))
+    except Exception:
+        images.IMAGE_UPSTREAM_FETCHES.labels(status='error').inc()
+        raise
+    images.IMAGE_UPSTREAM_FETCHES.labels(status=str(r.status_code)).inc()
+    return r.status_code, r.content, r.headers.get("Content-Type", "image/jpeg")
+
+
+async def _fetch_into_cache(image_url):
+    cached = images.cache.get(image_url)
+    if cached:
+        return 200, cached[0], cached[1]
+    try:
+        status, content, content_type = await fetch_image(image_url)
+    except Exception:
+        images.record_result(image_url, None)
+        raise
+    images.record_result(image_url, status)
+    if status == 200:
+        images.cache.put(image_url, content, content_type)
+    return status, content, content_type
+
+
+async def get_image(image_url):
+    """(status_code, content, content_type) from the cache or one shared upstream fetch"""
+    if httpx is None:
+        return await asyncio.to_thread(images.get_image, image_url)
+    cached = images.cache.get(image_url)
+    if cached:
+        return 200, cached[0], cached[1]
+    if images.is_known_bad(image_url):
+        return images.NOT_FOUND
+    result, shared = await in_flight.do(image_url, _fetch_into_cache, image_url)
+    if shared:
+        images.IMAGE_COALESCED.inc()
+    return result
+
+
+async def _respond(send, status, body, content_type, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type.encode('latin-1')),
+            (b'content-length', str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def image_proxy(scope, receive, send):
+    params = parse_qs(scope['query_string'].decode('latin-1'))
+    image_url = params.get('url', [None])[0]
+
+    if not image_url:
+        await _respond(send, 400, b"No URL provided", 'text/html; charset=utf-8')
+        return
+
+    try:
+        status, content, content_type = await get_image(image_url)
+    except Exception as e:
+        await _respond(send, 500, str(e).encode('utf-8'), 'text/html; charset=utf-8')
+        return
+
+    if status == 200:
+        await _respond(send, 200, content, content_type, [
+            (b'cache-control', b'public, max-age=86400'),
+            (b'access-control-allow-origin', b'*'),
+        ])
+    else:
+        await _respond(send, 404, b"Image not found", 'text/html; charset=utf-8')
+
+
+async def _lifespan(receive, send):
+    global client
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            logger.info("🚀 ASGI app ready (%d WSGI threads, httpx %s)",
+                        WSGI_THREADS, 'on' if httpx is not None else 'not installed')
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if client is not None:
+                await client.aclose()
+                client = None
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/image-proxy' and scope['method'] in ('GET', 'HEAD'):
+        await image_proxy(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        raise RuntimeError("Serving asgi.py directly needs uvicorn: pip install uvicorn")
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
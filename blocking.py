@@ -0,0 +1,222 @@
+"""
+Soft-block detection and a per-domain circuit breaker.
+
+Sites that block scrapers often answer 200 with a captcha or an empty page
+shell instead of an error. classify_page() sorts a fetched result page into
+'listings', 'empty' or 'blocked' using fingerprints of common challenge
+pages, the size of the page and the number of cards found on it. A page
+with cards is never a block: CDNs inject challenge scripts into real pages
+too. Scrapers report each parsed result page with check_result_page().
+
+The breaker counts consecutive blocks per domain. After BLOCK_THRESHOLD
+of them it opens and fetch() refuses requests to that domain with
+CircuitOpenError. Once the cooldown has passed a single probe request is let
+through: if it comes back unblocked the breaker closes, otherwise it opens
+again with double the cooldown (up to MAX_COOLDOWN).
+"""
+import logging
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BLOCK_THRESHOLD = 3
+COOLDOWN = 300
+MAX_COOLDOWN = 3600
+# A probe that never reported back (its page failed to parse) stops holding the breaker after this
+PROBE_TIMEOUT = 60
+
+# Statuses that mean "go away" rather than "try again"
+BLOCK_STATUSES = (403, 429)
+
+# Real result pages are well over this; captcha interstitials and JS shells are not
+MIN_PAGE_SIZE = 2048
+
+BLOCK_FINGERPRINTS = re.compile(
+    r'cf-chl-|challenge-platform|cf_captcha|px-captcha|_Incapsula_Resource|Incapsula incident'
+    r'|distil_r_captcha|Please verify you are a human|unusual traffic from your'
+    r'|Access to this page has been denied',
+    re.I,
+)
+BLOCK_TITLES = re.compile(r'captcha|access denied|attention required|just a moment|are you a robot|blocked',
+                          re.I)
+_title_pattern = re.compile(r'<title[^>]*>(.*?)</title>', re.I | re.S)
+
+PAGE_VERDICTS = metrics.Counter('scraper_page_verdicts_total', 'Result pages by classification',
+                                ['source', 'verdict'])
+CIRCUIT_EVENTS = metrics.Counter('circuit_breaker_events_total', 'Circuit breaker state changes',
+                                 ['domain', 'event'])
+CIRCUIT_OPEN = metrics.Gauge('circuit_breaker_open', '1 while requests to a domain are being refused',
+                             ['domain'])
+CIRCUIT_REJECTED = metrics.Counter('circuit_breaker_rejected_total', 'Requests refused by an open breaker',
+                                   ['domain'])
+
+
+class BlockedPageError(Exception):
+    """The site answered with a captcha or an empty shell instead of results"""
+
+    def __init__(self, url, reason):
+        self.url = url
+        self.reason = reason
+        super().__init__(f"Blocked by {domain_of(url)} ({reason})")
+
+
+class CircuitOpenError(Exception):
+    """Requests to the domain are suspended after repeated blocks"""
+
+    def __init__(self, domain, retry_in):
+        self.domain = domain
+        self.retry_in = retry_in
+        super().__init__(f"Circuit open for {domain}, next probe in {retry_in:.0f}s")
+
+
+def domain_of(url):
+    host = urlsplit(url).netloc.lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+def shell_reason(html):
+    """Why a 200 page is a block whatever it contains (a challenge title, or too small to hold results), or None"""
+    title = _title_pattern.search(html[:20000])
+    if title and BLOCK_TITLES.search(title.group(1)):
+        return f"title '{title.group(1).strip()[:60]}'"
+    if len(html) < MIN_PAGE_SIZE:
+        return 'empty shell'
+    return None
+
+
+def block_reason(html):
+    """Why a 200 page looks like a block, or None if it looks like a real page"""
+    reason = shell_reason(html)
+    if reason:
+        return reason
+    match = BLOCK_FINGERPRINTS.search(html[:20000])
+    if match:
+        return f"fingerprint '{match.group(0)}'"
+    return None
+
+
+def classify_page(html, card_count):
+    """'listings', 'empty' or 'blocked' for a fetched result page"""
+    if card_count:
+        return 'listings'
+    return 'blocked' if block_reason(html) else 'empty'
+
+
+def record_verdict(source, verdict):
+    PAGE_VERDICTS.labels(source=source, verdict=verdict).inc()
+
+
+def check_result_page(url, source, html, card_count):
+    """Classify a parsed result page and report it to the breaker; raises BlockedPageError for a block"""
+    verdict = classify_page(html, card_count)
+    record_verdict(source, verdict)
+    domain = domain_of(url)
+    if verdict == 'blocked':
+        reason = block_reason(html)
+        breaker.record_block(domain, reason)
+        raise BlockedPageError(url, reason)
+    breaker.record_success(domain)
+    return verdict
+
+
+class _DomainState:
+    def __init__(self):
+        self.state = 'closed'
+        self.blocks = 0
+        self.cooldown = COOLDOWN
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe_started = 0.0
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=BLOCK_THRESHOLD, cooldown=COOLDOWN, max_cooldown=MAX_COOLDOWN,
+                 probe_timeout=PROBE_TIMEOUT):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = probe_timeout
+        self._domains = {}
+        self._lock = threading.Lock()
+
+    def _get(self, domain):
+        state = self._domains.get(domain)
+        if state is None:
+            state = self._domains[domain] = _DomainState()
+            state.cooldown = self.cooldown
+        return state
+
+    def before_request(self, domain):
+        """Raise CircuitOpenError unless a request to domain may go ahead"""
+        with self._lock:
+            state = self._get(domain)
+            if state.state == 'closed':
+                return
+            retry_in = state.opened_at + state.cooldown - time.time()
+            if state.state == 'open' and retry_in <= 0:
+                state.state = 'half_open'
+                CIRCUIT_EVENTS.labels(domain=domain, event='half_open').inc()
+            if state.state == 'half_open' and (not state.probing or
+                                               time.time() - state.probe_started > self.probe_timeout):
+                state.probing = True
+                state.probe_started = time.time()
+                logger.info("🔌 Probing %s after %ds cooldown", domain, state.cooldown)
+                return
+        CIRCUIT_REJECTED.labels(domain=domain).inc()
+        raise CircuitOpenError(domain, max(retry_in, 0))
+
+    def record_success(self, domain):
+        with self._lock:
+            state = self._get(domain)
+            state.blocks = 0
+            state.probing = False
+            if state.state != 'closed':
+                state.state = 'closed'
+                state.cooldown = self.cooldown
+                CIRCUIT_EVENTS.labels(domain=domain, event='close').inc()
+                CIRCUIT_OPEN.labels(domain=domain).set(0)
+                logger.info("✅ Circuit closed for %s", domain)
+
+    def record_block(self, domain, reason=''):
+        with self._lock:
+            state = self._get(domain)
+            state.blocks += 1
+            if state.state == 'half_open':
+                # The probe was blocked too: back off harder
+                state.cooldown = min(state.cooldown * 2, self.max_cooldown)
+            elif state.state == 'open' or state.blocks < self.threshold:
+                logger.warning("🚧 %s soft-blocked us (%s), %d in a row", domain, reason, state.blocks)
+                return
+            state.state = 'open'
+            state.opened_at = time.time()
+            state.probing = False
+            CIRCUIT_EVENTS.labels(domain=domain, event='open').inc()
+            CIRCUIT_OPEN.labels(domain=domain).set(1)
+            logger.warning("⛔ Circuit open for %s after %d blocks (%s), cooling down %ds",
+                           domain, state.blocks, reason, state.cooldown)
+
+    def record_error(self, domain):
+        """A request failed for an unrelated reason; let another probe through"""
+        with self._lock:
+            self._get(domain).probing = False
+
+    def state(self):
+        now = time.time()
+        with self._lock:
+            return {
+                domain: {
+                    'state': s.state,
+                    'consecutive_blocks': s.blocks,
+                    'cooldown': s.cooldown,
+                    'retry_in': round(max(s.opened_at + s.cooldown - now, 0), 1) if s.state != 'closed' else 0,
+                }
+                for domain, s in self._domains.items()
+            }
+
+
+breaker = CircuitBreaker()
@@ -0,0 +1,131 @@
+"""
+Resumable crawl cursors and speculative next-page prefetch.
+
+/scrape returns a cursor naming the next page of the same crawl. Passing the
+cursor back continues from that page instead of re-crawling pages 1..N.
+After a response is sent the next page is prefetched on a background thread
+and kept in PageCache, so the following "load more" is served from memory.
+"""
+import base64
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CURSOR_VERSION = 1
+PAGE_TTL = 600
+MAX_CACHED_PAGES = 200
+
+
+def encode_cursor(source, city, page):
+    """Opaque cursor pointing at `page` of a (source, city) crawl"""
+    payload = json.dumps({'v': CURSOR_VERSION, 's': source, 'c': city, 'p': page}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (source, city, page) for a cursor, raising ValueError if it is malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if data.get('v') != CURSOR_VERSION:
+            raise ValueError('unsupported cursor version')
+        source, city, page = data['s'], data['c'], int(data['p'])
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if page < 1:
+        raise ValueError('Invalid cursor: page must be positive')
+    return source, city, page
+
+
+class PageCache:
+    """Single result pages keyed by (source, city, page), with TTL and in-flight tracking"""
+
+    def __init__(self, ttl=PAGE_TTL, max_pages=MAX_CACHED_PAGES):
+        self.ttl = ttl
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, wait=True):
+        """Cached properties for key, waiting for an in-flight prefetch of it if there is one"""
+        with self._lock:
+            event = self._inflight.get(key)
+        if event is not None and wait:
+            event.wait()
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is None:
+                return None
+            properties, expires = entry
+            if expires < time.time():
+                del self._pages[key]
+                return None
+            self._pages.move_to_end(key)
+            return properties
+
+    def put(self, key, properties):
+        with self._lock:
+            self._pages[key] = (properties, time.time() + self.ttl)
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+
+    def prefetch(self, key, crawl):
+        """Run crawl() on a background thread and cache its result under key"""
+        with self._lock:
+            if key in self._inflight or key in self._pages:
+                return False
+            event = self._inflight[key] = threading.Event()
+
+        def run():
+            try:
+                properties = crawl()
+                if properties:
+                    self.put(key, properties)
+                logger.debug("Prefetched %s: %d properties", key, len(properties or []))
+            except Exception as e:
+                logger.warning("Prefetch of %s failed: %s", key, e)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                event.set()
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {'pages': len(self._pages), 'inflight': len(self._inflight)}
+
+
+page_cache = PageCache()
+
+
+def crawl_pages(scraper, source, city, start_page, pages, cache=page_cache, wait=True):
+    """Properties for pages start_page..start_page+pages-1, using cached pages where possible
+
+    With wait=False a page that is still being prefetched is crawled again
+    rather than waited for.
+    """
+    properties = []
+    page = start_page
+    end = start_page + pages
+    while page < end:
+        cached = cache.get((source, city, page), wait=wait)
+        if cached is None:
+            break
+        properties.extend(cached)
+        page += 1
+    if page < end:
+        properties.extend(scraper(city, end - page, start_page=page))
+    return properties
+
+
+def prefetch_next_page(scraper, source, city, page, cache=page_cache):
+    """Speculatively crawl one page in the background"""
+    return cache.prefetch((source, city, page), lambda: scraper(city, 1, start_page=page))
@@ -0,0 +1,184 @@
+"""
+Streaming exporters for scraped properties.
+
+Records are appended as the scrapers produce them, buffered in chunks and
+flushed to disk, so memory stays flat. With chunks of PAGE_CHUNK_SIZE a
+crawl that dies part-way still leaves every page it finished written:
+
+    with get_exporter('jsonl', 'lahore.jsonl', chunk_size=PAGE_CHUNK_SIZE) as exporter:
+        exporter.write_many(iter_zameen_city('Lahore', pages=5))
+
+A Parquet file is only readable once it is closed. Parquet output needs
+pyarrow (pip install pyarrow).
+"""
+import csv
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('json', 'jsonl', 'csv', 'parquet')
+
+# Listings on one result page, the most any of the scrapers keeps per page
+PAGE_CHUNK_SIZE = 20
+
+# Union of the fields produced by the three scrapers, in display order
+DEFAULT_FIELDS = ['title', 'price', 'location', 'locality_id', 'area', 'beds', 'baths', 'image', 'url', 'city', 'source']
+
+
+class Exporter:
+    """Buffers records and writes them out chunk by chunk"""
+
+    def __init__(self, path, chunk_size=500):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.count = 0
+        self._buffer = []
+        self._closed = False
+
+    def write(self, record):
+        self._buffer.append(record)
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        if self._buffer:
+            self._write_chunk(self._buffer)
+            self.count += len(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        self._finish()
+        self._closed = True
+        logger.info("💾 %d records saved to %s", self.count, self.path)
+
+    def _write_chunk(self, records):
+        raise NotImplementedError
+
+    def _finish(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _TextExporter(Exporter):
+    def __init__(self, path, chunk_size=500):
+        super().__init__(path, chunk_size)
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _finish(self):
+        self._file.close()
+
+
+class JsonlExporter(_TextExporter):
+    """One JSON object per line"""
+
+    def _write_chunk(self, records):
+        self._file.write(''.join(json.dumps(r, ensure_ascii=False, separators=(',', ':')) + '\n' for r in records))
+        self._sync()
+
+
+class JsonExporter(_TextExporter):
+    """A single JSON array, written incrementally without indentation"""
+
+    def __init__(self, path, chunk_size=500):
+        super().__init__(path, chunk_size)
+        self._file.write('[')
+        self._first = True
+
+    def _write_chunk(self, records):
+        parts = []
+        for record in records:
+            parts.append(('' if self._first else ',\n') + json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+            self._first = False
+        self._file.write(''.join(parts))
+        self._sync()
+
+    def _finish(self):
+        self._file.write(']\n')
+        super()._finish()
+
+
+class CsvExporter(_TextExporter):
+    """CSV with a header row; fields missing from a record are left empty"""
+
+    def __init__(self, path, chunk_size=500, fieldnames=None):
+        super().__init__(path, chunk_size)
+        self.fieldnames = fieldnames
+        self._writer = None
+
+    def _write_chunk(self, records):
+        if self._writer is None:
+            if self.fieldnames is None:
+                extra = [k for k in records[0] if k not in DEFAULT_FIELDS]
+                self.fieldnames = DEFAULT_FIELDS + extra
+            self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames, extrasaction='ignore', restval='')
+            self._writer.writeheader()
+        self._writer.writerows(records)
+        self._sync()
+
+
+class ParquetExporter(Exporter):
+    """Parquet file with one row group per chunk"""
+
+    def __init__(self, path, chunk_size=10000, compression='zstd', fieldnames=None):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+        super().__init__(path, chunk_size)
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.compression = compression
+        self.fieldnames = fieldnames
+        self._writer = None
+
+    def _write_chunk(self, records):
+        pa = self._pa
+        if self._writer is None:
+            if self.fieldnames is None:
+                extra = [k for k in records[0] if k not in DEFAULT_FIELDS]
+                self.fieldnames = DEFAULT_FIELDS + extra
+            schema = pa.schema([(name, pa.string()) for name in self.fieldnames])
+            self._writer = self._pq.ParquetWriter(self.path, schema, compression=self.compression)
+        columns = {
+            name: [None if r.get(name) is None else str(r.get(name)) for r in records]
+            for name in self.fieldnames
+        }
+        self._writer.write_table(pa.table(columns, schema=self._writer.schema), row_group_size=len(records))
+
+    def _finish(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+EXPORTERS = {
+    'json': JsonExporter,
+    'jsonl': JsonlExporter,
+    'csv': CsvExporter,
+    'parquet': ParquetExporter,
+}
+
+
+def get_exporter(fmt, path, **kwargs):
+    """Create the exporter for an output format name"""
+    if fmt not in EXPORTERS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {', '.join(EXPORT_FORMATS)}")
+    return EXPORTERS[fmt](path, **kwargs)
@@ -0,0 +1,87 @@
+"""
+Shared page fetching for the scrapers.
+
+Every upstream GET a scraper makes goes through fetch(), which is the one
+place that applies the frontier's rate-limit hook, consults and feeds the
+per-domain circuit breaker, records timing, status, 429 and retry metrics,
+and keeps the pages that come back in the HTML archive.
+"""
+import logging
+
+import requests
+from urllib3.util.retry import Retry
+
+import metrics
+from blocking import BLOCK_STATUSES, BlockedPageError, breaker, domain_of, record_verdict, shell_reason
+from html_archive import archive_page
+
+logger = logging.getLogger(__name__)
+
+# Called with the URL before every request; crawl frontier workers set it to
+# wait for the per-site rate limit they share
+throttle = None
+
+
+class InstrumentedRetry(Retry):
+    """urllib3 Retry that counts every retry attempt per source"""
+
+    # urllib3 retries a 429 that carries Retry-After even when 429 is not in
+    # status_forcelist; leave 429s to fetch() and the circuit breaker
+    RETRY_AFTER_STATUS_CODES = frozenset({413, 503})
+
+    def __init__(self, *args, source='unknown', **kwargs):
+        self.source = source
+        super().__init__(*args, **kwargs)
+
+    def new(self, **kwargs):
+        kwargs.setdefault('source', self.source)
+        return super().new(**kwargs)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        metrics.HTTP_RETRIES.labels(source=self.source).inc()
+        if response is not None and response.status == 429:
+            metrics.HTTP_RATE_LIMITED.labels(source=self.source).inc()
+        logger.debug("Retrying %s (%s)", url, response.status if response is not None else error)
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+def fetch(url, source, city='', session=None, result_page=False, **kwargs):
+    """GET url for a scraper, recording fetch time and the response status
+
+    Raises CircuitOpenError while the domain's breaker is open. With
+    result_page=True a 200 response with a challenge title, or too small to
+    hold results, is reported to the breaker and raised as BlockedPageError
+    before anybody spends time parsing it. Other result pages are reported
+    by the caller with check_result_page() once their cards are counted.
+    """
+    domain = domain_of(url)
+    breaker.before_request(domain)
+    if throttle is not None:
+        throttle(url)
+    client = session or requests
+    try:
+        with metrics.timed('fetch', source, city):
+            response = client.get(url, **kwargs)
+    except Exception:
+        breaker.record_error(domain)
+        raise
+    metrics.HTTP_RESPONSES.labels(source=source, status=response.status_code).inc()
+    if response.status_code == 429:
+        metrics.HTTP_RATE_LIMITED.labels(source=source).inc()
+
+    if response.status_code in BLOCK_STATUSES:
+        breaker.record_block(domain, f"HTTP {response.status_code}")
+    elif result_page and response.status_code == 200:
+        reason = shell_reason(response.text)
+        if reason:
+            breaker.record_block(domain, reason)
+            record_verdict(source, 'blocked')
+            raise BlockedPageError(url, reason)
+    elif response.status_code < 400:
+        breaker.record_success(domain)
+    else:
+        breaker.record_error(domain)
+
+    if response.status_code == 200:
+        archive_page(url, response.text, source, city, 'result' if result_page else 'detail')
+    return response
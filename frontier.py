@@ -0,0 +1,526 @@
+"""
+Distributed crawl frontier.
+
+A crawl job is split into (source, city, page) tasks held in a shared
+backend. Workers on any number of machines lease tasks, crawl them, and
+write the properties back; results are merged into one output at the end.
+
+- Leases expire, so a task held by a dead worker is handed out again.
+- Tasks are sharded by (source, city). A worker drains its home shard
+  first and then steals from whichever shard has the largest backlog.
+- Each site has a global token-bucket rate limit kept in the backend,
+  shared by every worker and taken for every request a task makes.
+- A page that is blocked or fails to load is retried up to MAX_ATTEMPTS
+  times before its task is marked failed.
+
+Backends are pluggable: SQLiteBackend (a file on local or shared disk) and
+RedisBackend (any Redis-compatible server, needs pip install redis).
+
+    python frontier.py --db crawl.db submit --source zameen --city Lahore --city Karachi --pages 10
+    python frontier.py --db crawl.db worker --job <job id>
+    python frontier.py --db crawl.db results --job <job id> --format jsonl --output merged.jsonl
+"""
+import argparse
+import functools
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARDS = 8
+DEFAULT_LEASE_SECONDS = 120
+MAX_ATTEMPTS = 3
+
+# Requests per second and burst size allowed per site across all workers
+DOMAIN_RATE_LIMITS = {
+    'www.zameen.com': (0.5, 2),
+    'www.property1.pk': (0.3, 1),
+    'www.olx.com.pk': (0.2, 1),
+}
+
+SOURCE_DOMAINS = {
+    'zameen': 'www.zameen.com',
+    'property1': 'www.property1.pk',
+    'olx': 'www.olx.com.pk',
+}
+
+
+def get_scraper(source):
+    """Page scraper for a source that raises on failed pages, imported lazily so the frontier loads without bs4"""
+    if source == 'zameen':
+        from zameen_scraper import scrape_zameen_city
+        return functools.partial(scrape_zameen_city, raise_errors=True)
+    if source == 'property1':
+        from property1_scraper import scrape_property1_city
+        return functools.partial(scrape_property1_city, raise_errors=True)
+    if source == 'olx':
+        from olx_scraper import scrape_olx_city
+        return functools.partial(scrape_olx_city, raise_errors=True)
+    raise ValueError(f"Unknown source '{source}'")
+
+
+def task_id(source, city, page):
+    return f"{source}:{city}:{page}"
+
+
+def shard_for(source, city, shards=DEFAULT_SHARDS):
+    digest = hashlib.md5(f"{source}:{city}".encode('utf-8')).hexdigest()
+    return int(digest, 16) % shards
+
+
+class Task:
+    def __init__(self, job, source, city, page, attempts=0):
+        self.job = job
+        self.source = source
+        self.city = city
+        self.page = int(page)
+        self.attempts = attempts
+
+    @property
+    def id(self):
+        return task_id(self.source, self.city, self.page)
+
+    def __repr__(self):
+        return f"Task({self.job}, {self.id})"
+
+
+class FrontierBackend:
+    """Interface every frontier backend implements"""
+
+    shards = DEFAULT_SHARDS
+
+    def add_tasks(self, job, units):
+        """Queue (source, city, page) units for a job; already-known units are ignored"""
+        raise NotImplementedError
+
+    def lease(self, job, worker, lease_seconds, home_shard=None):
+        """Lease one runnable task, preferring home_shard and stealing otherwise; None if nothing is runnable"""
+        raise NotImplementedError
+
+    def renew(self, job, task, worker, lease_seconds):
+        raise NotImplementedError
+
+    def complete(self, job, task, worker, properties):
+        """Store a task's result; returns False if worker no longer holds its lease"""
+        raise NotImplementedError
+
+    def fail(self, job, task, worker, error):
+        raise NotImplementedError
+
+    def acquire_rate_token(self, domain, rate, burst):
+        """Take one token from a domain's bucket; return 0 if granted, else seconds to wait"""
+        raise NotImplementedError
+
+    def status(self, job):
+        """Counts of tasks per state"""
+        raise NotImplementedError
+
+    def results(self, job):
+        """[(source, city, page, properties)] for every completed task"""
+        raise NotImplementedError
+
+
+class SQLiteBackend(FrontierBackend):
+    """Frontier stored in a SQLite file; safe for many worker processes on one machine or shared disk"""
+
+    def __init__(self, path, shards=DEFAULT_SHARDS):
+        self.path = path
+        self.shards = shards
+        self._local = threading.local()
+        with self._transaction() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    job TEXT, id TEXT, source TEXT, city TEXT, page INTEGER, shard INTEGER,
+                    state TEXT DEFAULT 'pending', worker TEXT, lease_expires REAL,
+                    attempts INTEGER DEFAULT 0, result TEXT, error TEXT,
+                    PRIMARY KEY (job, id))
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS tasks_runnable ON tasks (job, state, shard)")
+            db.execute("CREATE TABLE IF NOT EXISTS rate_limits (domain TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    class _Transaction:
+        def __init__(self, db):
+            self.db = db
+
+        def __enter__(self):
+            self.db.execute('BEGIN IMMEDIATE')
+            return self.db
+
+        def __exit__(self, exc_type, exc, tb):
+            self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+    def _transaction(self):
+        return self._Transaction(self._db())
+
+    def add_tasks(self, job, units):
+        rows = [(job, task_id(s, c, p), s, c, int(p), shard_for(s, c, self.shards)) for s, c, p in units]
+        with self._transaction() as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO tasks (job, id, source, city, page, shard) VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def lease(self, job, worker, lease_seconds, home_shard=None):
+        now = time.time()
+        runnable = "job = ? AND (state = 'pending' OR (state = 'leased' AND lease_expires < ?))"
+        with self._transaction() as db:
+            row = None
+            if home_shard is not None:
+                row = db.execute(
+                    f"SELECT id, source, city, page, attempts FROM tasks WHERE {runnable} AND shard = ? "
+                    "ORDER BY page, id LIMIT 1", (job, now, home_shard)).fetchone()
+            if row is None:
+                # Steal from the shard with the largest backlog
+                busiest = db.execute(
+                    f"SELECT shard FROM tasks WHERE {runnable} GROUP BY shard ORDER BY COUNT(*) DESC LIMIT 1",
+                    (job, now)).fetchone()
+                if busiest is None:
+                    return None
+                row = db.execute(
+                    f"SELECT id, source, city, page, attempts FROM tasks WHERE {runnable} AND shard = ? "
+                    "ORDER BY page, id LIMIT 1", (job, now, busiest[0])).fetchone()
+            tid, source, city, page, attempts = row
+            db.execute(
+                "UPDATE tasks SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE job = ? AND id = ?", (worker, now + lease_seconds, job, tid))
+        return Task(job, source, city, page, attempts + 1)
+
+    def renew(self, job, task, worker, lease_seconds):
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE job = ? AND id = ? AND worker = ? AND state = 'leased'",
+                (time.time() + lease_seconds, job, task.id, worker))
+            return cursor.rowcount == 1
+
+    def complete(self, job, task, worker, properties):
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE tasks SET state = 'done', result = ?, error = NULL "
+                "WHERE job = ? AND id = ? AND worker = ? AND state = 'leased'",
+                (json.dumps(properties, ensure_ascii=False), job, task.id, worker))
+            return cursor.rowcount == 1
+
+    def fail(self, job, task, worker, error):
+        state = 'failed' if task.attempts >= MAX_ATTEMPTS else 'pending'
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE tasks SET state = ?, error = ?, worker = NULL, lease_expires = NULL "
+                "WHERE job = ? AND id = ? AND worker = ? AND state = 'leased'",
+                (state, str(error), job, task.id, worker))
+
+    def acquire_rate_token(self, domain, rate, burst):
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute("SELECT tokens, updated FROM rate_limits WHERE domain = ?", (domain,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            db.execute("INSERT OR REPLACE INTO rate_limits (domain, tokens, updated) VALUES (?, ?, ?)",
+                       (domain, tokens, now))
+        return wait
+
+    def status(self, job):
+        rows = self._db().execute("SELECT state, COUNT(*) FROM tasks WHERE job = ? GROUP BY state", (job,))
+        return dict(rows.fetchall())
+
+    def results(self, job):
+        rows = self._db().execute(
+            "SELECT source, city, page, result FROM tasks WHERE job = ? AND state = 'done' "
+            "ORDER BY source, city, page", (job,))
+        return [(source, city, page, json.loads(result)) for source, city, page, result in rows]
+
+
+class RedisBackend(FrontierBackend):
+    """Frontier stored in Redis or any server speaking its protocol"""
+
+    def __init__(self, url='redis://localhost:6379/0', shards=DEFAULT_SHARDS, client=None, prefix='frontier'):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("RedisBackend needs redis-py: pip install redis")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.shards = shards
+        self.prefix = prefix
+        self._rate_token = None
+
+    def _key(self, job, *parts):
+        return ':'.join((self.prefix, job) + tuple(str(p) for p in parts))
+
+    def add_tasks(self, job, units):
+        pipe = self.redis.pipeline()
+        for source, city, page in units:
+            tid = task_id(source, city, page)
+            pipe.hsetnx(self._key(job, 'state'), tid, 'pending')
+        added = pipe.execute()
+        pipe = self.redis.pipeline()
+        for (source, city, page), is_new in zip(units, added):
+            if is_new:
+                tid = task_id(source, city, page)
+                pipe.hset(self._key(job, 'task', tid), mapping={
+                    'source': source, 'city': city, 'page': int(page), 'attempts': 0})
+                pipe.rpush(self._key(job, 'pending', shard_for(source, city, self.shards)), tid)
+        pipe.execute()
+
+    def _reclaim_expired(self, job):
+        """Put tasks whose lease ran out back on their shard queue"""
+        now = time.time()
+        for tid in self.redis.zrangebyscore(self._key(job, 'leased'), 0, now):
+            if self.redis.zrem(self._key(job, 'leased'), tid):
+                source, city, _ = tid.split(':', 2)
+                self.redis.hset(self._key(job, 'state'), tid, 'pending')
+                self.redis.rpush(self._key(job, 'pending', shard_for(source, city, self.shards)), tid)
+
+    def lease(self, job, worker, lease_seconds, home_shard=None):
+        self._reclaim_expired(job)
+        order = list(range(self.shards))
+        if home_shard is not None:
+            order.remove(home_shard)
+            # Steal from the longest queues first
+            order.sort(key=lambda s: -self.redis.llen(self._key(job, 'pending', s)))
+            order.insert(0, home_shard)
+        for shard in order:
+            tid = self.redis.lpop(self._key(job, 'pending', shard))
+            if tid is None:
+                continue
+            task_key = self._key(job, 'task', tid)
+            attempts = self.redis.hincrby(task_key, 'attempts', 1)
+            self.redis.hset(task_key, 'worker', worker)
+            self.redis.hset(self._key(job, 'state'), tid, 'leased')
+            self.redis.zadd(self._key(job, 'leased'), {tid: time.time() + lease_seconds})
+            data = self.redis.hgetall(task_key)
+            return Task(job, data['source'], data['city'], data['page'], attempts)
+        return None
+
+    def renew(self, job, task, worker, lease_seconds):
+        if self.redis.hget(self._key(job, 'task', task.id), 'worker') != worker:
+            return False
+        return bool(self.redis.zadd(self._key(job, 'leased'), {task.id: time.time() + lease_seconds}, xx=True, ch=True))
+
+    def _release_lease(self, job, task, worker):
+        """Drop worker's lease on task; False if the lease has expired or passed to another worker"""
+        if self.redis.hget(self._key(job, 'task', task.id), 'worker') != worker:
+            return False
+        return bool(self.redis.zrem(self._key(job, 'leased'), task.id))
+
+    def complete(self, job, task, worker, properties):
+        if not self._release_lease(job, task, worker):
+            return False
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key(job, 'task', task.id), 'result', json.dumps(properties, ensure_ascii=False))
+        pipe.hset(self._key(job, 'state'), task.id, 'done')
+        pipe.execute()
+        return True
+
+    def fail(self, job, task, worker, error):
+        if not self._release_lease(job, task, worker):
+            return
+        self.redis.hset(self._key(job, 'task', task.id), 'error', str(error))
+        if task.attempts >= MAX_ATTEMPTS:
+            self.redis.hset(self._key(job, 'state'), task.id, 'failed')
+        else:
+            self.redis.hset(self._key(job, 'state'), task.id, 'pending')
+            self.redis.rpush(self._key(job, 'pending', shard_for(task.source, task.city, self.shards)), task.id)
+
+    # The SQLite backend's refill bucket, run atomically on the server. The
+    # wait comes back as a string because Redis truncates Lua numbers to integers.
+    RATE_TOKEN_SCRIPT = """
+    local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = burst
+    if bucket[1] then
+        tokens = math.min(burst, tonumber(bucket[1]) + math.max(0, now - tonumber(bucket[2])) * rate)
+    end
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', string.format('%.17g', tokens), 'updated', string.format('%.17g', now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+    return string.format('%.17g', wait)
+    """
+
+    def acquire_rate_token(self, domain, rate, burst):
+        if self._rate_token is None:
+            self._rate_token = self.redis.register_script(self.RATE_TOKEN_SCRIPT)
+        wait = self._rate_token(keys=[f"{self.prefix}:rate:{domain}"], args=[rate, burst, repr(time.time())])
+        return float(wait)
+
+    def status(self, job):
+        counts = {}
+        for state in self.redis.hvals(self._key(job, 'state')):
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    def results(self, job):
+        done = [tid for tid, state in self.redis.hgetall(self._key(job, 'state')).items() if state == 'done']
+        rows = []
+        for tid in done:
+            data = self.redis.hgetall(self._key(job, 'task', tid))
+            rows.append((data['source'], data['city'], int(data['page']), json.loads(data['result'])))
+        return sorted(rows, key=lambda row: row[:3])
+
+
+class Worker:
+    """Leases tasks from a frontier and crawls them until the job has nothing runnable"""
+
+    def __init__(self, backend, worker_id=None, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 rate_limits=None, scraper_for=get_scraper):
+        self.backend = backend
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.rate_limits = DOMAIN_RATE_LIMITS if rate_limits is None else rate_limits
+        self.scraper_for = scraper_for
+        self.home_shard = int(hashlib.md5(self.worker_id.encode('utf-8')).hexdigest(), 16) % backend.shards
+        self.completed = 0
+
+    def _wait_for_rate_limit(self, url):
+        """fetching.throttle hook: take a token from the URL's site bucket, sleeping until one is free"""
+        domain = urlsplit(url).netloc.lower()
+        if domain not in self.rate_limits:
+            return
+        rate, burst = self.rate_limits[domain]
+        while True:
+            wait = self.backend.acquire_rate_token(domain, rate, burst)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def _heartbeat(self, job, task, stop):
+        while not stop.wait(self.lease_seconds / 3):
+            if not self.backend.renew(job, task, self.worker_id, self.lease_seconds):
+                logger.warning("Lost lease on %s", task)
+                return
+
+    def run_task(self, job, task):
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, task, stop), daemon=True)
+        heartbeat.start()
+        try:
+            properties = self.scraper_for(task.source)(task.city, 1, start_page=task.page)
+            if self.backend.complete(job, task, self.worker_id, properties):
+                self.completed += 1
+                logger.info("✅ %s done: %d properties", task, len(properties))
+            else:
+                logger.warning("⏱️ Lease on %s expired before it finished; result dropped", task)
+        except Exception as e:
+            logger.error("❌ %s failed: %s", task, e)
+            self.backend.fail(job, task, self.worker_id, e)
+        finally:
+            stop.set()
+
+    def run(self, job, idle_timeout=5.0, poll_interval=1.0):
+        """Crawl until no task has been runnable for idle_timeout seconds"""
+        import fetching
+        previous_throttle, fetching.throttle = fetching.throttle, self._wait_for_rate_limit
+        try:
+            idle_since = None
+            while True:
+                task = self.backend.lease(job, self.worker_id, self.lease_seconds, self.home_shard)
+                if task is None:
+                    idle_since = idle_since or time.monotonic()
+                    if time.monotonic() - idle_since >= idle_timeout:
+                        return self.completed
+                    time.sleep(poll_interval)
+                    continue
+                idle_since = None
+                self.run_task(job, task)
+        finally:
+            fetching.throttle = previous_throttle
+
+
+def submit_crawl(backend, sources, cities, pages, job=None):
+    """Split a crawl into (source, city, page) tasks; return the job id"""
+    job = job or uuid.uuid4().hex[:12]
+    units = [(source, city, page) for source in sources for city in cities for page in range(1, pages + 1)]
+    backend.add_tasks(job, units)
+    return job
+
+
+def merge_results(backend, job):
+    """All completed pages merged into one list, ordered by source, city and page, without duplicate URLs"""
+    merged = []
+    seen_urls = set()
+    for source, city, page, properties in backend.results(job):
+        for prop in properties:
+            url = prop.get('url')
+            if url and url in seen_urls:
+                continue
+            if url:
+                seen_urls.add(url)
+            merged.append(prop)
+    return merged
+
+
+def open_backend(args):
+    if args.redis:
+        return RedisBackend(args.redis, shards=args.shards)
+    return SQLiteBackend(args.db, shards=args.shards)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Distributed crawl frontier')
+    parser.add_argument('--db', default='frontier.db', help='SQLite frontier file')
+    parser.add_argument('--redis', help='Redis URL; overrides --db')
+    parser.add_argument('--shards', type=int, default=DEFAULT_SHARDS)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit = commands.add_parser('submit', help='queue a crawl job')
+    submit.add_argument('--source', action='append', required=True, choices=sorted(SOURCE_DOMAINS))
+    submit.add_argument('--city', action='append', required=True)
+    submit.add_argument('--pages', type=int, default=1)
+    submit.add_argument('--job', help='job id (default: random)')
+
+    worker = commands.add_parser('worker', help='crawl tasks of a job')
+    worker.add_argument('--job', required=True)
+    worker.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS, help='lease length in seconds')
+    worker.add_argument('--idle-timeout', type=float, default=30, help='exit after this long with nothing to do')
+
+    status = commands.add_parser('status', help='show task counts of a job')
+    status.add_argument('--job', required=True)
+
+    results = commands.add_parser('results', help='merge the results of a job into one file')
+    results.add_argument('--job', required=True)
+    results.add_argument('--format', default='jsonl', help='json, jsonl, csv or parquet')
+    results.add_argument('--output', required=True)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    backend = open_backend(args)
+
+    if args.command == 'submit':
+        job = submit_crawl(backend, args.source, args.city, args.pages, args.job)
+        print(job)
+    elif args.command == 'worker':
+        done = Worker(backend, lease_seconds=args.lease).run(args.job, idle_timeout=args.idle_timeout)
+        print(f"Worker finished {done} tasks")
+    elif args.command == 'status':
+        print(json.dumps(backend.status(args.job)))
+    elif args.command == 'results':
+        from exporters import get_exporter
+        with get_exporter(args.format, args.output) as exporter:
+            exporter.write_many(merge_results(backend, args.job))
+
+
+if __name__ == "__main__":
+    main()
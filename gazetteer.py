@@ -0,0 +1,390 @@
+"""
+Built-in gazetteer of localities for the cities we scrape.
+
+Every society, phase, sector and block below gets a canonical id such as
+'lahore/dha-phase-6' or 'islamabad/g-11'. match_locality() finds the most
+specific locality named in a piece of text with an Aho-Corasick automaton
+over all names and spellings, in one pass over the text: "D.H.A. Phase VI,
+Lahore", "Defence Phase 6" and "DHA Phase-6" all come back as
+'lahore/dha-phase-6'.
+
+Text is normalized on the fly (lowercased, dots and apostrophes dropped,
+other punctuation turned into single spaces), and names only match whole
+words. When several localities are named, a subdivision (a phase, sector
+or block) beats a locality without a parent, so "Askari 10, Lahore Cantt"
+is Askari 10 even though "Lahore Cantt" is the longer name. Among matches
+of the same depth the longest name wins, and after that the first one in
+the text.
+"""
+import re
+import threading
+from collections import namedtuple
+
+Locality = namedtuple('Locality', 'id name city parent')
+
+_ROMAN = ['i', 'ii', 'iii', 'iv', 'v', 'vi', 'vii', 'viii', 'ix', 'x', 'xi', 'xii', 'xiii', 'xiv', 'xv']
+
+
+def _numbers(first, last):
+    return [str(n) for n in range(first, last + 1)]
+
+
+def _letters(first, last):
+    return [chr(c) for c in range(ord(first), ord(last) + 1)]
+
+
+# city -> [(name, aliases, [(subdivision word, labels), ...])]
+# An empty subdivision word means the label follows the name directly ("Gulberg 3").
+LOCALITY_SPECS = {
+    'Lahore': [
+        ('DHA', ['Defence', 'DHA Lahore', 'Defence Housing Authority', 'DHA Defence'],
+         [('Phase', _numbers(1, 13))]),
+        ('DHA 9 Town', ['DHA Phase 9 Town'], []),
+        ('DHA 9 Prism', ['DHA Phase 9 Prism'], []),
+        ('DHA Rahbar', ['Rahbar'], [('Phase', _numbers(1, 4))]),
+        ('Bahria Town', ['Bahria'], [('Sector', _letters('A', 'F'))]),
+        ('Bahria Orchard', [], [('Phase', _numbers(1, 4))]),
+        ('Gulberg', [], [('', _numbers(1, 5))]),
+        ('Johar Town', ['Joher Town'], [('Phase', _numbers(1, 2)), ('Block', _letters('A', 'R'))]),
+        ('Model Town', [], [('Block', _letters('A', 'Q'))]),
+        ('Wapda Town', [], [('Phase', _numbers(1, 2))]),
+        ('Askari', [], [('', _numbers(1, 11))]),
+        ('Allama Iqbal Town', ['Iqbal Town'], []),
+        ('Valencia', ['Valencia Town', 'Valencia Housing Society'], []),
+        ('Lake City', [], []),
+        ('Cantt', ['Cantonment', 'Lahore Cantt'], []),
+        ('Garden Town', [], []),
+        ('Faisal Town', [], []),
+        ('Township', [], []),
+        ('Sabzazar', [], []),
+        ('Samanabad', [], []),
+        ('Shadman', [], []),
+        ('Cavalry Ground', [], []),
+        ('State Life Housing Society', ['State Life'], []),
+        ('EME Society', ['EME'], []),
+        ('Paragon City', [], []),
+        ('Park View City', [], []),
+        ('Al Rehman Garden', ['Al-Rehman Garden'], []),
+        ('Central Park Housing Scheme', ['Central Park'], []),
+        ('Formanites Housing Scheme', ['Formanites'], []),
+        ('Punjab Coop Housing Society', ['Punjab Cooperative Housing Society'], []),
+        ('NESPAK Housing Scheme', ['NESPAK'], []),
+        ('Sukh Chayn Gardens', ['Sukh Chain Gardens'], []),
+        ('Canal Garden', [], []),
+        ('Eden', ['Eden City', 'Eden Villas'], []),
+        ('Raiwind Road', [], []),
+        ('Bedian Road', [], []),
+        ('Thokar Niaz Baig', [], []),
+        ('Military Accounts Housing Society', ['Military Accounts'], []),
+        ('Marghzar Officers Colony', ['Marghzar'], []),
+        ('Gulshan-e-Ravi', ['Gulshan Ravi'], []),
+        ('Shalimar', [], []),
+        ('Ichhra', [], []),
+        ('Mughalpura', [], []),
+        ('Harbanspura', [], []),
+        ('Green City', [], []),
+        ('Bankers Town', ['Bankers Co-operative Housing Society'], []),
+        ('Izmir Town', [], []),
+        ('Architects Engineers Housing Society', ['Architects Engineers'], []),
+        ('Gulshan-e-Lahore', [], []),
+        ('Mustafa Town', [], []),
+        ('Wahdat Road', [], []),
+        ('Multan Road', [], []),
+        ('Ferozepur Road', [], []),
+    ],
+    'Karachi': [
+        ('DHA', ['Defence', 'DHA Karachi', 'Defence Housing Authority', 'DHA Defence'],
+         [('Phase', _numbers(1, 8))]),
+        ('DHA City', ['DHA City Karachi', 'DCK'], []),
+        ('Clifton', [], [('Block', _numbers(1, 9))]),
+        ('Bahria Town', ['Bahria Town Karachi', 'Bahria'], [('Precinct', _numbers(1, 60))]),
+        ('Gulshan-e-Iqbal', ['Gulshan Iqbal', 'Gulshan e Iqbal Town'], [('Block', _numbers(1, 19))]),
+        ('Gulistan-e-Johar', ['Gulistan Johar', 'Gulistan-e-Jauhar', 'Gulistan e Jauhar'],
+         [('Block', _numbers(1, 20))]),
+        ('North Nazimabad', [], [('Block', _letters('A', 'T'))]),
+        ('Nazimabad', [], [('', _numbers(1, 7))]),
+        ('PECHS', ['P E C H S'], [('Block', _numbers(2, 6))]),
+        ('Federal B Area', ['FB Area', 'F B Area'], [('Block', _numbers(1, 22))]),
+        ('Scheme 33', ['KDA Scheme 33'], []),
+        ('Scheme 45', ['KDA Scheme 45'], []),
+        ('KDA Scheme 1', [], []),
+        ('Malir', ['Malir Cantt', 'Malir Cantonment'], []),
+        ('Korangi', [], []),
+        ('Saddar', [], []),
+        ('Shahra-e-Faisal', ['Shahrah-e-Faisal', 'Shara e Faisal'], []),
+        ('Tariq Road', [], []),
+        ('Defence View', [], []),
+        ('Bath Island', [], []),
+        ('Gizri', [], []),
+        ('Surjani Town', [], []),
+        ('North Karachi', [], []),
+        ('New Karachi', [], []),
+        ('Naya Nazimabad', [], []),
+        ('Navy Housing Scheme Karsaz', ['Navy Housing Scheme'], []),
+        ('Karsaz', [], []),
+        ('Askari', [], [('', _numbers(1, 5))]),
+        ('Falcon Complex', [], []),
+        ('Shah Faisal Colony', ['Shah Faisal Town'], []),
+        ('Landhi', [], []),
+        ('Orangi Town', ['Orangi'], []),
+        ('Lyari', [], []),
+        ('Garden West', [], []),
+        ('Garden East', [], []),
+        ('Gulshan-e-Maymar', ['Gulshan e Maymar'], []),
+        ('Bufferzone', ['Buffer Zone'], []),
+        ('Gulberg Town', [], []),
+        ('Jamshed Town', [], []),
+        ('Cantt', ['Karachi Cantt', 'Cantonment'], []),
+        ('Sea View', ['Seaview'], []),
+        ('Zamzama', [], []),
+        ('Saadi Town', [], []),
+        ('Scheme 36', [], []),
+    ],
+    'Islamabad': [
+        ('DHA', ['Defence', 'DHA Islamabad', 'DHA Defence', 'Defence Housing Authority'],
+         [('Phase', _numbers(1, 5))]),
+        ('DHA Valley', [], []),
+        ('Bahria Town', ['Bahria Town Islamabad', 'Bahria'], [('Phase', _numbers(1, 8))]),
+        ('Bahria Enclave', [], [('Sector', _letters('A', 'N'))]),
+        ('Gulberg Greens', [], []),
+        ('Gulberg Residencia', [], []),
+        ('Blue Area', ['Jinnah Avenue'], []),
+        ('Diplomatic Enclave', [], []),
+        ('Bani Gala', ['Bani Gala Road'], []),
+        ('Chak Shahzad', [], []),
+        ('Park Enclave', [], []),
+        ('Naval Anchorage', [], []),
+        ('PWD Housing Scheme', ['PWD Society', 'PWD'], []),
+        ('Soan Garden', [], []),
+        ('Ghauri Town', [], []),
+        ('Korang Town', [], []),
+        ('Jinnah Garden', [], []),
+        ('Top City 1', ['Top City'], []),
+        ('Capital Smart City', [], []),
+        ('Faisal Town', ['F-18 Faisal Town'], []),
+        ('Kuri Road', [], []),
+        ('Shah Allah Ditta', [], []),
+        ('Tarlai', [], []),
+        ('Mumtaz City', [], []),
+        ('Multi Gardens', ['Multi Gardens B-17', 'MPCHS'], []),
+        ('Gulshan-e-Sehat', ['E-18 Gulshan-e-Sehat'], []),
+        ('Margalla Town', [], []),
+        ('National Police Foundation', ['Police Foundation'], []),
+        ('Islamabad Expressway', ['Expressway'], []),
+        ('Zaraj Housing Scheme', ['Zaraj'], []),
+        ('Eighteen Islamabad', ['ECHS Eighteen', 'Eighteen Society'], []),
+        ('Park View City', [], []),
+    ],
+    'Rawalpindi': [
+        ('Bahria Town', ['Bahria Town Rawalpindi', 'Bahria'], [('Phase', _numbers(1, 8))]),
+        ('Saddar', [], []),
+        ('Satellite Town', [], [('Block', _letters('A', 'F'))]),
+        ('Chaklala Scheme', [], [('', _numbers(1, 3))]),
+        ('Askari', [], [('', _numbers(1, 14))]),
+        ('Westridge', ['West Ridge'], [('', _numbers(1, 3))]),
+        ('Adiala Road', [], []),
+        ('Gulraiz Housing Scheme', ['Gulraiz'], []),
+        ('Media Town', [], []),
+        ('Gulistan Colony', [], []),
+        ('Dhok Kashmirian', [], []),
+        ('Peshawar Road', [], []),
+        ('Lalazar', ['Lalazaar'], []),
+        ('Chaklala', [], []),
+        ('Cantt', ['Rawalpindi Cantt', 'Cantonment'], []),
+        ('Shamsabad', [], []),
+        ('Muslim Town', [], []),
+        ('Khayaban-e-Sir Syed', ['Khayaban e Sir Syed'], []),
+        ('Airport Housing Society', [], [('Sector', _numbers(1, 4))]),
+        ('Gulshan Abad', ['Gulshanabad'], [('Sector', _numbers(1, 3))]),
+        ('Morgah', [], []),
+        ('Range Road', [], []),
+        ('Scheme 3', [], []),
+        ('Defence Road', [], []),
+        ('Ayub Park', [], []),
+        ('Tench Bhatta', [], []),
+        ('Kamalabad', [], []),
+        ('Chakri Road', [], []),
+        ('DHA', ['Defence', 'DHA Rawalpindi'], [('Phase', _numbers(1, 2))]),
+    ],
+}
+
+# Islamabad's grid sectors: E-7, F-10, G-11, ...
+ISLAMABAD_SECTORS = {
+    'B': _numbers(17, 18), 'C': _numbers(13, 19), 'D': _numbers(12, 18), 'E': _numbers(7, 18),
+    'F': _numbers(5, 18), 'G': _numbers(5, 17), 'H': _numbers(8, 17), 'I': _numbers(8, 18),
+}
+
+
+def slug(name):
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+
+def normalize(text):
+    """The form names are matched in: lowercase words separated by single spaces"""
+    return ' '.join(re.sub(r"[^a-z0-9]+", ' ', re.sub(r"[.'’]", '', text.lower())).split())
+
+
+def _spellings(names, word, label):
+    """Every way of writing "<name> <word> <label>" we expect to see"""
+    labels = [label]
+    if label.isdigit() and int(label) <= len(_ROMAN):
+        labels.append(_ROMAN[int(label) - 1])
+    for name in names:
+        for text in labels:
+            if word:
+                yield f"{name} {word} {text}"
+                yield f"{word} {text} {name}"
+            else:
+                yield f"{name} {text}"
+
+
+def _build_entries():
+    """[(Locality, [spellings])] for the whole gazetteer"""
+    entries = []
+    for city, specs in LOCALITY_SPECS.items():
+        city_slug = slug(city)
+        for name, aliases, subdivisions in specs:
+            names = [name] + aliases
+            parent_id = f"{city_slug}/{slug(name)}"
+            entries.append((Locality(parent_id, name, city, None), names))
+            for word, labels in subdivisions:
+                for label in labels:
+                    sub_name = f"{name} {word} {label}" if word else f"{name} {label}"
+                    locality = Locality(f"{city_slug}/{slug(sub_name)}", sub_name, city, parent_id)
+                    entries.append((locality, list(_spellings(names, word, label))))
+    for letter, numbers in ISLAMABAD_SECTORS.items():
+        for number in numbers:
+            name = f"{letter}-{number}"
+            locality = Locality(f"islamabad/{slug(name)}", name, 'Islamabad', None)
+            entries.append((locality, [name, f"{letter}{number}", f"Sector {name}"]))
+    return entries
+
+
+def _rank(length, locality):
+    """How specific a match is: subdivisions first, then longer spellings"""
+    return locality.parent is not None, length
+
+
+class LocalityMatcher:
+    """Aho-Corasick automaton over space-padded normalized spellings"""
+
+    def __init__(self, entries):
+        self.localities = {}
+        self._goto = [{}]
+        self._fail = [0]
+        # Per node: (length, locality) of every spelling ending here, best ranked first
+        self._out = [[]]
+        for locality, spellings in entries:
+            self.localities[locality.id] = locality
+            for spelling in spellings:
+                key = normalize(spelling)
+                if key:
+                    self._add(f" {key} ", locality)
+        self._link()
+
+    def _add(self, pattern, locality):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        if all(existing.id != locality.id for _, existing in self._out[node]):
+            self._out[node].append((len(pattern), locality))
+
+    def _link(self):
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for ch, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                # Spellings that are suffixes of this one end here too
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+                queue.append(child)
+        for out in self._out:
+            out.sort(key=lambda item: _rank(*item), reverse=True)
+
+    def match(self, text, city=None):
+        """The most specific Locality named in text (restricted to city when given), or None"""
+        if not text:
+            return None
+        city = city.strip().lower() if city else None
+        goto, fail, outputs = self._goto, self._fail, self._out
+        best = None
+        best_rank = (False, 0)
+        node = 0
+        previous = None
+
+        # Feed a leading space, the normalized text and a trailing space through the automaton
+        for ch in ' ' + text.lower() + ' ':
+            if ch in ".'’":
+                continue
+            if not ch.isalnum():
+                if previous == ' ':
+                    continue
+                ch = ' '
+            previous = ch
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for length, locality in outputs[node]:
+                rank = _rank(length, locality)
+                if rank <= best_rank:
+                    break
+                if city is None or locality.city.lower() == city:
+                    best, best_rank = locality, rank
+                    break
+        return best
+
+    def get(self, locality_id):
+        return self.localities.get(locality_id)
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def matcher():
+    """The gazetteer's automaton, built on first use"""
+    global _matcher
+    if _matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                _matcher = LocalityMatcher(_build_entries())
+    return _matcher
+
+
+def match_locality(text, city=None):
+    return matcher().match(text, city)
+
+
+def locality_id(text, city=None):
+    """Canonical locality id for text, or None if it names no known locality"""
+    locality = matcher().match(text, city)
+    return locality.id if locality else None
+
+
+def get_locality(locality_id):
+    return matcher().get(locality_id)
+
+
+def listing_locality_id(prop):
+    """Locality id of a scraped property, matched from its location if it was scraped without one"""
+    return prop.get('locality_id') or locality_id(prop.get('location'), prop.get('city'))
+
+
+def canonical_locality(value, city=None):
+    """Gazetteer id for a stored locality value, which may be location text saved before the gazetteer existed
+
+    Values that are already ids, or that name no known locality, come back unchanged.
+    """
+    if not value or get_locality(value):
+        return value
+    return locality_id(value, city) or value
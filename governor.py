@@ -0,0 +1,212 @@
+"""
+Process-wide limits on live crawls.
+
+Every crawl /scrape starts goes through the governor. At most a source's
+limit of crawls run against it at once; the rest wait their turn in a
+per-source FIFO queue. Identical crawls (same source, city, start page and
+number of pages) that are already running or queued are not started again:
+the later callers wait for the first one and get its result.
+
+A caller can pass a ticket (any string) with its crawl and look up where it
+stands with position() while it waits, which is how the web UI shows "3rd
+in line". state() is what /governor returns.
+
+Every source gets CRAWL_LIMIT slots (default DEFAULT_LIMIT); CRAWL_LIMITS
+overrides it per source, e.g. CRAWL_LIMITS=zameen=2,olx=1,property1=3.
+"""
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+import metrics
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 2
+# Crawls waiting per source before new ones are turned away
+MAX_QUEUE = 50
+QUEUE_TIMEOUT = 300
+
+CRAWLS = metrics.Counter('governor_crawls_total', 'Crawls requested through the governor',
+                         ['source', 'result'])
+QUEUE_WAIT = metrics.Histogram('governor_queue_wait_seconds', 'Time crawls waited for a free slot', ['source'])
+RUNNING = metrics.Gauge('governor_running_crawls', 'Crawls running per source', ['source'])
+QUEUED = metrics.Gauge('governor_queued_crawls', 'Crawls waiting for a slot per source', ['source'])
+
+
+class GovernorBusyError(Exception):
+    """The source's queue is full, or the crawl waited too long for a slot
+
+    queued is False when the crawl was turned away without queueing because
+    its caller passed wait=False.
+    """
+
+    def __init__(self, source, reason, queued=True):
+        self.source = source
+        self.queued = queued
+        super().__init__(f"Too many {source} crawls: {reason}")
+
+
+def parse_limits(text):
+    """{'zameen': 2, ...} from "zameen=2,olx=1" """
+    limits = {}
+    for item in (text or '').split(','):
+        if not item.strip():
+            continue
+        source, _, value = item.partition('=')
+        try:
+            limits[source.strip()] = max(int(value), 1)
+        except ValueError:
+            logger.warning("Ignoring crawl limit %r", item)
+    return limits
+
+
+class CrawlGovernor:
+    def __init__(self, limits=None, default_limit=DEFAULT_LIMIT, max_queue=MAX_QUEUE, queue_timeout=QUEUE_TIMEOUT):
+        self.limits = dict(limits or {})
+        self.default_limit = default_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._running = defaultdict(list)
+        self._queues = defaultdict(deque)
+        self._tickets = {}
+        self._flights = SingleFlight()
+        self._cond = threading.Condition()
+
+    def limit(self, source):
+        return self.limits.get(source, self.default_limit)
+
+    def _gauges(self, source):
+        RUNNING.labels(source=source).set(len(self._running[source]))
+        QUEUED.labels(source=source).set(len(self._queues[source]))
+
+    def _acquire(self, source, key, wait):
+        """Take a running slot for key, queueing for it; returns (queue position on arrival, seconds waited)"""
+        with self._cond:
+            running, queue = self._running[source], self._queues[source]
+            if len(running) < self.limit(source) and not queue:
+                running.append(key)
+                self._gauges(source)
+                return 0, 0.0
+            if not wait:
+                raise GovernorBusyError(source, f"all {self.limit(source)} slots are busy", queued=False)
+            if len(queue) >= self.max_queue:
+                raise GovernorBusyError(source, f"{len(queue)} crawls already queued")
+            queue.append(key)
+            position = len(queue)
+            self._gauges(source)
+            logger.info("🚦 %s queued at position %d", key, position)
+            started = time.time()
+            deadline = started + self.queue_timeout
+            try:
+                while queue[0] != key or len(running) >= self.limit(source):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise GovernorBusyError(source, f"no slot within {self.queue_timeout}s")
+                    self._cond.wait(remaining)
+            except BaseException:
+                queue.remove(key)
+                self._gauges(source)
+                self._cond.notify_all()
+                raise
+            queue.popleft()
+            running.append(key)
+            self._gauges(source)
+            # The next in line may fit too if the limit was raised
+            self._cond.notify_all()
+        waited = time.time() - started
+        QUEUE_WAIT.labels(source=source).observe(waited)
+        return position, waited
+
+    def _release(self, source, key):
+        with self._cond:
+            self._running[source].remove(key)
+            self._gauges(source)
+            self._cond.notify_all()
+
+    def _crawl(self, source, key, wait, func, args, kwargs):
+        position, waited = self._acquire(source, key, wait)
+        try:
+            return func(*args, **kwargs), position, waited
+        finally:
+            self._release(source, key)
+
+    def run(self, source, key, func, *args, ticket=None, wait=True, **kwargs):
+        """func(*args, **kwargs) under source's limit, shared with identical crawls; returns (result, info)
+
+        key identifies the crawl, e.g. (source, city, start_page, pages).
+        info says whether the result was shared with a crawl already in
+        flight, the crawl's place in the queue when it arrived (0 if it
+        started right away) and how long it waited. With wait=False a busy
+        source raises GovernorBusyError instead of queueing.
+
+        wait applies to each caller, not to the flight it joins: a caller
+        willing to wait that joined a crawl turned away for not waiting
+        starts it again itself.
+        """
+        if ticket:
+            with self._cond:
+                self._tickets[ticket] = (source, key)
+        try:
+            while True:
+                try:
+                    (result, position, waited), shared = self._flights.do(
+                        key, self._crawl, source, key, wait, func, args, kwargs)
+                    break
+                except GovernorBusyError as e:
+                    if wait and not e.queued:
+                        continue
+                    CRAWLS.labels(source=source, result='rejected').inc()
+                    raise
+        finally:
+            if ticket:
+                with self._cond:
+                    self._tickets.pop(ticket, None)
+        CRAWLS.labels(source=source, result='coalesced' if shared else 'crawled').inc()
+        return result, {'coalesced': shared, 'queue_position': position, 'queue_wait': round(waited, 2)}
+
+    def position(self, ticket):
+        """Where the crawl behind ticket stands, or None for an unknown or finished ticket"""
+        with self._cond:
+            entry = self._tickets.get(ticket)
+            if entry is None:
+                return None
+            source, key = entry
+            queue = self._queues[source]
+            if key in self._running[source]:
+                return {'state': 'running', 'source': source, 'position': 0}
+            if key in queue:
+                return {'state': 'queued', 'source': source, 'position': queue.index(key) + 1,
+                        'limit': self.limit(source)}
+            return {'state': 'starting', 'source': source, 'position': 0}
+
+    def state(self):
+        shared = self._flights.in_flight()
+        with self._cond:
+            sources = sorted(set(self._running) | set(self._queues) | set(self.limits))
+            return {
+                'default_limit': self.default_limit,
+                'max_queue': self.max_queue,
+                'queue_timeout': self.queue_timeout,
+                'sources': {
+                    source: {
+                        'limit': self.limit(source),
+                        'running': [
+                            {'crawl': list(key), 'waiters': shared.get(key, 0)} for key in self._running[source]
+                        ],
+                        'queued': [
+                            {'crawl': list(key), 'waiters': shared.get(key, 0)} for key in self._queues[source]
+                        ],
+                    }
+                    for source in sources
+                },
+            }
+
+
+governor = CrawlGovernor(
+    limits=parse_limits(os.environ.get('CRAWL_LIMITS')),
+    default_limit=int(os.environ.get('CRAWL_LIMIT', DEFAULT_LIMIT)),
+)
@@ -0,0 +1,307 @@
+"""
+Compressed, content-addressed archive of fetched pages, and offline re-parsing.
+
+With HTML_ARCHIVE_DIR set, fetch() stores every 200 page a scraper
+downloads: the HTML is compressed with zstd and written once under objects/
+by its SHA-256, and a line with the URL, source, city, kind ('result' or
+'detail') and fetch time goes to index.jsonl. Pages that come back
+unchanged share one object. Compression runs inside the crawl, so it uses a
+fast level; prune() drops pages older than a retention period.
+
+When a site's markup changes or an extractor is fixed, reparse() runs the
+scrapers' current parse_result_page() over the archived result pages on a
+process pool, so rebuilding a dataset is CPU work on local files instead
+of a new crawl. OLX images are filled in from archived property pages.
+
+    HTML_ARCHIVE_DIR=html_archive python app.py
+    python html_archive.py --source olx -o olx_rebuilt.jsonl
+    python html_archive.py --prune-days 30
+
+Needs zstandard (pip install zstandard). Archiving is off unless
+HTML_ARCHIVE_DIR is set.
+"""
+import argparse
+import hashlib
+import importlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from bs4 import BeautifulSoup
+
+import metrics
+from exporters import EXPORT_FORMATS, get_exporter
+from parsing import free_tree
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.environ.get('HTML_ARCHIVE_DIR', '')
+# Pages are compressed on the crawl's thread; level 3 is several times
+# faster than level 9 and compresses HTML nearly as well
+COMPRESSION_LEVEL = 3
+INDEX_FILE = 'index.jsonl'
+
+# parse_result_page() of each source's scraper module
+PARSERS = {
+    'zameen': 'zameen_scraper',
+    'property1': 'property1_scraper',
+    'olx': 'olx_scraper',
+}
+
+# The 'source' field the scrapers give their listings; Zameen's leave it out
+SOURCE_NAMES = {
+    'zameen': 'Zameen.com',
+    'property1': 'Property1.pk',
+    'olx': 'OLX.pk',
+}
+
+ARCHIVED_PAGES = metrics.Counter('html_archive_pages_total', 'Fetched pages stored in the HTML archive',
+                                 ['source', 'result'])
+ARCHIVED_BYTES = metrics.Counter('html_archive_bytes_total', 'Compressed bytes written to the HTML archive',
+                                 ['source'])
+
+_local = threading.local()
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("The HTML archive needs zstandard: pip install zstandard")
+
+
+def _compressor(level):
+    # zstd contexts are not thread-safe; keep one per thread
+    compressor = getattr(_local, 'compressor', None)
+    if compressor is None:
+        compressor = _local.compressor = zstandard.ZstdCompressor(level=level)
+    return compressor
+
+
+def _decompressor():
+    decompressor = getattr(_local, 'decompressor', None)
+    if decompressor is None:
+        decompressor = _local.decompressor = zstandard.ZstdDecompressor()
+    return decompressor
+
+
+def object_path(directory, digest):
+    return os.path.join(directory, 'objects', digest[:2], digest[2:] + '.zst')
+
+
+def load_page(directory, digest):
+    """HTML of an archived page"""
+    _require_zstandard()
+    with open(object_path(directory, digest), 'rb') as f:
+        return _decompressor().decompress(f.read()).decode('utf-8')
+
+
+def read_index(directory, source=None, kind=None, latest=True):
+    """Index entries, oldest first; with latest only the newest entry per URL"""
+    path = os.path.join(directory, INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+    entries = {} if latest else []
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning("Skipping unreadable archive index line %d in %s", line_number, path)
+                continue
+            if (source and entry['source'] != source) or (kind and entry['kind'] != kind):
+                continue
+            if latest:
+                entries.pop(entry['url'], None)
+                entries[entry['url']] = entry
+            else:
+                entries.append(entry)
+    return list(entries.values()) if latest else entries
+
+
+class HtmlArchive:
+    def __init__(self, directory, level=COMPRESSION_LEVEL):
+        _require_zstandard()
+        self.directory = directory
+        self.level = level
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        self._index = open(os.path.join(directory, INDEX_FILE), 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def store(self, url, html, source, city='', kind='result', ts=None):
+        """Archive one fetched page; returns its digest"""
+        data = html.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = object_path(self.directory, digest)
+        if os.path.exists(path):
+            ARCHIVED_PAGES.labels(source=source, result='duplicate').inc()
+        else:
+            blob = _compressor(self.level).compress(data)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp, path)
+            ARCHIVED_PAGES.labels(source=source, result='new').inc()
+            ARCHIVED_BYTES.labels(source=source).inc(len(blob))
+        entry = {'url': url, 'source': source, 'city': city, 'kind': kind,
+                 'ts': int(ts or time.time()), 'sha256': digest, 'size': len(data)}
+        with self._lock:
+            self._index.write(json.dumps(entry) + '\n')
+            self._index.flush()
+        return digest
+
+    def load(self, digest):
+        return load_page(self.directory, digest)
+
+    def entries(self, source=None, kind=None, latest=True):
+        return read_index(self.directory, source, kind, latest)
+
+    def prune(self, max_age_days):
+        """Forget pages fetched more than max_age_days ago; returns (entries dropped, objects deleted)
+
+        Objects still used by a newer entry are kept.
+        """
+        cutoff = time.time() - max_age_days * 86400
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        with self._lock:
+            self._index.close()
+            kept, dropped = [], 0
+            with open(index_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry['ts'] < cutoff:
+                        dropped += 1
+                    else:
+                        kept.append(entry)
+            tmp = index_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                for entry in kept:
+                    f.write(json.dumps(entry) + '\n')
+            os.replace(tmp, index_path)
+            self._index = open(index_path, 'a', encoding='utf-8')
+
+            live = {entry['sha256'] for entry in kept}
+            deleted = 0
+            objects = os.path.join(self.directory, 'objects')
+            for prefix in os.listdir(objects):
+                for name in os.listdir(os.path.join(objects, prefix)):
+                    if name.endswith('.zst') and prefix + name[:-4] not in live:
+                        os.remove(os.path.join(objects, prefix, name))
+                        deleted += 1
+        logger.info("🧹 Pruned %d archive entries and %d pages older than %g days", dropped, deleted, max_age_days)
+        return dropped, deleted
+
+    def close(self):
+        with self._lock:
+            self._index.close()
+
+
+archive = None
+if ARCHIVE_DIR:
+    try:
+        archive = HtmlArchive(ARCHIVE_DIR)
+    except RuntimeError as e:
+        logger.warning("HTML archive disabled: %s", e)
+
+
+def archive_page(url, html, source, city='', kind='result'):
+    """Store a fetched page if archiving is on; never fails the crawl"""
+    if archive is None:
+        return
+    try:
+        archive.store(url, html, source, city, kind)
+    except Exception:
+        logger.exception("Could not archive %s", url)
+
+
+def _parse_result_entry(directory, entry):
+    module = importlib.import_module(PARSERS[entry['source']])
+    properties = module.parse_result_page(load_page(directory, entry['sha256']), entry['city'])
+    for prop in properties:
+        prop.setdefault('source', SOURCE_NAMES[entry['source']])
+    return entry['ts'], properties
+
+
+def _parse_detail_entry(directory, entry):
+    olx = importlib.import_module(PARSERS['olx'])
+    soup = BeautifulSoup(load_page(directory, entry['sha256']), 'html.parser')
+    image = olx.find_detail_image(soup)
+    free_tree(soup)
+    return entry['url'], image
+
+
+def reparse(directory=ARCHIVE_DIR, source=None, city=None, workers=None):
+    """Rebuild listings from archived result pages on a process pool
+
+    Returns one property per listing URL, taken from the newest page that
+    has it. Every archived snapshot of a result page is parsed, so listings
+    that have since dropped off the site are kept too.
+    """
+    _require_zstandard()
+    entries = [e for e in read_index(directory, source, kind='result', latest=False)
+               if e['source'] in PARSERS and (not city or e['city'] == city)]
+    logger.info("🗃️ Re-parsing %d archived result pages with %s workers",
+                len(entries), workers or os.cpu_count())
+    started = time.time()
+    newest = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(1, len(entries) // ((workers or os.cpu_count() or 1) * 4))
+        for ts, properties in pool.map(partial(_parse_result_entry, directory), entries, chunksize=chunksize):
+            for prop in properties:
+                previous = newest.get(prop['url'])
+                if previous is None or ts >= previous[0]:
+                    newest[prop['url']] = (ts, prop)
+
+        # OLX result pages have no photos; take them from the archived property pages
+        details = [e for e in read_index(directory, 'olx', kind='detail')
+                   if e['url'] in newest and not newest[e['url']][1].get('image')]
+        for url, image in pool.map(partial(_parse_detail_entry, directory), details,
+                                   chunksize=max(1, chunksize)):
+            newest[url][1]['image'] = image
+
+    properties = [prop for _, prop in newest.values()]
+    logger.info("✅ Rebuilt %d listings from %d pages in %.1fs",
+                len(properties), len(entries), time.time() - started)
+    return properties
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild listings from the archived HTML without fetching')
+    parser.add_argument('--archive', default=ARCHIVE_DIR or 'html_archive', help='archive directory')
+    parser.add_argument('--source', choices=sorted(PARSERS), help='only this source')
+    parser.add_argument('--city', help='only this city')
+    parser.add_argument('--workers', type=int, default=None, help='parser processes (default: one per core)')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl', help='output format')
+    parser.add_argument('-o', '--output', default='rebuilt.jsonl', help='output file')
+    parser.add_argument('--prune-days', type=float,
+                        help='instead of re-parsing, drop pages fetched more than this many days ago')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if args.prune_days is not None:
+        target = archive if archive is not None and archive.directory == args.archive else HtmlArchive(args.archive)
+        target.prune(args.prune_days)
+        return
+    properties = reparse(args.archive, args.source, args.city, args.workers)
+    with get_exporter(args.format, args.output) as exporter:
+        exporter.write_many(properties)
+    logger.info("💾 Wrote %d listings to %s", len(properties), args.output)
+
+
+if __name__ == '__main__':
+    main()
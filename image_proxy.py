@@ -0,0 +1,411 @@
+"""
+Server-side image cache behind /image-proxy, and post-scrape cache warming.
+
+get_image() is the single way images are fetched: it answers from the cache,
+and concurrent misses for the same URL (a grid rendering, several users on
+the same city, the warmer racing the browser) share one upstream request.
+
+ImageCache keeps fetched image bytes in memory (LRU, bounded by total size,
+entries expire with the same 24 hour lifetime the proxy advertises to
+browsers). ImageWarmer takes the listings of a finished crawl, dedups their
+image URLs against each other, the cache and any warm already in progress,
+and fetches the rest concurrently with at most PER_HOST_CONCURRENCY
+requests per image host, so the grid the browser is about to render comes
+out of the cache.
+
+URLs that failed upstream go into a negative cache for NEGATIVE_TTL, so the
+proxy answers 404 for them at once instead of retrying a slow dead host.
+validate_images() checks a crawl's image URLs with concurrent HEAD requests
+right after extraction, for at most VALIDATE_BUDGET seconds a page, and
+drops (or swaps for an alternative) the ones that are definitely gone: a 404
+or 410, or a response that is not an image. Timeouts and 5xx keep the URL.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_TTL = 86400
+FETCH_TIMEOUT = 15
+WARM_WORKERS = 16
+PER_HOST_CONCURRENCY = 4
+NEGATIVE_TTL = 3600
+# Timeouts and 5xx may clear up soon, so they are only remembered briefly
+TRANSIENT_NEGATIVE_TTL = 120
+VALIDATED_TTL = 6 * 3600
+VALIDATE_TIMEOUT = 5
+# Longest a page's crawl waits on its image checks; later answers still feed the caches
+VALIDATE_BUDGET = 2
+VALIDATE_WORKERS = 16
+# Answers that mean the image is gone, not that its host is having a bad moment
+DEAD_STATUSES = (404, 410, 415)
+VALIDATE_IMAGES = os.environ.get('VALIDATE_IMAGES', '1') != '0'
+
+# Lazy-load stand-ins that are never the listing's real photo
+PLACEHOLDER_PATTERN = re.compile(r'^data:|placeholder|lazy[-_]?load|blank\.(gif|png)|spacer\.|/pixel\.|'
+                                 r'loading\.(gif|svg)|\.svg(\?|$)', re.I)
+
+IMAGE_CACHE_LOOKUPS = metrics.Counter('image_cache_lookups_total', 'Image proxy cache lookups', ['result'])
+IMAGE_CACHE_BYTES = metrics.Gauge('image_cache_bytes', 'Bytes of image data held by the proxy cache')
+IMAGES_WARMED = metrics.Counter('images_warmed_total', 'Images fetched ahead of the browser', ['outcome'])
+IMAGE_UPSTREAM_FETCHES = metrics.Counter('image_upstream_fetches_total', 'Upstream image requests', ['status'])
+IMAGE_COALESCED = metrics.Counter('image_requests_coalesced_total',
+                                  'Image requests that shared another request\'s upstream fetch')
+IMAGE_NEGATIVE_HITS = metrics.Counter('image_negative_cache_hits_total',
+                                      'Image requests answered 404 from the negative cache')
+IMAGES_VALIDATED = metrics.Counter('images_validated_total', 'Image URLs checked after extraction', ['outcome'])
+
+USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+              "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=32, pool_maxsize=32))
+session.mount('https://', HTTPAdapter(pool_connections=32, pool_maxsize=32))
+
+
+def referer_for(image_url):
+    """Referer the image host expects, based on its domain"""
+    if "zameen.com" in image_url:
+        return "https://www.zameen.com/"
+    if "property1.pk" in image_url:
+        return "https://www.property1.pk/"
+    if "olx.com.pk" in image_url:
+        return "https://www.olx.com.pk/"
+    return "https://www.google.com/"
+
+
+def request_headers(image_url):
+    return {
+        "User-Agent": USER_AGENT,
+        "Referer": referer_for(image_url),
+        "Accept": "image/webp,image/apng,image/*,*/*;q=0.8",
+        "Accept-Language": "en-US,en;q=0.9",
+        "Connection": "keep-alive",
+    }
+
+
+def fetch_image(image_url):
+    """GET an image upstream; returns (status_code, content, content_type)"""
+    try:
+        r = session.get(image_url, headers=request_headers(image_url), timeout=FETCH_TIMEOUT)
+    except Exception:
+        IMAGE_UPSTREAM_FETCHES.labels(status='error').inc()
+        raise
+    IMAGE_UPSTREAM_FETCHES.labels(status=str(r.status_code)).inc()
+    return r.status_code, r.content, r.headers.get("Content-Type", "image/jpeg")
+
+
+class ImageCache:
+    """LRU of (content, content_type) by URL, bounded by total bytes"""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None and entry[2] < time.time():
+                self._drop(url)
+                entry = None
+            if entry is None:
+                IMAGE_CACHE_LOOKUPS.labels(result='miss').inc()
+                return None
+            self._entries.move_to_end(url)
+        IMAGE_CACHE_LOOKUPS.labels(result='hit').inc()
+        return entry[0], entry[1]
+
+    def __contains__(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            return entry is not None and entry[2] >= time.time()
+
+    def put(self, url, content, content_type):
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            if url in self._entries:
+                self._drop(url)
+            self._entries[url] = (content, content_type, time.time() + self.ttl)
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+            IMAGE_CACHE_BYTES.set(self.size)
+
+    def _drop(self, url):
+        content = self._entries.pop(url)[0]
+        self.size -= len(content)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ExpiringSet:
+    """URLs remembered for ttl seconds, oldest forgotten first past max_size"""
+
+    def __init__(self, ttl, max_size=100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expires = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, url, ttl=None):
+        with self._lock:
+            self._expires.pop(url, None)
+            self._expires[url] = time.time() + (ttl or self.ttl)
+            while len(self._expires) > self.max_size:
+                self._expires.popitem(last=False)
+
+    def discard(self, url):
+        with self._lock:
+            self._expires.pop(url, None)
+
+    def __contains__(self, url):
+        with self._lock:
+            expires = self._expires.get(url)
+            if expires is None:
+                return False
+            if expires < time.time():
+                del self._expires[url]
+                return False
+            return True
+
+    def __len__(self):
+        return len(self._expires)
+
+
+cache = ImageCache()
+in_flight = SingleFlight()
+known_bad = ExpiringSet(NEGATIVE_TTL)
+known_good = ExpiringSet(VALIDATED_TTL)
+# The part of the negative cache validate_images() is allowed to drop images for
+known_dead = ExpiringSet(NEGATIVE_TTL)
+
+# What the proxy returns for a URL in the negative cache
+NOT_FOUND = (404, b'', None)
+
+
+def record_result(image_url, status):
+    """Remember an upstream outcome for the negative cache; status None means the request failed"""
+    if status == 200:
+        known_bad.discard(image_url)
+        known_dead.discard(image_url)
+        known_good.add(image_url)
+        return
+    if status in DEAD_STATUSES:
+        known_dead.add(image_url)
+    if status is None or status >= 500:
+        known_bad.add(image_url, TRANSIENT_NEGATIVE_TTL)
+    elif status in (400, 401, 403, 404, 410, 415):
+        known_bad.add(image_url)
+
+
+def is_known_bad(image_url):
+    if image_url in known_bad:
+        IMAGE_NEGATIVE_HITS.inc()
+        return True
+    return False
+
+
+def _fetch_into_cache(image_url):
+    # A call that finished just before this one started may have filled the cache
+    cached = cache.get(image_url)
+    if cached:
+        return 200, cached[0], cached[1]
+    try:
+        status, content, content_type = fetch_image(image_url)
+    except Exception:
+        record_result(image_url, None)
+        raise
+    record_result(image_url, status)
+    if status == 200:
+        cache.put(image_url, content, content_type)
+    return status, content, content_type
+
+
+def get_image(image_url):
+    """(status_code, content, content_type) from the cache or one shared upstream fetch"""
+    cached = cache.get(image_url)
+    if cached:
+        return 200, cached[0], cached[1]
+    if is_known_bad(image_url):
+        return NOT_FOUND
+    result, shared = in_flight.do(image_url, _fetch_into_cache, image_url)
+    if shared:
+        IMAGE_COALESCED.inc()
+    return result
+
+
+def stats():
+    """Counts for /image-proxy/stats"""
+    return {
+        'cache_entries': len(cache),
+        'cache_bytes': cache.size,
+        'cache_hits': IMAGE_CACHE_LOOKUPS.labels(result='hit').value,
+        'cache_misses': IMAGE_CACHE_LOOKUPS.labels(result='miss').value,
+        'upstream_fetches': {status: child.value for (status,), child in IMAGE_UPSTREAM_FETCHES.collect()},
+        'coalesced': IMAGE_COALESCED.labels().value,
+        'negative_cache_entries': len(known_bad),
+        'negative_cache_hits': IMAGE_NEGATIVE_HITS.labels().value,
+        'in_flight': len(in_flight.in_flight()),
+    }
+
+
+def image_urls(properties):
+    """Distinct http(s) image URLs of a listing set, in first-seen order"""
+    seen = set()
+    urls = []
+    for prop in properties:
+        url = (prop.get('image') or '').strip()
+        if not url.startswith(('http://', 'https://')) or url in seen:
+            continue
+        seen.add(url)
+        urls.append(url)
+    return urls
+
+
+class ImageWarmer:
+    def __init__(self, cache, fetch=get_image, workers=WARM_WORKERS, per_host=PER_HOST_CONCURRENCY):
+        self.cache = cache
+        self.fetch = fetch
+        self.per_host = per_host
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-warm')
+        # Per-host waiting lists; a URL is only submitted to the pool once its host has a free slot,
+        # so pool threads never sit blocked behind one busy host
+        self._pending = defaultdict(deque)
+        self._active = defaultdict(int)
+        self._queued = set()
+        self._lock = threading.Lock()
+
+    def _dispatch(self, host):
+        """Submit host's waiting URLs while it has free slots; call with the lock held"""
+        pending = self._pending[host]
+        while pending and self._active[host] < self.per_host:
+            self._active[host] += 1
+            self._executor.submit(self._warm_one, host, pending.popleft())
+        if not pending:
+            del self._pending[host]
+            if not self._active[host]:
+                del self._active[host]
+
+    def _warm_one(self, host, url):
+        try:
+            if url in self.cache:
+                IMAGES_WARMED.labels(outcome='cached').inc()
+                return
+            status, content, content_type = self.fetch(url)
+            if status == 200:
+                IMAGES_WARMED.labels(outcome='ok').inc()
+            else:
+                IMAGES_WARMED.labels(outcome='failed').inc()
+        except Exception as e:
+            IMAGES_WARMED.labels(outcome='failed').inc()
+            logger.debug("Warming %s failed: %s", url, e)
+        finally:
+            with self._lock:
+                self._queued.discard(url)
+                self._active[host] -= 1
+                self._dispatch(host)
+
+    def warm(self, properties):
+        """Queue the listings' images that are neither cached nor already queued; returns how many"""
+        queued = 0
+        hosts = set()
+        with self._lock:
+            for url in image_urls(properties):
+                if url in self.cache or url in self._queued:
+                    continue
+                self._queued.add(url)
+                host = urlsplit(url).netloc
+                self._pending[host].append(url)
+                hosts.add(host)
+                queued += 1
+            for host in hosts:
+                self._dispatch(host)
+        if queued:
+            logger.debug("🖼️ Warming %d images", queued)
+        return queued
+
+
+warmer = ImageWarmer(cache)
+
+
+def is_placeholder(image_url):
+    return bool(image_url) and bool(PLACEHOLDER_PATTERN.search(image_url))
+
+
+def check_image_url(image_url):
+    """HEAD an image URL; returns its status (415 for a non-image 200) or None if the request failed"""
+    try:
+        r = session.head(image_url, headers=request_headers(image_url), timeout=VALIDATE_TIMEOUT,
+                         allow_redirects=True)
+    except requests.RequestException:
+        return None
+    content_type = r.headers.get('Content-Type', '')
+    if r.status_code == 200 and content_type and not content_type.startswith(('image/', 'application/octet-stream')):
+        return 415
+    return r.status_code
+
+
+def _check_and_record(url):
+    status = check_image_url(url)
+    # Hosts that do not support HEAD (405, 501) get the benefit of the doubt
+    if status not in (405, 501):
+        record_result(url, status)
+    outcome = 'ok' if url in known_good else 'dead' if url in known_dead else 'unknown'
+    IMAGES_VALIDATED.labels(outcome=outcome).inc()
+
+
+def validate_images(properties, workers=VALIDATE_WORKERS, budget=None):
+    """Drop or replace dead image URLs in place; returns the number of images removed
+
+    A property may carry 'image_alternatives', other URLs that might hold its
+    photo; the first one not known to be dead replaces a dead 'image'. The
+    key is removed either way. URLs whose check has not answered within
+    budget seconds (VALIDATE_BUDGET by default) are kept.
+    """
+    candidates = {}
+    for prop in properties:
+        urls = [prop.get('image')] + list(prop.pop('image_alternatives', None) or [])
+        candidates[id(prop)] = [u for u in urls if u and not is_placeholder(u)]
+    if not VALIDATE_IMAGES:
+        for prop in properties:
+            prop['image'] = (candidates[id(prop)] or [None])[0]
+        return 0
+
+    to_check = {u for urls in candidates.values() for u in urls
+                if u.startswith(('http://', 'https://')) and u not in known_good and u not in known_dead}
+    if to_check:
+        pool = ThreadPoolExecutor(max_workers=min(workers, len(to_check)), thread_name_prefix='image-check')
+        try:
+            wait([pool.submit(_check_and_record, url) for url in to_check],
+                 timeout=VALIDATE_BUDGET if budget is None else budget)
+        finally:
+            # Checks still running finish in the background; queued ones are dropped
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    removed = 0
+    for prop in properties:
+        original = prop.get('image')
+        prop['image'] = next((u for u in candidates[id(prop)] if u not in known_dead), None)
+        if original and not prop['image']:
+            removed += 1
+    if to_check:
+        logger.debug("🖼️ Checked %d image URLs, removed %d dead images", len(to_check), removed)
+    return removed
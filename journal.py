@@ -0,0 +1,113 @@
+"""
+Append-only crawl journal for crash-resumable multi-city crawls.
+
+Each completed (source, city, page) unit is written as one JSON line with
+its properties and flushed to disk before the crawl moves on. Opening an
+existing journal loads every finished unit, so a restarted crawl skips
+them and reloads their results instead of fetching them again.
+
+    journal = CrawlJournal('overnight.jsonl')
+    results = scrape_multiple_cities(pages_per_city=10, journal=journal)
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlJournal:
+    def __init__(self, path):
+        self.path = path
+        self._units = {}
+        self._lock = threading.Lock()
+        self._load()
+        self._file = open(path, 'a', encoding='utf-8')
+        self._terminate_partial_line()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                    key = (entry['source'], entry['city'], int(entry['page']))
+                except (ValueError, KeyError, TypeError):
+                    # A crash can leave a half-written last line
+                    logger.warning("Skipping unreadable journal line %d in %s", line_number, self.path)
+                    continue
+                self._units[key] = entry['properties']
+        logger.info("📒 Journal %s: %d completed units", self.path, len(self._units))
+
+    def _terminate_partial_line(self):
+        """Start a fresh line if a crash left the last record without its newline"""
+        if os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                self._file.write('\n')
+                self._file.flush()
+
+    def get(self, source, city, page):
+        """Properties of a completed unit, or None if it still has to be crawled"""
+        with self._lock:
+            return self._units.get((source, city, int(page)))
+
+    def is_done(self, source, city, page):
+        return self.get(source, city, page) is not None
+
+    def record(self, source, city, page, properties):
+        """Durably append a completed unit"""
+        entry = {
+            'source': source,
+            'city': city,
+            'page': int(page),
+            'completed_at': time.time(),
+            'properties': properties,
+        }
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._units[(source, city, int(page))] = properties
+
+    def crawl_page(self, source, city, page, crawl):
+        """Return a unit's properties from the journal, or crawl() and record them
+
+        Pages that come back empty are not recorded: the scrapers return an
+        empty list both for a real empty page and for a failed fetch, and a
+        failed fetch must be retried on restart.
+        """
+        properties = self.get(source, city, page)
+        if properties is not None:
+            logger.info("📒 Reusing %s/%s page %d from journal", source, city, page)
+            return properties
+        properties = crawl()
+        if properties:
+            self.record(source, city, page, properties)
+        return properties
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_journal(journal):
+    """Accept a CrawlJournal or a path; return (journal, owned) where owned means we opened it"""
+    if journal is None or isinstance(journal, CrawlJournal):
+        return journal, False
+    return CrawlJournal(journal), True
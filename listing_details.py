@@ -0,0 +1,109 @@
+"""
+On-demand OLX listing details behind /listing/details.
+
+An OLX result page has no photos; each listing's image is on its own page.
+Fetching those pages during a crawl costs one request plus a 1-2 second
+pause per listing, which is most of an OLX crawl's time. With lazy details
+the crawl skips them and the browser asks for a card's details only when
+the card scrolls into view, so pages nobody looks at are never fetched.
+
+Details are cached for DETAILS_TTL and concurrent requests for the same
+listing share one fetch. Only listing URLs on the OLX domain are accepted,
+so the endpoint cannot be used to make the server fetch arbitrary URLs.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+import olx_scraper
+from blocking import domain_of
+from image_proxy import is_placeholder
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+DETAILS_TTL = 6 * 3600
+# Failed fetches are retried sooner
+FAILED_TTL = 300
+MAX_ENTRIES = 20000
+
+DETAIL_LOOKUPS = metrics.Counter('listing_detail_lookups_total', 'Listing detail requests', ['result'])
+
+
+class DisallowedURLError(ValueError):
+    """The URL is not a listing on a site we scrape"""
+
+
+class DetailsCache:
+    """url -> details dict, expiring after ttl, oldest dropped past max_entries"""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            expires, details = entry
+            if expires < time.time():
+                del self._entries[url]
+                return None
+            self._entries.move_to_end(url)
+            return details
+
+    def put(self, url, details, ttl):
+        with self._lock:
+            self._entries[url] = (time.time() + ttl, details)
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+cache = DetailsCache()
+in_flight = SingleFlight()
+
+
+def allowed_domains():
+    return {domain_of(url) for url in olx_scraper.CITIES.values()}
+
+
+def check_url(url):
+    if not url.startswith(('http://', 'https://')) or domain_of(url) not in allowed_domains():
+        raise DisallowedURLError(f"Not an OLX listing: {url}")
+
+
+def _fetch_details(url):
+    cached = cache.get(url)
+    if cached is not None:
+        return cached
+    try:
+        details = olx_scraper.get_listing_details(url)
+    except Exception as e:
+        logger.debug("⚠️ Could not fetch details for %s: %s", url, e)
+        details = {'image': None, 'description': None}
+        cache.put(url, details, FAILED_TTL)
+        return details
+    if details['image'] and is_placeholder(details['image']):
+        details['image'] = None
+    cache.put(url, details, DETAILS_TTL)
+    return details
+
+
+def get_details(url):
+    """(details, cached) for an OLX listing URL; raises DisallowedURLError for other URLs"""
+    check_url(url)
+    details = cache.get(url)
+    if details is not None:
+        DETAIL_LOOKUPS.labels(result='hit').inc()
+        return details, True
+    details, shared = in_flight.do(url, _fetch_details, url)
+    DETAIL_LOOKUPS.labels(result='coalesced' if shared else 'miss').inc()
+    return details, shared
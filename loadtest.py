@@ -0,0 +1,217 @@
+"""
+Load-test harness for the Flask app.
+
+Starts local mock servers imitating zameen.com, property1.pk and olx.com.pk,
+points the scrapers at them, serves app.py on a local port and drives
+concurrent clients against /scrape and /image-proxy.
+
+    python loadtest.py --clients 20 --duration 30 --latency 0.1 --rate-limit 0.05
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+import types
+from collections import defaultdict
+from urllib.parse import quote
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import mock_sites
+import olx_scraper
+import property1_scraper
+import zameen_scraper
+
+SCRAPER_MODULES = {
+    'zameen': zameen_scraper,
+    'property1': property1_scraper,
+    'olx': olx_scraper,
+}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def _no_sleep_time():
+    """A stand-in for the time module whose sleep() returns immediately"""
+    shim = types.SimpleNamespace(**{name: getattr(time, name) for name in dir(time) if not name.startswith('_')})
+    shim.sleep = lambda seconds: None
+    return shim
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.sites = {}
+        self.server = None
+        self.base_url = None
+        self.image_urls = []
+        self.results = defaultdict(list)  # endpoint -> [(latency, status)]
+        self._lock = threading.Lock()
+        self._saved = {}
+
+    def start(self):
+        args = self.args
+        for name, module in SCRAPER_MODULES.items():
+            config = mock_sites.MockSiteConfig(
+                latency=args.latency,
+                jitter=args.jitter,
+                rate_limit_rate=args.rate_limit,
+                server_error_rate=args.server_errors,
+                soft_block_rate=args.soft_blocks,
+                image_size=args.image_size,
+                seed=args.seed,
+            )
+            site = mock_sites.MockSite(name, config).start()
+            self.sites[name] = site
+
+            # Point the scraper at the mock site
+            self._saved[name] = (module.CITIES, module.time)
+            module.CITIES = mock_sites.city_urls(site)
+            if not args.keep_delays:
+                module.time = _no_sleep_time()
+
+            self.image_urls.extend(f"{site.base_url}/images/{name}{i}.jpg" for i in range(args.distinct_images))
+
+        import app as app_module
+        self.server = make_server('127.0.0.1', args.port, app_module.app, threaded=True,
+                                  request_handler=QuietRequestHandler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+        for name, site in self.sites.items():
+            site.stop()
+            module = SCRAPER_MODULES[name]
+            module.CITIES, module.time = self._saved[name]
+
+    def _record(self, endpoint, latency, status):
+        with self._lock:
+            self.results[endpoint].append((latency, status))
+
+    def _client(self, deadline, rng):
+        session = requests.Session()
+        sources = list(SCRAPER_MODULES)
+        while time.monotonic() < deadline:
+            if rng.random() < self.args.scrape_ratio:
+                endpoint = '/scrape'
+                started = time.perf_counter()
+                try:
+                    response = session.post(
+                        self.base_url + '/scrape',
+                        json={
+                            'source': rng.choice(sources),
+                            'city': rng.choice(list(mock_sites.LOCALITIES)),
+                            'pages': self.args.pages,
+                        },
+                        timeout=self.args.timeout,
+                    )
+                    status = response.status_code
+                except requests.RequestException:
+                    status = 'error'
+            else:
+                endpoint = '/image-proxy'
+                started = time.perf_counter()
+                try:
+                    url = rng.choice(self.image_urls)
+                    response = session.get(f"{self.base_url}/image-proxy?url={quote(url, safe='')}", timeout=self.args.timeout)
+                    status = response.status_code
+                except requests.RequestException:
+                    status = 'error'
+            self._record(endpoint, time.perf_counter() - started, status)
+
+    def run(self):
+        deadline = time.monotonic() + self.args.duration
+        threads = []
+        started = time.monotonic()
+        for i in range(self.args.clients):
+            rng = random.Random(None if self.args.seed is None else self.args.seed + i)
+            thread = threading.Thread(target=self._client, args=(deadline, rng), daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - started
+
+    def report(self, elapsed):
+        lines = []
+        lines.append(f"{'=' * 78}")
+        lines.append(f"Load test: {self.args.clients} clients, {elapsed:.1f}s")
+        lines.append(f"{'=' * 78}")
+        lines.append(f"{'endpoint':<14}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>9}{'err %':>8}")
+        for endpoint, samples in sorted(self.results.items()):
+            latencies = sorted(latency for latency, _ in samples)
+            errors = sum(1 for _, status in samples if status == 'error' or status >= 400)
+            lines.append(
+                f"{endpoint:<14}{len(samples):>9}{len(samples) / elapsed:>9.1f}"
+                f"{percentile(latencies, 50) * 1000:>9.0f}{percentile(latencies, 95) * 1000:>9.0f}"
+                f"{percentile(latencies, 99) * 1000:>9.0f}{errors:>9}{errors / len(samples) * 100:>7.1f}%"
+            )
+            statuses = defaultdict(int)
+            for _, status in samples:
+                statuses[status] += 1
+            lines.append(f"{'':<14}status: " + ', '.join(f"{k}={v}" for k, v in sorted(statuses.items(), key=str)))
+            if latencies:
+                lines.append(f"{'':<14}mean: {statistics.mean(latencies) * 1000:.0f} ms, max: {latencies[-1] * 1000:.0f} ms")
+        lines.append('')
+        lines.append('Upstream mock sites:')
+        for name, site in self.sites.items():
+            stats = site.stats
+            lines.append(
+                f"  {name:<10} requests={stats['requests']} 429={stats['rate_limited']} "
+                f"5xx={stats['server_errors']} soft-blocked={stats['soft_blocked']} bytes={stats['bytes']}"
+            )
+        return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test app.py against local mock upstream sites')
+    parser.add_argument('--clients', type=int, default=10, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=20, help='test duration in seconds')
+    parser.add_argument('--scrape-ratio', type=float, default=0.1, help='fraction of requests that hit /scrape')
+    parser.add_argument('--pages', type=int, default=1, help='pages per /scrape request')
+    parser.add_argument('--latency', type=float, default=0.05, help='mock upstream latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.02, help='mock upstream latency jitter in seconds')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='fraction of upstream responses that are 429')
+    parser.add_argument('--server-errors', type=float, default=0.0, help='fraction of upstream responses that are 503')
+    parser.add_argument('--soft-blocks', type=float, default=0.0,
+                        help='fraction of upstream pages that are a 200 captcha page')
+    parser.add_argument('--image-size', type=int, default=20000, help='mock image size in bytes')
+    parser.add_argument('--distinct-images', type=int, default=200, help='distinct image URLs per site')
+    parser.add_argument('--timeout', type=float, default=120, help='client request timeout in seconds')
+    parser.add_argument('--port', type=int, default=0, help='port for the app under test (0 = any free port)')
+    parser.add_argument('--seed', type=int, default=None, help='random seed for reproducible runs')
+    parser.add_argument('--keep-delays', action='store_true', help="keep the scrapers' politeness sleeps")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    test = LoadTest(args)
+    test.start()
+    print(f"🚀 App under test at {test.base_url}")
+    for name, site in test.sites.items():
+        print(f"   mock {name}: {site.base_url}")
+    try:
+        elapsed = test.run()
+    finally:
+        test.stop()
+    print(test.report(elapsed))
+
+
+if __name__ == "__main__":
+    main()
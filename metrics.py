@@ -0,0 +1,216 @@
+"""
+In-process metrics exposed in the Prometheus text format at /metrics.
+
+Counters, gauges and histograms are created once at module level and
+updated from the scrapers and the Flask app:
+
+    with metrics.timed('parse', 'zameen', 'Lahore'):
+        soup = BeautifulSoup(html, 'html.parser')
+    metrics.CARDS_FOUND.labels(source='zameen', city='Lahore').inc(len(cards))
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def labels(self, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        """Child for metrics declared without labels"""
+        return self.labels()
+
+    def collect(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in self.collect():
+            lines.extend(child.render(self.name, self.labelnames, key))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def render(self, name, labelnames, key):
+        return [f"{name}{_format_labels(labelnames, key)} {_format_value(self._value)}"]
+
+
+class _GaugeChild(_CounterChild):
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * len(buckets)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._sum += value
+            self._count += 1
+            for i, bound in enumerate(self._buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def render(self, name, labelnames, key):
+        lines = []
+        cumulative = 0
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        for bound, bucket_count in zip(self._buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(labelnames, key, [('le', _format_value(bound))])
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, key, [('le', '+Inf')])
+        lines.append(f"{name}_bucket{labels} {count}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, key)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, key)} {count}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+
+def render():
+    """Render every registered metric in the Prometheus text exposition format"""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# ---------------- Scraper metrics ----------------
+
+STAGE_SECONDS = Histogram(
+    'scraper_stage_seconds',
+    'Time spent in each scrape stage (fetch, parse, detect, extract, enrich, serialize)',
+    ['stage', 'source', 'city'],
+)
+
+CARDS_FOUND = Counter('scraper_cards_found_total', 'Listing cards detected on result pages', ['source', 'city'])
+CARDS_KEPT = Counter('scraper_cards_kept_total', 'Listing cards that produced a usable property', ['source', 'city'])
+PAGES_FAILED = Counter('scraper_pages_failed_total', 'Result pages that raised an error', ['source', 'city'])
+
+HTTP_RESPONSES = Counter('scraper_http_responses_total', 'Upstream HTTP responses by status code', ['source', 'status'])
+HTTP_RETRIES = Counter('scraper_http_retries_total', 'Upstream requests retried by the retry adapter', ['source'])
+HTTP_RATE_LIMITED = Counter('scraper_http_rate_limited_total', 'Upstream 429 Too Many Requests responses', ['source'])
+
+
+@contextmanager
+def timed(stage, source, city=''):
+    """Observe the wall time of the wrapped block in STAGE_SECONDS"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage=stage, source=source, city=city or '').observe(time.perf_counter() - started)
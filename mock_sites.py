@@ -0,0 +1,255 @@
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Localities used to fill in mock listing cards
+LOCALITIES = {
+    'Lahore': ['DHA Phase 6', 'Bahria Town Sector C', 'Johar Town Block J', 'Model Town'],
+    'Karachi': ['DHA Phase 8', 'Gulshan-e-Iqbal Block 13', 'Clifton Block 5', 'Bahria Town Karachi'],
+    'Islamabad': ['F-7', 'G-11', 'DHA Phase 2', 'Bahria Town Phase 7'],
+    'Rawalpindi': ['Bahria Town Phase 8', 'Saddar', 'Chaklala Scheme 3', 'Satellite Town Block A'],
+}
+
+PROPERTY_TYPES = ['House', 'Flat', 'Plot', 'Upper Portion']
+
+
+# What a soft block looks like: a 200 with a challenge instead of results
+CAPTCHA_PAGE = (
+    b'<!DOCTYPE html><html><head><title>Attention Required!</title></head>'
+    b'<body><div class="g-recaptcha" data-sitekey="x"></div></body></html>'
+)
+
+
+class MockSiteConfig:
+    """Behaviour knobs for a mock upstream site"""
+
+    def __init__(self, latency=0.05, jitter=0.02, rate_limit_rate=0.0, server_error_rate=0.0,
+                 image_size=20000, cards_per_page=20, soft_block_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.image_size = image_size
+        self.cards_per_page = cards_per_page
+        self.soft_block_rate = soft_block_rate
+        self.random = random.Random(seed)
+
+
+def _fake_listing(rng, city, page, index):
+    """Build the fields of one fake listing"""
+    marla = rng.choice([3, 5, 7, 10, 20])
+    price = round(rng.uniform(0.5, 9.5), 2)
+    return {
+        'id': f"{page}{index:03d}{rng.randint(100, 999)}",
+        'title': f"{marla} Marla {rng.choice(PROPERTY_TYPES)} for sale in {rng.choice(LOCALITIES.get(city, ['Main Boulevard']))}",
+        'price': f"PKR {price} Crore",
+        'location': f"{rng.choice(LOCALITIES.get(city, ['Main Boulevard']))}, {city}",
+        'area': f"{marla} Marla",
+        'beds': rng.randint(1, 6),
+        'baths': rng.randint(1, 6),
+    }
+
+
+def _page_shell(body):
+    """Wrap listing markup in the header/footer noise a real results page has"""
+    nav = ''.join(f'<li><a href="/nav/{i}">Menu item {i}</a></li>' for i in range(40))
+    scripts = ''.join(f'<script>window.__tracker{i} = {{"id": {i}}};</script>' for i in range(10))
+    return (
+        '<!DOCTYPE html><html><head><title>Results</title>' + scripts + '</head><body>'
+        '<header><nav><ul>' + nav + '</ul></nav></header>'
+        '<main>' + body + '</main>'
+        '<footer><p>Copyright mock site</p></footer></body></html>'
+    )
+
+
+def render_zameen_page(config, base, city, page):
+    cards = []
+    for i in range(config.cards_per_page):
+        p = _fake_listing(config.random, city, page, i)
+        cards.append(
+            f'<li role="article"><article>'
+            f'<a href="/Property/{p["id"]}.html"><img src="{base}/images/z{p["id"]}.jpg"></a>'
+            f'<h2>{p["title"]}</h2>'
+            f'<span class="price">{p["price"]}</span>'
+            f'<div class="location">{p["location"]}</div>'
+            f'<span class="area">{p["area"]}</span>'
+            f'</article></li>'
+        )
+    return _page_shell('<ul class="listings">' + ''.join(cards) + '</ul>')
+
+
+def render_property1_page(config, base, city, page):
+    cards = []
+    for i in range(config.cards_per_page):
+        p = _fake_listing(config.random, city, page, i)
+        cards.append(
+            f'<div class="rtcl-listing-item">'
+            f'<img data-src="{base}/images/p{p["id"]}.jpg" src="data:image/gif;base64,R0lGOD">'
+            f'<h3>{p["title"]}</h3>'
+            f'<span class="price-amount">{p["price"]}</span>'
+            f'<div class="rtcl-location">{p["location"]}</div>'
+            f'<a href="{base}/listing/{p["id"]}/">Details</a>'
+            f'</div>'
+        )
+    return _page_shell('<div class="rtcl-listings">' + ''.join(cards) + '</div>')
+
+
+def render_olx_page(config, base, city, page):
+    cards = []
+    for i in range(config.cards_per_page):
+        p = _fake_listing(config.random, city, page, i)
+        cards.append(
+            f'<li class="_2U8HN"><div class="_1t0I4">'
+            f'<a href="{base}/item/{p["id"]}"><h2>{p["title"]}</h2></a>'
+            f'<span class="price">{p["price"]}</span>'
+            f'<span class="location">{p["location"]}</span>'
+            f'<span>{p["area"]} {p["beds"]} Beds {p["baths"]} Baths</span>'
+            f'</div></li>'
+        )
+    return _page_shell('<ul class="listings">' + ''.join(cards) + '</ul>')
+
+
+def render_olx_detail(base, item_id):
+    return (
+        '<html><head>'
+        f'<meta property="og:image" content="{base}/images/o{item_id}.jpg">'
+        '</head><body><div class="gallery"></div></body></html>'
+    )
+
+
+class MockSite:
+    """A local HTTP server imitating one upstream property site"""
+
+    def __init__(self, name, config=None, host='127.0.0.1', port=0):
+        self.name = name
+        self.config = config or MockSiteConfig()
+        self.stats = {'requests': 0, 'rate_limited': 0, 'server_errors': 0, 'soft_blocked': 0, 'bytes': 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _make_handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                self.do_GET(head=True)
+
+            def do_GET(self, head=False):
+                config = site.config
+                site._count('requests')
+                time.sleep(max(0.0, config.latency + config.random.uniform(-config.jitter, config.jitter)))
+
+                roll = config.random.random()
+                if roll < config.rate_limit_rate:
+                    site._count('rate_limited')
+                    return self._send(429, b'Too Many Requests', 'text/plain', head, {'Retry-After': '1'})
+                if roll < config.rate_limit_rate + config.server_error_rate:
+                    site._count('server_errors')
+                    return self._send(503, b'Service Unavailable', 'text/plain', head)
+                if not self.path.startswith('/images/') and config.random.random() < config.soft_block_rate:
+                    site._count('soft_blocked')
+                    return self._send(200, CAPTCHA_PAGE, 'text/html; charset=utf-8', head)
+
+                status, body, content_type = site.route(self.path)
+                self._send(status, body, content_type, head)
+
+            def _send(self, status, body, content_type, head, extra_headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (extra_headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                if not head:
+                    self.wfile.write(body)
+                    site._count('bytes', len(body))
+
+        return Handler
+
+    def route(self, path):
+        """Map a request path to (status, body, content type)"""
+        config = self.config
+        base = self.base_url
+
+        if path.startswith('/images/'):
+            return 200, _image_bytes(config.image_size), 'image/jpeg'
+
+        if self.name == 'zameen':
+            match = re.match(r'^/Homes/([A-Za-z]+)-\d+-(\d+)\.html', path)
+            if match:
+                html = render_zameen_page(config, base, match.group(1), int(match.group(2)))
+                return 200, html.encode('utf-8'), 'text/html; charset=utf-8'
+
+        elif self.name == 'property1':
+            if path.startswith('/all-properties'):
+                page_match = re.search(r'/page/(\d+)', path)
+                city_match = re.search(r'rtcl_location=([a-z]+)', path)
+                city = city_match.group(1).title() if city_match else 'Lahore'
+                page = int(page_match.group(1)) if page_match else 1
+                html = render_property1_page(config, base, city, page)
+                return 200, html.encode('utf-8'), 'text/html; charset=utf-8'
+
+        elif self.name == 'olx':
+            match = re.match(r'^/item/(\w+)', path)
+            if match:
+                return 200, render_olx_detail(base, match.group(1)).encode('utf-8'), 'text/html; charset=utf-8'
+            match = re.match(r'^/([a-z]+)/q-[\w-]+/(?:\?page=(\d+))?', path)
+            if match:
+                html = render_olx_page(config, base, match.group(1).title(), int(match.group(2) or 1))
+                return 200, html.encode('utf-8'), 'text/html; charset=utf-8'
+
+        return 404, b'Not Found', 'text/plain'
+
+
+_IMAGE_CACHE = {}
+
+
+def _image_bytes(size):
+    """Return a fake JPEG payload of the requested size"""
+    if size not in _IMAGE_CACHE:
+        header = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00'
+        _IMAGE_CACHE[size] = (header + b'\x00' * max(0, size - len(header) - 2) + b'\xff\xd9')[:max(size, 4)]
+    return _IMAGE_CACHE[size]
+
+
+def city_urls(site):
+    """CITIES mapping for a scraper module, pointed at a mock site"""
+    base = site.base_url
+    if site.name == 'zameen':
+        ids = {'Lahore': 1, 'Karachi': 2, 'Rawalpindi': 41, 'Islamabad': 3}
+        return {city: f"{base}/Homes/{city}-{ids[city]}-1.html" for city in ids}
+    if site.name == 'property1':
+        return {
+            city: f"{base}/all-properties/?s=&filters%5Bad_type%5D=&rtcl_location={city.lower()}"
+            for city in LOCALITIES
+        }
+    if site.name == 'olx':
+        return {city: f"{base}/{city.lower()}/" for city in LOCALITIES}
+    raise ValueError(f"Unknown mock site {site.name}")
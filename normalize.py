@@ -0,0 +1,122 @@
+"""
+Normalization of scraped price, area, locality and property type strings.
+
+The scrapers keep prices and areas as display text ("PKR 2.8 Crore",
+"1 Kanal", "1,800 Sq. Ft."). These helpers turn them into rupees, marlas
+and a few canonical labels so listings from every source can be compared
+and aggregated.
+"""
+import re
+
+PRICE_UNITS = {
+    'thousand': 1e3,
+    'lakh': 1e5,
+    'lac': 1e5,
+    'million': 1e6,
+    'crore': 1e7,
+    'arab': 1e9,
+}
+
+SQFT_PER_MARLA = 225.0
+
+# Marlas per unit, using the 225 sq ft marla that Zameen and OLX list with
+AREA_UNITS = {
+    'marla': 1.0,
+    'kanal': 20.0,
+    'sqft': 1 / SQFT_PER_MARLA,
+    'sqyd': 1 / 25.0,
+    'sqm': 1 / 20.9,
+}
+
+# Checked in order, so the more specific names come first
+PROPERTY_TYPES = [
+    ('farm house', re.compile(r'farm\s*house', re.I)),
+    ('penthouse', re.compile(r'penthouse', re.I)),
+    ('portion', re.compile(r'(upper|lower)\s+portion|portion', re.I)),
+    ('flat', re.compile(r'\b(flat|apartment)s?\b', re.I)),
+    ('plot', re.compile(r'\bplots?\b|\bfile\b', re.I)),
+    ('shop', re.compile(r'\bshops?\b', re.I)),
+    ('office', re.compile(r'\boffices?\b', re.I)),
+    ('commercial', re.compile(r'commercial|building|warehouse|plaza', re.I)),
+    ('room', re.compile(r'\brooms?\b', re.I)),
+    ('house', re.compile(r'\b(house|home|villa|bungalow)s?\b', re.I)),
+]
+
+_price_pattern = re.compile(r'([\d,]+(?:\.\d+)?)\s*(thousand|lakh|lac|million|crore|arab)?', re.I)
+_area_pattern = re.compile(
+    r'([\d,]+(?:\.\d+)?)\s*(?:-\s*[\d.]+\s*)?'
+    r'(marla|kanal|sq\.?\s*ft\.?|sqft|square\s*feet|sq\.?\s*yd\.?|sq\.?\s*yards?|square\s*yards?|sqm|m²|square\s*meters?)',
+    re.I,
+)
+
+
+def _area_unit(text):
+    unit = re.sub(r'[\s.]', '', text.lower())
+    if unit.startswith('marla'):
+        return 'marla'
+    if unit.startswith('kanal'):
+        return 'kanal'
+    if unit in ('sqft', 'squarefeet'):
+        return 'sqft'
+    if unit.startswith('sqyd') or unit.startswith('squareyard') or unit.startswith('sqyard'):
+        return 'sqyd'
+    return 'sqm'
+
+
+def parse_price(text):
+    """Price text in rupees as a float, or None if there is no number"""
+    if not text or not isinstance(text, str):
+        return None
+    for match in _price_pattern.finditer(text):
+        number = match.group(1).replace(',', '')
+        if not number or number == '.':
+            continue
+        try:
+            value = float(number)
+        except ValueError:
+            continue
+        if value <= 0:
+            continue
+        unit = match.group(2)
+        if unit:
+            value *= PRICE_UNITS[unit.lower()]
+        return value
+    return None
+
+
+def parse_area_marla(text):
+    """Area text in marlas as a float, or None if there is no recognizable unit"""
+    if not text or not isinstance(text, str):
+        return None
+    match = _area_pattern.search(text)
+    if not match:
+        return None
+    try:
+        value = float(match.group(1).replace(',', ''))
+    except ValueError:
+        return None
+    if value <= 0:
+        return None
+    return value * AREA_UNITS[_area_unit(match.group(2))]
+
+
+def parse_area_sqft(text):
+    """Area text in square feet, or None"""
+    marla = parse_area_marla(text)
+    return None if marla is None else marla * SQFT_PER_MARLA
+
+
+def normalize_locality(text):
+    """Location text lowercased with punctuation and extra spaces removed"""
+    if not text or not isinstance(text, str):
+        return ''
+    return ' '.join(text.lower().replace(',', ' ').split())
+
+
+def property_type(title):
+    """Canonical property type named in a listing title, or 'other'"""
+    if title and isinstance(title, str):
+        for name, pattern in PROPERTY_TYPES:
+            if pattern.search(title):
+                return name
+    return 'other'
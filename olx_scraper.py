@@ -5,6 +5,18 @@ import re
 from urllib.parse import urljoin, quote
 import json
 import random
+import logging
+
+import metrics
+from fetching import fetch
+from gazetteer import match_locality
+from blocking import BlockedPageError, CircuitOpenError, check_result_page
+from image_proxy import validate_images
+from parsing import ListingStrainer, class_contains, free_tree, parse_listing_page
+from journal import open_journal
+from exporters import EXPORT_FORMATS, PAGE_CHUNK_SIZE, JsonExporter, get_exporter
+
+logger = logging.getLogger(__name__)
 
 # Rotating User-Agents
 USER_AGENTS = [
@@ -30,6 +42,48 @@ PROPERTY_CATEGORIES = [
     'land-plots',  # Changed from plots-for-sale
 ]
 
+LISTING_SELECTORS = [
+    'div[class*="_1t0I4"]',  # OLX listing card class
+    'div[class*="a38b8"]',
+    'li[class*="_2U8HN"]',
+    'div[class*="ads__item"]',
+    'div[class*="listing-card"]',
+]
+
+def is_listing_tag(name, attrs):
+    """True for tags LISTING_SELECTORS can match, used to parse only the listings"""
+    if name == 'li':
+        return class_contains(attrs, '_2U8HN')
+    if name == 'div':
+        return any(class_contains(attrs, fragment) for fragment in ('_1t0I4', 'a38b8', 'ads__item', 'listing-card'))
+    return False
+
+LISTING_STRAINER = ListingStrainer(is_listing_tag)
+
+def find_listings(soup):
+    """Find listing cards on an OLX results page"""
+    for selector in LISTING_SELECTORS:
+        found = soup.select(selector)
+        if found:
+            logger.debug("  ✅ Found %d listings with selector: %s", len(found), selector)
+            return found
+    
+    # If no listings found with selectors, try finding by structure
+    listings = []
+    # Look for divs containing price and area
+    all_divs = soup.find_all('div', recursive=True)
+    for div in all_divs:
+        div_text = div.get_text().lower()
+        if ('pk' in div_text or 'rs' in div_text) and any(x in div_text for x in ['marla', 'kanal']):
+            if 100 < len(div.get_text()) < 1000:
+                listings.append(div)
+                if len(listings) >= 20:
+                    break
+    
+    if listings:
+        logger.debug("  ✅ Found %d potential listings", len(listings))
+    return listings
+
 def get_headers():
     """Get headers with random user agent"""
     return {
@@ -43,54 +97,74 @@ def get_headers():
         'DNT': '1',
     }
 
-def get_property_image(property_url):
-    """Fetch property image from OLX property page"""
-    try:
-        response = requests.get(property_url, headers=get_headers(), timeout=15)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Method 1: Look for image in gallery/slider
-        image_selectors = [
-            'div[class*="swiper"] img',
-            'div[class*="gallery"] img',
-            'div[class*="slider"] img',
-            'img[class*="image"]',
-            'img[class*="photo"]',
-            'meta[property="og:image"]',
-        ]
-        
-        for selector in image_selectors:
-            if selector.startswith('meta'):
-                meta = soup.find('meta', property='og:image')
-                if meta and meta.get('content'):
-                    return meta['content']
-            else:
-                img = soup.select_one(selector)
-                if img and img.get('src'):
-                    src = img['src']
-                    if src.startswith('//'):
-                        src = 'https:' + src
-                    return src
-        
-        # Method 2: Any image that's not an icon
-        images = soup.find_all('img')
-        for img in images[:10]:
-            src = img.get('src') or img.get('data-src')
-            if src and not any(x in src.lower() for x in ['icon', 'logo', 'avatar', 'placeholder', 'pixel']):
+def find_detail_image(soup):
+    """Main photo on an OLX property page"""
+    # Method 1: Look for image in gallery/slider
+    image_selectors = [
+        'div[class*="swiper"] img',
+        'div[class*="gallery"] img',
+        'div[class*="slider"] img',
+        'img[class*="image"]',
+        'img[class*="photo"]',
+        'meta[property="og:image"]',
+    ]
+    
+    for selector in image_selectors:
+        if selector.startswith('meta'):
+            meta = soup.find('meta', property='og:image')
+            if meta and meta.get('content'):
+                return meta['content']
+        else:
+            img = soup.select_one(selector)
+            if img and img.get('src'):
+                src = img['src']
                 if src.startswith('//'):
                     src = 'https:' + src
                 return src
-                
-    except Exception as e:
-        print(f"    ⚠️ Image fetch error: {e}")
     
+    # Method 2: Any image that's not an icon
+    images = soup.find_all('img')
+    for img in images[:10]:
+        src = img.get('src') or img.get('data-src')
+        if src and not any(x in src.lower() for x in ['icon', 'logo', 'avatar', 'placeholder', 'pixel']):
+            if src.startswith('//'):
+                src = 'https:' + src
+            return src
+    
+    return None
+
+def find_detail_description(soup):
+    """Seller's description from an OLX property page"""
+    meta = soup.find('meta', property='og:description') or soup.find('meta', attrs={'name': 'description'})
+    if meta and meta.get('content'):
+        return meta['content'].strip()
+    return None
+
+def get_listing_details(property_url):
+    """Fields only an OLX property page has: {'image', 'description'}"""
+    response = fetch(property_url, 'olx', headers=get_headers(), timeout=15)
+    response.raise_for_status()
+    soup = BeautifulSoup(response.text, 'html.parser')
+    details = {
+        'image': find_detail_image(soup),
+        'description': find_detail_description(soup),
+    }
+    free_tree(soup)
+    return details
+
+def get_property_image(property_url):
+    """Fetch property image from OLX property page"""
+    try:
+        return get_listing_details(property_url)['image']
+    except Exception as e:
+        logger.debug("    ⚠️ Image fetch error: %s", e)
     return None
 
 def extract_price(text):
     """Extract price from text"""
     patterns = [
-        r'(?:PKR|Rs\.?)\s*([\d,]+(?:\.\d+)?)\s*(?:Crore|Lakh|Million)?',
-        r'([\d,]+(?:\.\d+)?)\s*(?:Crore|Lakh|Million)',
+        r'(?:PKR|Rs\.?)\s*([\d,]+(?:\.\d+)?)\s*(Crore|Lakh|Million)?',
+        r'([\d,]+(?:\.\d+)?)\s*(Crore|Lakh|Million)',
         r'([\d,]+)\s*(?:Rs|PKR)',
     ]
     
@@ -141,7 +215,7 @@ def extract_bed_bath(text):
     return beds, baths
 
 def extract_location(card, default_city):
-    """Extract location from card"""
+    """(location, locality) for a card; locality is the gazetteer match or None"""
     location_selectors = [
         'span[class*="location"]',
         'span[class*="address"]',
@@ -154,41 +228,138 @@ def extract_location(card, default_city):
         if elem:
             loc_text = elem.get_text(strip=True)
             if loc_text and len(loc_text) > 3:
-                return loc_text
+                return loc_text, match_locality(loc_text, default_city)
     
-    # Try to find in text
-    card_text = card.get_text()
-    patterns = [
-        r'(?:in|at|location)\s+([A-Za-z\s,]+(?:Phase|Sector|Block|Town)?[A-Za-z\s,]*)',
-        r'([A-Za-z\s]+(?:Phase|Sector|Block|Town)[\s\d]*)',
+    # Look for a known locality anywhere in the card
+    locality = match_locality(card.get_text(" "), default_city)
+    if locality:
+        return f"{locality.name}, {default_city}", locality
+    
+    return default_city, None
+
+def extract_listing_data(listing, city_name):
+    """Property dict for one result page listing, or None if it has no price or link
+
+    The image is on the listing's own page, so it is left as None here.
+    """
+    # Get listing text
+    listing_text = listing.get_text(" ", strip=True)
+    
+    # Skip if no price
+    if not re.search(r'(PKR|Rs|Crore|Lakh)', listing_text, re.I):
+        return None
+    
+    # Extract title
+    title = "N/A"
+    title_selectors = [
+        ('h2', None),
+        ('h3', None),
+        ('a', re.compile(r'title|heading', re.I)),
+        ('div', re.compile(r'title|heading', re.I)),
     ]
     
-    for pattern in patterns:
-        match = re.search(pattern, card_text, re.I)
-        if match:
-            loc = match.group(1).strip()
-            if loc and len(loc) > 3 and loc != default_city:
-                return loc
+    for tag, class_pattern in title_selectors:
+        if class_pattern:
+            elem = listing.find(tag, class_=class_pattern)
+        else:
+            elem = listing.find(tag)
+        
+        if elem:
+            title_text = elem.get_text(strip=True)
+            if title_text and len(title_text) > 10:
+                title = title_text
+                break
+    
+    # Extract price
+    price = extract_price(listing_text)
+    
+    # Extract area
+    area = extract_area(listing_text)
+    
+    # Extract bedrooms/bathrooms
+    beds, baths = extract_bed_bath(listing_text)
+    
+    # Extract location
+    location, locality = extract_location(listing, city_name)
     
-    return default_city
+    # Extract link
+    link_elem = listing.find('a', href=True)
+    link = None
+    if link_elem:
+        href = link_elem['href']
+        if href.startswith('/'):
+            link = urljoin('https://www.olx.com.pk', href)
+        elif href.startswith('http'):
+            link = href
+    
+    if not link:
+        return None
+    
+    return {
+        "title": title[:150] + "..." if len(title) > 150 else title,
+        "price": price,
+        "location": location,
+        "locality_id": locality.id if locality else None,
+        "area": area,
+        "beds": beds,
+        "baths": baths,
+        "image": None,
+        "url": link,
+        "city": city_name,
+        "source": "OLX.pk"
+    }
 
-def scrape_olx_city(city_name, pages=2):
-    """Scrape property listings from OLX Pakistan"""
+def parse_result_page(html, city_name):
+    """Properties on an already fetched result page, without touching the network
+
+    Images are left as None; see the archive's re-parse for filling them in
+    from archived property pages.
+    """
+    soup, listings = parse_listing_page(html, 'olx', city_name, LISTING_STRAINER, find_listings)
+    properties = []
+    seen_urls = set()
+    for listing in listings[:20]:
+        try:
+            prop = extract_listing_data(listing, city_name)
+        except Exception as e:
+            logger.debug("    ⚠️ Error processing listing: %s", e)
+            continue
+        if prop and prop["url"] not in seen_urls:
+            seen_urls.add(prop["url"])
+            properties.append(prop)
+    free_tree(soup)
+    return properties
+
+def iter_olx_city(city_name, pages=2, start_page=1, lazy_details=False, raise_errors=False):
+    """Yield property listings from OLX Pakistan as each result page is extracted
+
+    Each page's parse tree is freed before its properties are yielded, so
+    memory does not grow with the number of pages.
+
+    The image is only on each listing's own page. With lazy_details those
+    pages are not fetched: listings come back with image None and
+    "lazy_details": True, and /listing/details fills them in on demand.
+
+    With raise_errors a page that is blocked, or whose every category
+    fails to load, raises instead of being skipped, for callers that retry
+    pages themselves.
+    """
     
     if city_name not in CITIES:
-        print(f"❌ City '{city_name}' not found")
-        return []
+        logger.warning("❌ City '%s' not found", city_name)
+        return
     
     base_url = CITIES[city_name]
-    all_properties = []
     seen_urls = set()
+    total = with_images = 0
     
-    print(f"\n{'='*60}")
-    print(f"🚀 Scraping {city_name} from OLX.pk")
-    print(f"{'='*60}")
+    logger.info("🚀 Scraping %s from OLX.pk", city_name)
 
-    for page in range(1, pages + 1):
+    blocked = False
+    for page in range(start_page, start_page + pages):
         properties_found = False
+        page_properties = []
+        page_error = None
         
         for category in PROPERTY_CATEGORIES:
             # Construct OLX search URL - updated format
@@ -198,194 +369,160 @@ def scrape_olx_city(city_name, pages=2):
                 page_url = f"{base_url}q-{category}/?page={page}"
             
             try:
-                print(f"\n📄 Trying: {page_url}")
+                logger.debug("📄 Trying: %s", page_url)
                 
                 # Random delay
                 time.sleep(random.uniform(3, 5))
                 
-                response = requests.get(page_url, headers=get_headers(), timeout=25)
+                response = fetch(page_url, 'olx', city_name, result_page=True, headers=get_headers(), timeout=25)
                 
                 if response.status_code != 200:
-                    print(f"  ❌ HTTP {response.status_code}")
+                    logger.info("  ❌ HTTP %d for %s", response.status_code, page_url)
+                    page_error = requests.HTTPError(f"HTTP {response.status_code} for {page_url}", response=response)
                     continue
                 
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Find property listings - updated OLX selectors
-                listings = []
-                
-                listing_selectors = [
-                    'div[class*="_1t0I4"]',  # OLX listing card class
-                    'div[class*="a38b8"]',
-                    'li[class*="_2U8HN"]',
-                    'div[class*="ads__item"]',
-                    'div[class*="listing-card"]',
-                ]
-                
-                for selector in listing_selectors:
-                    found = soup.select(selector)
-                    if found:
-                        listings = found
-                        print(f"  ✅ Found {len(listings)} listings with selector: {selector}")
-                        properties_found = True
-                        break
-                
-                # If no listings found with selectors, try finding by structure
-                if not listings:
-                    # Look for divs containing price and area
-                    all_divs = soup.find_all('div', recursive=True)
-                    for div in all_divs:
-                        div_text = div.get_text().lower()
-                        if ('pk' in div_text or 'rs' in div_text) and any(x in div_text for x in ['marla', 'kanal']):
-                            if 100 < len(div.get_text()) < 1000:
-                                listings.append(div)
-                                if len(listings) >= 20:
-                                    break
-                    
-                    if listings:
-                        print(f"  ✅ Found {len(listings)} potential listings")
-                        properties_found = True
+                # Parse only the listing cards
+                soup, listings = parse_listing_page(response.text, 'olx', city_name, LISTING_STRAINER, find_listings)
+                check_result_page(page_url, 'olx', response.text, len(listings))
+                if listings:
+                    properties_found = True
                 
                 if listings:
-                    print(f"  Processing {min(len(listings), 20)} listings...")
+                    logger.debug("  Processing %d listings...", min(len(listings), 20))
+                    metrics.CARDS_FOUND.labels(source='olx', city=city_name).inc(min(len(listings), 20))
                     page_properties = []
                     
                     for i, listing in enumerate(listings[:20]):
                         try:
-                            # Get listing text
-                            listing_text = listing.get_text(" ", strip=True)
-                            
-                            # Skip if no price
-                            if not re.search(r'(PKR|Rs|Crore|Lakh)', listing_text, re.I):
-                                continue
-                            
-                            # Extract title
-                            title = "N/A"
-                            title_selectors = [
-                                ('h2', None),
-                                ('h3', None),
-                                ('a', re.compile(r'title|heading', re.I)),
-                                ('div', re.compile(r'title|heading', re.I)),
-                            ]
-                            
-                            for tag, class_pattern in title_selectors:
-                                if class_pattern:
-                                    elem = listing.find(tag, class_=class_pattern)
-                                else:
-                                    elem = listing.find(tag)
-                                
-                                if elem:
-                                    title_text = elem.get_text(strip=True)
-                                    if title_text and len(title_text) > 10:
-                                        title = title_text
-                                        break
+                            extract_started = time.perf_counter()
                             
-                            # Extract price
-                            price = extract_price(listing_text)
-                            
-                            # Extract area
-                            area = extract_area(listing_text)
-                            
-                            # Extract bedrooms/bathrooms
-                            beds, baths = extract_bed_bath(listing_text)
-                            
-                            # Extract location
-                            location = extract_location(listing, city_name)
-                            
-                            # Extract link
-                            link_elem = listing.find('a', href=True)
-                            link = None
-                            if link_elem:
-                                href = link_elem['href']
-                                if href.startswith('/'):
-                                    link = urljoin('https://www.olx.com.pk', href)
-                                elif href.startswith('http'):
-                                    link = href
-                            
-                            if not link or link in seen_urls:
+                            prop = extract_listing_data(listing, city_name)
+                            if not prop or prop["url"] in seen_urls:
                                 continue
                             
-                            seen_urls.add(link)
+                            seen_urls.add(prop["url"])
+                            metrics.STAGE_SECONDS.labels(stage='extract', source='olx', city=city_name).observe(
+                                time.perf_counter() - extract_started)
                             
                             # Get image
-                            print(f"    📸 Listing {i+1}: Getting image...")
-                            image = get_property_image(link)
-                            
-                            # Create property dictionary
-                            prop = {
-                                "title": title[:150] + "..." if len(title) > 150 else title,
-                                "price": price,
-                                "location": location,
-                                "area": area,
-                                "beds": beds,
-                                "baths": baths,
-                                "image": image,
-                                "url": link,
-                                "city": city_name,
-                                "source": "OLX.pk"
-                            }
+                            if lazy_details:
+                                prop["lazy_details"] = True
+                            else:
+                                logger.debug("    📸 Listing %d: Getting image...", i + 1)
+                                with metrics.timed('enrich', 'olx', city_name):
+                                    prop["image"] = get_property_image(prop["url"])
                             
                             page_properties.append(prop)
-                            print(f"    ✓ Added: {title[:40]}... | {price}")
+                            logger.debug("    ✓ Added: %s... | %s", prop["title"][:40], prop["price"])
                             
-                            # Small delay
-                            time.sleep(random.uniform(1, 2))
+                            # Small delay between property page fetches
+                            if not lazy_details:
+                                time.sleep(random.uniform(1, 2))
                             
                         except Exception as e:
-                            print(f"    ⚠️ Error processing listing {i+1}: {e}")
+                            logger.debug("    ⚠️ Error processing listing %d: %s", i + 1, e)
                             continue
                     
-                    all_properties.extend(page_properties)
-                    print(f"\n  ✅ Page {page}: Extracted {len(page_properties)} properties")
+                    free_tree(soup)
+                    del soup, listings, response
+                    metrics.CARDS_KEPT.labels(source='olx', city=city_name).inc(len(page_properties))
+                    logger.info("  ✅ Page %d: Extracted %d properties", page, len(page_properties))
                     
                     # If we found properties in this category, move to next page
                     if page_properties:
                         break
+                else:
+                    free_tree(soup)
                 
+            except (BlockedPageError, CircuitOpenError) as e:
+                # Trying the other categories would only prolong the block
+                metrics.PAGES_FAILED.labels(source='olx', city=city_name).inc()
+                logger.warning("🚧 Stopping %s crawl at page %d: %s", city_name, page, e)
+                if raise_errors:
+                    raise
+                blocked = True
+                break
             except Exception as e:
-                print(f"  ⚠️ Error with {category}: {e}")
+                metrics.PAGES_FAILED.labels(source='olx', city=city_name).inc()
+                logger.error("  ⚠️ Error with %s: %s", category, e)
+                page_error = e
                 continue
         
-        if not properties_found:
-            print(f"  ⚠️ No properties found on page {page}")
+        if raise_errors and page_error is not None and not properties_found:
+            raise page_error
+        
+        if not properties_found and not blocked:
+            logger.info("  ⚠️ No properties found on page %d", page)
+        
+        validate_images(page_properties)
+        total += len(page_properties)
+        with_images += sum(1 for p in page_properties if p['image'])
+        yield from page_properties
+        if blocked:
+            break
     
     # Statistics
-    with_images = sum(1 for p in all_properties if p['image'])
-    print(f"\n{'='*60}")
-    print(f"✅ Total: {len(all_properties)} properties scraped from {city_name}")
-    if all_properties:
-        print(f"📸 Properties with images: {with_images}/{len(all_properties)} ({with_images/len(all_properties)*100:.1f}%)")
-    print(f"{'='*60}")
-    
-    return all_properties
+    logger.info("✅ Total: %d properties scraped from %s", total, city_name)
+    if total and not lazy_details:
+        logger.info("📸 Properties with images: %d/%d (%.1f%%)",
+                    with_images, total, with_images / total * 100)
 
-def scrape_olx_multiple_cities(cities=None, pages_per_city=1):
-    """Scrape multiple cities"""
+def scrape_olx_city(city_name, pages=2, start_page=1, lazy_details=False, raise_errors=False):
+    """Scrape property listings from OLX Pakistan"""
+    return list(iter_olx_city(city_name, pages, start_page, lazy_details, raise_errors))
+
+def scrape_olx_multiple_cities(cities=None, pages_per_city=1, journal=None):
+    """Scrape multiple cities
+    
+    With a journal (a CrawlJournal or a path), every completed page is
+    written to it and pages already in it are reloaded instead of fetched,
+    so a restarted crawl picks up where the last one stopped.
+    """
     if cities is None:
         cities = list(CITIES.keys())
     
+    journal, owned = open_journal(journal)
     all_results = {}
     
-    for city in cities:
-        print(f"\n{'*'*60}")
-        print(f"🔄 Switching to {city}")
-        print(f"{'*'*60}")
-        
-        properties = scrape_olx_city(city, pages=pages_per_city)
-        all_results[city] = properties
-        
-        # Delay between cities
-        if city != cities[-1]:
-            print(f"\n⏳ Waiting before next city...")
-            time.sleep(5)
+    try:
+        for city in cities:
+            logger.info("🔄 Switching to %s", city)
+            
+            if journal is None:
+                properties = scrape_olx_city(city, pages=pages_per_city)
+            else:
+                # Pages are crawled one at a time, so drop listings repeated across pages here
+                properties = []
+                seen_urls = set()
+                for page in range(1, pages_per_city + 1):
+                    page_properties = journal.crawl_page(
+                        'olx', city, page,
+                        lambda: scrape_olx_city(city, pages=1, start_page=page))
+                    for prop in page_properties:
+                        if prop['url'] not in seen_urls:
+                            seen_urls.add(prop['url'])
+                            properties.append(prop)
+            all_results[city] = properties
+            
+            # Delay between cities
+            if city != cities[-1]:
+                logger.info("⏳ Waiting before next city...")
+                time.sleep(5)
+    finally:
+        if owned:
+            journal.close()
     
     return all_results
 
 def save_to_json(data, filename):
     """Save scraped data to JSON file"""
+    if isinstance(data, list):
+        with JsonExporter(filename) as exporter:
+            exporter.write_many(data)
+        return
     with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    print(f"💾 Data saved to {filename}")
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    logger.info("💾 Data saved to %s", filename)
 
 def display_properties(properties, limit=5):
     """Display scraped properties"""
@@ -411,16 +548,28 @@ def display_properties(properties, limit=5):
 
 # ---------------- TEST ----------------
 if __name__ == "__main__":
+    import argparse
+    
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
+    parser = argparse.ArgumentParser(description='Scrape OLX.pk property listings for a city')
+    parser.add_argument('city', nargs='?', default='Lahore', help='Lahore, Karachi, Islamabad or Rawalpindi')
+    parser.add_argument('pages', nargs='?', type=int, default=1, help='number of pages (default 1)')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='json', help='output format (default json)')
+    parser.add_argument('--output', help='output file (default olx_<city>_<timestamp>.<format>)')
+    args = parser.parse_args()
+    
     print("🚀 Starting OLX.pk Property Scraper")
     print("="*60)
     
-    # Test with Lahore
-    results = scrape_olx_city("Lahore", pages=1)
+    # Stream listings to disk as they are scraped, a page's worth per chunk
+    filename = args.output or f"olx_{args.city.lower()}_{time.strftime('%Y%m%d_%H%M%S')}.{args.format}"
+    sample = []
+    with get_exporter(args.format, filename, chunk_size=PAGE_CHUNK_SIZE) as exporter:
+        for prop in iter_olx_city(args.city, pages=args.pages):
+            exporter.write(prop)
+            if len(sample) < 5:
+                sample.append(prop)
     
     # Display results
-    display_properties(results)
-    
-    # Save to file
-    if results:
-        filename = f"olx_lahore_{time.strftime('%Y%m%d_%H%M%S')}.json"
-        save_to_json(results, filename)
\ No newline at end of file
+    display_properties(sample)
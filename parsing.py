@@ -0,0 +1,98 @@
+"""
+Partial parsing of result pages.
+
+Each scraper describes the tags that can be listing cards with a predicate
+on (tag name, raw attributes). ListingStrainer hands that predicate to
+BeautifulSoup so only matching cards and their subtrees become tree nodes;
+headers, footers, scripts and ads are skipped while the HTML is tokenized.
+
+Every card selector a scraper uses is covered by its predicate, so card
+detection on the partial tree returns the same cards as on the full tree.
+When nothing matches (for example a redesign, where the scrapers fall back
+to scanning every div) the page is parsed again in full.
+"""
+import os
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+import metrics
+
+PARTIAL_PARSE = os.environ.get('PARTIAL_PARSE', '1') != '0'
+
+
+def class_list(attrs):
+    """The class attribute of a raw attribute dict as a list of names"""
+    value = attrs.get('class') or ''
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return value.split()
+
+
+def class_matches(attrs, pattern):
+    """Match a compiled regex against each class and the joined class string, like find_all(class_=...)"""
+    classes = class_list(attrs)
+    if not classes:
+        return False
+    return any(pattern.search(c) for c in classes) or bool(pattern.search(' '.join(classes)))
+
+
+def class_contains(attrs, fragment):
+    """CSS [class*="fragment"] on raw attributes"""
+    value = attrs.get('class') or ''
+    if isinstance(value, (list, tuple)):
+        value = ' '.join(value)
+    return fragment in value
+
+
+class ListingStrainer(SoupStrainer):
+    """SoupStrainer that keeps only tags accepted by predicate(name, attrs)"""
+
+    def __init__(self, predicate):
+        super().__init__()
+        self.predicate = predicate
+
+    # bs4 >= 4.13
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        return bool(self.predicate(name, attrs or {}))
+
+    # bs4 < 4.13
+    def search_tag(self, markup_name=None, markup_attrs={}):
+        if isinstance(markup_name, str):
+            return markup_name if self.predicate(markup_name, dict(markup_attrs or {})) else None
+        return super().search_tag(markup_name, markup_attrs)
+
+
+def parse_page(html, source, city, strainer=None):
+    """Build a soup for a result page, restricted to strainer when given"""
+    with metrics.timed('parse', source, city):
+        return BeautifulSoup(html, 'html.parser', parse_only=strainer)
+
+
+def free_tree(soup):
+    """Break up a parsed page so its nodes are freed now, not at the next cyclic GC
+
+    BeautifulSoup.decompose() leaves the tree linked: it walks next_element
+    from the root, which the parser leaves unset. Decomposing the top-level
+    nodes clears each one and everything under it.
+    """
+    for node in list(soup.contents):
+        node.decompose()
+
+
+def parse_listing_page(html, source, city, strainer, detect):
+    """Parse a result page and detect its cards, partially when possible
+
+    Returns (soup, cards). detect(soup) must return the page's cards.
+    """
+    if PARTIAL_PARSE and strainer is not None:
+        soup = parse_page(html, source, city, strainer)
+        with metrics.timed('detect', source, city):
+            cards = detect(soup)
+        if cards:
+            return soup, cards
+        free_tree(soup)
+
+    soup = parse_page(html, source, city)
+    with metrics.timed('detect', source, city):
+        cards = detect(soup)
+    return soup, cards
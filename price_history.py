@@ -0,0 +1,417 @@
+"""
+Columnar time series of listing prices.
+
+Every crawl appends one observation per listing: (timestamp, listing url,
+locality, price in rupees, area in marlas). Observations are stored column
+by column as .npy files in numbered segment directories, with listing urls
+and localities dictionary-encoded to integer ids, so queries are a handful of
+vectorized numpy passes over memory-mapped arrays:
+
+    store = PriceHistoryStore('price_history')
+    store.record_crawl(properties)
+    store.price_changes(city='Lahore', limit=20)
+    store.median_price_per_marla(city='Lahore', bucket='week')
+
+Small segments are merged once there are more than MAX_SEGMENTS of them.
+Segments that replace others (compaction, the locality migration) list
+what they replace in a marker file, so a store left half-rewritten by a
+crash is finished the next time it is opened. Needs numpy (pip install numpy).
+"""
+import contextlib
+import logging
+import os
+import shutil
+import threading
+import time
+
+from gazetteer import canonical_locality, get_locality, listing_locality_id
+from normalize import normalize_locality, parse_area_marla, parse_price
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = {
+    'ts': 'int64',
+    'url_id': 'int32',
+    'locality_id': 'int32',
+    'price': 'float64',
+    'area': 'float64',
+}
+
+BUCKETS = {
+    'day': 86400,
+    'week': 7 * 86400,
+    'month': 30 * 86400,
+}
+
+MAX_SEGMENTS = 32
+
+# In a segment: the segments it replaces, and the locality dictionary its ids index
+REPLACES_FILE = 'replaces.txt'
+LOCALITIES_FILE = 'localities.txt'
+
+# Anything cheaper is a price whose unit was lost in extraction
+MIN_PRICE = 10000
+
+
+def _group_order(groups, within):
+    """Indices that sort by groups, then by within
+
+    Packs the group and the rank of within into one int64 so a single
+    unstable argsort does the work of a much slower lexsort.
+    """
+    if not len(groups) or groups.max() >= 2 ** 31 or len(groups) >= 2 ** 32:
+        return np.lexsort((within, groups))
+    rank = np.empty(len(within), dtype=np.int64)
+    rank[np.argsort(within, kind='stable')] = np.arange(len(within))
+    return np.argsort((groups.astype(np.int64) << 32) | rank)
+
+
+def locality_key(prop):
+    """'city|locality' for a scraped property
+
+    The locality is the gazetteer id when the location names a known one, so
+    every spelling of a phase or sector groups together; otherwise it is the
+    lowercased location.
+    """
+    city = (prop.get('city') or '').strip().lower()
+    return f"{city}|{listing_locality_id(prop) or normalize_locality(prop.get('location'))}"
+
+
+class _Dictionary:
+    """Append-only string <-> id mapping persisted one string per line"""
+
+    def __init__(self, path):
+        self.path = path
+        self.values = []
+        self.ids = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    self._add(line.rstrip('\n'))
+
+    def _add(self, value):
+        self.ids[value] = len(self.values)
+        self.values.append(value)
+
+    def encode_many(self, values):
+        """ids for values, appending unseen ones to the file"""
+        new = []
+        ids = []
+        for value in values:
+            value = value.replace('\n', ' ')
+            if value not in self.ids:
+                self._add(value)
+                new.append(value)
+            ids.append(self.ids[value])
+        if new:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(''.join(v + '\n' for v in new))
+                f.flush()
+                os.fsync(f.fileno())
+        return ids
+
+    def __len__(self):
+        return len(self.values)
+
+
+class PriceHistoryStore:
+    def __init__(self, directory, max_segments=MAX_SEGMENTS):
+        if np is None:
+            raise RuntimeError("Price history needs numpy: pip install numpy")
+        self.directory = directory
+        self.max_segments = max_segments
+        self._segments_dir = os.path.join(directory, 'segments')
+        os.makedirs(self._segments_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._columns = None
+        # Bumped on every append, for ETags on the query endpoints
+        self.version = 0
+        with self._file_lock():
+            self._recover()
+            self.urls = _Dictionary(os.path.join(directory, 'urls.txt'))
+            self.localities = _Dictionary(os.path.join(directory, 'localities.txt'))
+            self._rekey_localities()
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """Keep other processes sharing the directory out while segments are rewritten"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, 'lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # --- writing ---------------------------------------------------------
+
+    def _segment_dirs(self):
+        return sorted(name for name in os.listdir(self._segments_dir) if name.isdigit())
+
+    def _replaced_by(self, name):
+        path = os.path.join(self._segments_dir, name, REPLACES_FILE)
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding='utf-8') as f:
+            return f.read().split()
+
+    def _segment_names(self):
+        """Segments holding live data; ones already replaced by a newer segment are left out"""
+        names = self._segment_dirs()
+        replaced = {old for name in names for old in self._replaced_by(name)}
+        return [name for name in names if name not in replaced]
+
+    def _write_segment(self, columns, replaces=(), localities=None):
+        names = self._segment_dirs()
+        name = '%08d' % (int(names[-1]) + 1 if names else 0)
+        tmp = os.path.join(self._segments_dir, name + '.tmp')
+        os.makedirs(tmp, exist_ok=True)
+        for column, dtype in COLUMNS.items():
+            np.save(os.path.join(tmp, column + '.npy'), np.asarray(columns[column], dtype=dtype))
+        if localities is not None:
+            with open(os.path.join(tmp, LOCALITIES_FILE), 'w', encoding='utf-8') as f:
+                f.write(''.join(value + '\n' for value in localities))
+        if replaces:
+            with open(os.path.join(tmp, REPLACES_FILE), 'w', encoding='utf-8') as f:
+                f.write('\n'.join(replaces))
+        # The rename makes the segment visible, and the ones it replaces invisible, in one step
+        os.rename(tmp, os.path.join(self._segments_dir, name))
+        return name
+
+    def _finish_replacement(self, name):
+        """Install the dictionary a replacing segment carries and delete the segments it replaced"""
+        segment = os.path.join(self._segments_dir, name)
+        localities = os.path.join(segment, LOCALITIES_FILE)
+        if os.path.exists(localities):
+            os.replace(localities, os.path.join(self.directory, 'localities.txt'))
+        for old in self._replaced_by(name):
+            shutil.rmtree(os.path.join(self._segments_dir, old), ignore_errors=True)
+        os.remove(os.path.join(segment, REPLACES_FILE))
+
+    def _replace_segments(self, names, columns, localities=None):
+        """Swap names for one segment of columns, whose locality ids index localities if given"""
+        self._finish_replacement(self._write_segment(columns, replaces=names, localities=localities))
+        if localities is not None:
+            self.localities = _Dictionary(self.localities.path)
+
+    def _recover(self):
+        """Finish rewrites a crash interrupted and drop segments that were never made visible"""
+        for name in os.listdir(self._segments_dir):
+            if name.endswith('.tmp'):
+                shutil.rmtree(os.path.join(self._segments_dir, name), ignore_errors=True)
+        for name in self._segment_dirs():
+            if os.path.exists(os.path.join(self._segments_dir, name, REPLACES_FILE)):
+                logger.warning("Finishing interrupted price history rewrite %s", name)
+                self._finish_replacement(name)
+
+    def append(self, observations):
+        """Store [(ts, url, locality, price, area_marla)]; returns the number stored"""
+        observations = [o for o in observations if o[1] and o[3]]
+        if not observations:
+            return 0
+        with self._lock, self._file_lock():
+            ts, urls, localities, prices, areas = zip(*observations)
+            self._write_segment({
+                'ts': ts,
+                'url_id': self.urls.encode_many(urls),
+                'locality_id': self.localities.encode_many(localities),
+                'price': prices,
+                'area': [a if a else np.nan for a in areas],
+            })
+            self._columns = None
+            self.version += 1
+            if len(self._segment_names()) > self.max_segments:
+                self._compact()
+        return len(observations)
+
+    def record_crawl(self, properties, ts=None):
+        """Append one observation per priced listing in a crawl result"""
+        ts = int(ts or time.time())
+        observations = []
+        for prop in properties:
+            price = parse_price(prop.get('price'))
+            if price is None or price < MIN_PRICE:
+                continue
+            observations.append((ts, prop.get('url'), locality_key(prop), price, parse_area_marla(prop.get('area'))))
+        stored = self.append(observations)
+        logger.debug("📈 Recorded %d price observations", stored)
+        return stored
+
+    def _compact(self):
+        names = self._segment_names()
+        columns = self._load(names)
+        self._replace_segments(names, columns)
+        logger.info("📦 Compacted %d price history segments (%d observations)", len(names), len(columns['ts']))
+
+    def compact(self):
+        with self._lock, self._file_lock():
+            self._compact()
+            self._columns = None
+
+    def _rekey_localities(self):
+        """Move observations stored under 'city|location text' to 'city|gazetteer id'
+
+        Stores written before the gazetteer keyed localities by their
+        normalized location text. Those that name a known locality are
+        merged into its id, in one compacted segment that carries the new
+        dictionary until it is installed.
+        """
+        values = self.localities.values
+        rekeyed = []
+        for value in values:
+            city, _, locality = value.partition('|')
+            rekeyed.append(f"{city}|{canonical_locality(locality, city)}")
+        if rekeyed == values:
+            return
+        new_values = list(dict.fromkeys(rekeyed))
+        new_ids = {value: i for i, value in enumerate(new_values)}
+        mapping = np.array([new_ids[value] for value in rekeyed], dtype=COLUMNS['locality_id'])
+
+        names = self._segment_names()
+        columns = dict(self._load(names))
+        columns['locality_id'] = mapping[columns['locality_id']]
+        self._replace_segments(names, columns, localities=new_values)
+        logger.info("📍 Moved %d price history localities to %d gazetteer ids",
+                    len(values), len(new_values))
+
+    # --- reading ---------------------------------------------------------
+
+    def _load(self, names):
+        parts = {column: [] for column in COLUMNS}
+        for name in names:
+            for column in COLUMNS:
+                parts[column].append(np.load(os.path.join(self._segments_dir, name, column + '.npy'), mmap_mode='r'))
+        return {
+            column: np.concatenate(arrays) if arrays else np.empty(0, dtype=COLUMNS[column])
+            for column, arrays in parts.items()
+        }
+
+    def columns(self):
+        """All observations as a dict of numpy arrays, cached until the next append"""
+        with self._lock:
+            if self._columns is None:
+                self._columns = self._load(self._segment_names())
+            return self._columns
+
+    def __len__(self):
+        return len(self.columns()['ts'])
+
+    def _locality_mask(self, locality_ids, city):
+        """Boolean mask over observations whose locality belongs to city"""
+        prefix = city.strip().lower() + '|'
+        in_city = np.array([value.startswith(prefix) for value in self.localities.values], dtype=bool)
+        return in_city[locality_ids]
+
+    def _select(self, city=None, since=None):
+        cols = self.columns()
+        mask = np.ones(len(cols['ts']), dtype=bool)
+        if city:
+            mask &= self._locality_mask(cols['locality_id'], city)
+        if since:
+            mask &= cols['ts'] >= since
+        if mask.all():
+            return cols
+        return {column: values[mask] for column, values in cols.items()}
+
+    def history(self, url):
+        """[(ts, price)] for one listing, oldest first"""
+        url_id = self.urls.ids.get(url)
+        if url_id is None:
+            return []
+        cols = self.columns()
+        mask = cols['url_id'] == url_id
+        order = np.argsort(cols['ts'][mask], kind='stable')
+        return list(zip(cols['ts'][mask][order].tolist(), cols['price'][mask][order].tolist()))
+
+    def price_changes(self, city=None, since=None, min_change=0.0, limit=50):
+        """Listings whose price moved between their first and last observation, biggest moves first"""
+        cols = self._select(city, since)
+        if not len(cols['ts']):
+            return []
+        order = _group_order(cols['url_id'], cols['ts'])
+        url_ids = cols['url_id'][order]
+        prices = cols['price'][order]
+        ts = cols['ts'][order]
+
+        starts = np.flatnonzero(np.r_[True, url_ids[1:] != url_ids[:-1]])
+        ends = np.r_[starts[1:], len(url_ids)] - 1
+        first, last = prices[starts], prices[ends]
+        change = last - first
+        pct = change / first * 100.0
+
+        moved = np.flatnonzero(np.abs(pct) > min_change)
+        moved = moved[np.argsort(-np.abs(pct[moved]), kind='stable')][:limit]
+        return [
+            {
+                'url': self.urls.values[url_ids[starts[i]]],
+                'first_price': float(first[i]),
+                'last_price': float(last[i]),
+                'change': float(change[i]),
+                'change_pct': round(float(pct[i]), 2),
+                'observations': int(ends[i] - starts[i] + 1),
+                'first_seen': int(ts[starts[i]]),
+                'last_seen': int(ts[ends[i]]),
+            }
+            for i in moved
+        ]
+
+    def median_price_per_marla(self, city=None, since=None, bucket='day'):
+        """Median rupees per marla for every (locality, time bucket)
+
+        Each listing counts once per bucket (its latest observation), so
+        listings that are re-crawled often do not outweigh the rest.
+        """
+        width = BUCKETS[bucket] if isinstance(bucket, str) else int(bucket)
+        cols = self._select(city, since)
+        valid = np.isfinite(cols['area']) & (cols['area'] > 0)
+        if not valid.any():
+            return []
+        ts = cols['ts'][valid]
+        buckets = ts // width
+        url_ids = cols['url_id'][valid].astype(np.int64)
+        locality_ids = cols['locality_id'][valid].astype(np.int64)
+        ppm = cols['price'][valid] / cols['area'][valid]
+
+        # Latest observation per (listing, bucket)
+        bucket_index = buckets - buckets.min()
+        n_buckets = int(bucket_index.max()) + 1
+        listing_key = url_ids * n_buckets + bucket_index
+        order = _group_order(listing_key, ts)
+        keys = listing_key[order]
+        latest = order[np.r_[keys[1:] != keys[:-1], True]]
+
+        group = locality_ids[latest] * n_buckets + bucket_index[latest]
+        values = ppm[latest]
+        order = _group_order(group, values)
+        group, values = group[order], values[order]
+        starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+        counts = np.diff(np.r_[starts, len(group)])
+        medians = (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2.0
+
+        base = int(buckets.min())
+        results = []
+        for start, count, median in zip(starts.tolist(), counts.tolist(), medians.tolist()):
+            locality_id, bucket_no = divmod(int(group[start]), n_buckets)
+            city_name, _, locality = self.localities.values[locality_id].partition('|')
+            known = get_locality(locality)
+            results.append({
+                'city': city_name,
+                'locality': locality,
+                'locality_name': known.name if known else None,
+                'bucket_start': (base + bucket_no) * width,
+                'median_price_per_marla': round(median, 2),
+                'listings': count,
+            })
+        return results
@@ -0,0 +1,140 @@
+"""
+Opt-in profiling of a single /scrape request.
+
+A request asks for profiling with ?profile=1, an X-Profile: 1 header or
+"profile": true in the JSON body. The crawl then runs under cProfile while a
+sampler thread records the request thread's stacks every few milliseconds.
+The report holds the cProfile call tree (time in BeautifulSoup construction,
+the div fallback scan, regexes, socket reads) and the sampled stacks in the
+collapsed format understood by flamegraph.pl and speedscope.
+
+Requests without the flag never touch this module beyond the flag check.
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+MAX_PROFILES = 20
+SAMPLE_INTERVAL = 0.005
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+
+_profiles = OrderedDict()
+_profiles_lock = threading.Lock()
+
+
+def profile_requested(request):
+    """True if the Flask request opted in to profiling"""
+    flag = request.args.get('profile') or request.headers.get('X-Profile')
+    if flag is None and request.is_json:
+        flag = (request.get_json(silent=True) or {}).get('profile')
+    return str(flag).lower() in ('1', 'true', 'yes')
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a background thread"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        """Stacks in collapsed flame-graph format, one 'a;b;c count' per line"""
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + '\n'
+
+
+class ProfileReport:
+    def __init__(self, profile_id, label, elapsed, stats_text, callees_text, collapsed):
+        self.id = profile_id
+        self.label = label
+        self.created = time.time()
+        self.elapsed = elapsed
+        self.stats_text = stats_text
+        self.callees_text = callees_text
+        self.collapsed = collapsed
+
+    def text(self):
+        return (
+            f"Profile {self.id} - {self.label}\n"
+            f"Wall time: {self.elapsed:.3f}s\n\n"
+            f"{'=' * 30} Functions by cumulative time {'=' * 30}\n{self.stats_text}\n"
+            f"{'=' * 30} Call tree (callees) {'=' * 30}\n{self.callees_text}"
+        )
+
+    def summary(self):
+        return {'id': self.id, 'label': self.label, 'created': self.created, 'elapsed': round(self.elapsed, 3)}
+
+
+def run_profiled(label, func, *args, **kwargs):
+    """Run func under cProfile and the stack sampler; return (result, ProfileReport)"""
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        result = profiler.runcall(func, *args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - started
+        sampler.stop()
+
+    stats_stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stats_stream).strip_dirs().sort_stats('cumulative')
+    stats.print_stats(60)
+    callees_stream = io.StringIO()
+    stats.stream = callees_stream
+    stats.print_callees(30)
+
+    report = ProfileReport(uuid.uuid4().hex[:12], label, elapsed, stats_stream.getvalue(),
+                           callees_stream.getvalue(), sampler.collapsed())
+    _store(report)
+    return result, report
+
+
+def _store(report):
+    with _profiles_lock:
+        _profiles[report.id] = report
+        while len(_profiles) > MAX_PROFILES:
+            _profiles.popitem(last=False)
+    if PROFILE_DIR:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, f"{report.id}.txt"), 'w', encoding='utf-8') as f:
+            f.write(report.text())
+        with open(os.path.join(PROFILE_DIR, f"{report.id}.collapsed"), 'w', encoding='utf-8') as f:
+            f.write(report.collapsed)
+
+
+def get_profile(profile_id):
+    with _profiles_lock:
+        return _profiles.get(profile_id)
+
+
+def list_profiles():
+    with _profiles_lock:
+        return [report.summary() for report in reversed(_profiles.values())]
@@ -1,9 +1,17 @@
-import requests
-from bs4 import BeautifulSoup
 import time
 import re
 from urllib.parse import urljoin
 import json
+import logging
+
+import metrics
+from fetching import fetch
+from gazetteer import match_locality
+from blocking import BlockedPageError, CircuitOpenError, check_result_page
+from image_proxy import validate_images
+from parsing import ListingStrainer, class_matches, free_tree, parse_listing_page
+
+logger = logging.getLogger(__name__)
 
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -95,6 +103,10 @@ def extract_property_data(card, city_name):
         area = 'N/A'
         card_text = card.get_text()
         
+        locality = match_locality(location if location != 'N/A' else card_text, city_name)
+        if location == 'N/A' and locality:
+            location = f"{locality.name}, {city_name}"
+        
         area_patterns = [
             r'(\d+[\.,]?\d*)\s*(Marla|marla)',
             r'(\d+[\.,]?\d*)\s*(Kanal|kanal)',
@@ -115,6 +127,7 @@ def extract_property_data(card, city_name):
         
         # --- ENHANCED IMAGE EXTRACTION ---
         image = None
+        image_alternatives = []
         
         # METHOD 1: Find all images and check all possible attributes
         all_images = card.find_all('img')
@@ -218,8 +231,9 @@ def extract_property_data(card, city_name):
                     f'https://www.property1.pk/storage/properties/{prop_id}.jpg',
                     f'https://www.property1.pk/images/properties/{prop_id}.jpg'
                 ]
-                # We can't verify these without making additional requests, but we can try the first one
+                # Unverified guesses: validate_images() keeps the first one that exists
                 image = possible_urls[0]
+                image_alternatives = possible_urls[1:]
         
         # --- LINK ---
         link = None
@@ -229,35 +243,54 @@ def extract_property_data(card, city_name):
             if href:
                 link = urljoin('https://www.property1.pk', href)
         
-        return {
+        prop = {
             'title': title[:120] + '...' if len(title) > 120 else title,
             'price': price,
             'location': location,
+            'locality_id': locality.id if locality else None,
             'area': area,
             'image': image,
             'url': link,
             'city': city_name,
             'source': 'Property1.pk'
         }
+        if image_alternatives:
+            prop['image_alternatives'] = image_alternatives
+        return prop
         
     except Exception as e:
-        print(f"Error extracting property: {e}")
+        logger.warning("Error extracting property: %s", e)
         return None
 
+CARD_SELECTORS = [
+    ('div', {'class': re.compile(r'listing-item|property-item|rtcl-listing-item', re.I)}),
+    ('div', {'class': re.compile(r'col.*?property', re.I)}),
+    ('article', {'class': re.compile(r'listing|property', re.I)}),
+    ('div', {'class': re.compile(r'item', re.I)}),
+    ('li', {'class': re.compile(r'listing', re.I)}),
+    ('div', {'class': re.compile(r'property-box', re.I)}),
+    ('div', {'data-rtcl': re.compile(r'listing', re.I)})
+]
+
+def is_card_tag(name, attrs):
+    """True for tags CARD_SELECTORS can match, used to parse only the cards"""
+    for tag, selector_attrs in CARD_SELECTORS:
+        if name != tag:
+            continue
+        for attr, pattern in selector_attrs.items():
+            if attr == 'class':
+                if class_matches(attrs, pattern):
+                    return True
+            elif attrs.get(attr) and pattern.search(attrs[attr]):
+                return True
+    return False
+
+CARD_STRAINER = ListingStrainer(is_card_tag)
+
 def find_property_cards(soup):
     """Find all property cards on the page"""
-    selectors = [
-        ('div', {'class': re.compile(r'listing-item|property-item|rtcl-listing-item', re.I)}),
-        ('div', {'class': re.compile(r'col.*?property', re.I)}),
-        ('article', {'class': re.compile(r'listing|property', re.I)}),
-        ('div', {'class': re.compile(r'item', re.I)}),
-        ('li', {'class': re.compile(r'listing', re.I)}),
-        ('div', {'class': re.compile(r'property-box', re.I)}),
-        ('div', {'data-rtcl': re.compile(r'listing', re.I)})
-    ]
-    
     cards = []
-    for tag, attrs in selectors:
+    for tag, attrs in CARD_SELECTORS:
         found = soup.find_all(tag, attrs)
         if found:
             cards.extend(found)
@@ -274,53 +307,91 @@ def find_property_cards(soup):
     
     return unique_cards
 
-def scrape_property1_city(city_name, pages=1):
-    """Scrape Property1.pk for a specific city"""
+def extract_properties(cards, city_name):
+    """Properties worth keeping among a result page's cards"""
+    properties = []
+    for card in cards[:20]:
+        prop = extract_property_data(card, city_name)
+        if prop and prop['title'] != 'N/A':
+            properties.append(prop)
+    return properties
+
+def parse_result_page(html, city_name):
+    """Properties on an already fetched result page, without touching the network"""
+    soup, cards = parse_listing_page(html, 'property1', city_name, CARD_STRAINER, find_property_cards)
+    properties = extract_properties(cards, city_name)
+    free_tree(soup)
+    return properties
+
+def iter_property1_city(city_name, pages=1, start_page=1, raise_errors=False):
+    """Yield Property1.pk properties for a city as each result page is extracted
+
+    Each page's parse tree is freed before its properties are yielded, so
+    memory does not grow with the number of pages.
+
+    With raise_errors a page that is blocked or fails to load raises
+    instead of being skipped, for callers that retry pages themselves.
+    """
     url = CITIES[city_name]
-    all_properties = []
     
-    print(f"\nScraping {city_name} from Property1.pk")
+    logger.info("Scraping %s from Property1.pk", city_name)
     
-    for page in range(1, pages + 1):
+    for page in range(start_page, start_page + pages):
         page_url = get_page_url(url, page)
-        print(f"  Page {page}: {page_url}")
+        logger.debug("  Page %d: %s", page, page_url)
         
+        page_properties = []
         try:
             # Add a longer delay for Property1
             time.sleep(3)
             
-            response = requests.get(page_url, headers=HEADERS, timeout=20)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Find property cards
-            cards = find_property_cards(soup)
+            response = fetch(page_url, 'property1', city_name, result_page=True, headers=HEADERS, timeout=20)
+            response.raise_for_status()
+            # Parse only the property cards
+            soup, cards = parse_listing_page(response.text, 'property1', city_name, CARD_STRAINER, find_property_cards)
+            check_result_page(page_url, 'property1', response.text, len(cards))
             
             if not cards:
-                print(f"  No cards found on page {page}")
+                logger.info("  No cards found on page %d", page)
                 continue
             
-            print(f"  Found {len(cards)} cards")
+            logger.debug("  Found %d cards", len(cards))
+            metrics.CARDS_FOUND.labels(source='property1', city=city_name).inc(len(cards[:20]))
             
             # Extract data from each card
-            page_properties = []
-            for card in cards[:20]:
-                prop = extract_property_data(card, city_name)
-                if prop and prop['title'] != 'N/A':
-                    page_properties.append(prop)
-                    all_properties.append(prop)
+            with metrics.timed('extract', 'property1', city_name):
+                page_properties = extract_properties(cards, city_name)
             
-            print(f"  Extracted {len(page_properties)} properties")
+            metrics.CARDS_KEPT.labels(source='property1', city=city_name).inc(len(page_properties))
             
             # Count properties with images
             images_found = sum(1 for p in page_properties if p.get('image'))
-            print(f"  Images found: {images_found}/{len(page_properties)}")
+            logger.info("  Page %d: extracted %d properties, images found: %d/%d",
+                        page, len(page_properties), images_found, len(page_properties))
             
-            # If no images, print debug info for first property
-            if images_found == 0 and page_properties:
-                print(f"  Debug - First property card HTML preview: {str(cards[0])[:500]}")
+            # If no images, log debug info for first property
+            if images_found == 0 and page_properties and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("  Debug - First property card HTML preview: %s", str(cards[0])[:500])
+            free_tree(soup)
+            del soup, cards, response
             
+        except (BlockedPageError, CircuitOpenError) as e:
+            metrics.PAGES_FAILED.labels(source='property1', city=city_name).inc()
+            logger.warning("🚧 Stopping %s crawl at page %d: %s", city_name, page, e)
+            if raise_errors:
+                raise
+            break
         except Exception as e:
-            print(f"  Error on page {page}: {e}")
+            metrics.PAGES_FAILED.labels(source='property1', city=city_name).inc()
+            logger.error("  Error on page %d: %s", page, e)
+            if raise_errors:
+                raise
             continue
-    
-    return all_properties
\ No newline at end of file
+        
+        # Drop images that do not exist, trying the other guessed URLs first
+        validate_images(page_properties)
+        yield from page_properties
+
+def scrape_property1_city(city_name, pages=1, start_page=1, raise_errors=False):
+    """Scrape Property1.pk for a specific city"""
+    return list(iter_property1_city(city_name, pages, start_page, raise_errors))
\ No newline at end of file
@@ -0,0 +1,146 @@
+"""
+Compressed, cache-validated JSON responses.
+
+json_response() serializes with orjson when it is installed (falling back to
+the standard json module), tags the body with a content-hash ETag, answers
+If-None-Match with 304 Not Modified, and compresses with brotli or gzip
+according to the request's Accept-Encoding. On POST /scrape the crawl has
+already run by then, so the 304 saves bandwidth only.
+
+GET endpoints whose data carries a version number use version_etag() and
+not_modified() instead, answering 304 before doing any of the work.
+
+brotli is optional (pip install brotli); without it only gzip is offered.
+"""
+import gzip
+import hashlib
+import json
+import os
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Versions restart when the process does; this keeps their ETags from matching old ones
+_PROCESS_TAG = os.urandom(8).hex()
+
+
+def dumps(payload):
+    """Serialize payload to UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def make_etag(body):
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def _accepted_encodings(header):
+    """Encodings from an Accept-Encoding header with a non-zero q value"""
+    accepted = set()
+    for part in (header or '').split(','):
+        pieces = part.strip().split(';')
+        name = pieces[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in pieces[1:]:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(name)
+    return accepted
+
+
+def choose_encoding(header):
+    accepted = _accepted_encodings(header)
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+def _etag_matches(header, etag):
+    """True if If-None-Match names etag in any content encoding"""
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        candidate = candidate.strip('"').split('-')[0]
+        if candidate == etag:
+            return True
+    return False
+
+
+def version_etag(version):
+    """ETag for the current request's URL while the data behind it is at version"""
+    return make_etag(f"{_PROCESS_TAG}|{request.full_path}|{version}".encode('utf-8'))
+
+
+def _not_modified_response(etag, headers):
+    response = Response(status=304, headers=headers)
+    response.headers['ETag'] = f'"{etag}"'
+    return response
+
+
+def not_modified(etag, headers=None):
+    """A 304 response if the request's If-None-Match names etag, otherwise None"""
+    if not _etag_matches(request.headers.get('If-None-Match'), etag):
+        return None
+    common_headers = {'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+    common_headers.update(headers or {})
+    return _not_modified_response(etag, common_headers)
+
+
+def json_response(payload, status=200, headers=None, etag=None):
+    """A JSON Response with ETag/304 handling and negotiated compression
+
+    etag defaults to a hash of the body; pass a version_etag() to skip hashing.
+    """
+    body = dumps(payload)
+    etag = etag or make_etag(body)
+    common_headers = {'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+    common_headers.update(headers or {})
+
+    if status == 200 and _etag_matches(request.headers.get('If-None-Match'), etag):
+        return _not_modified_response(etag, common_headers)
+
+    encoding = choose_encoding(request.headers.get('Accept-Encoding')) if len(body) >= MIN_COMPRESS_SIZE else None
+    if encoding:
+        body = compress(body, encoding)
+        common_headers['Content-Encoding'] = encoding
+        etag = f"{etag}-{encoding}"
+
+    response = Response(body, status=status, mimetype='application/json', headers=common_headers)
+    response.headers['ETag'] = f'"{etag}"'
+    return response
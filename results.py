@@ -0,0 +1,98 @@
+"""
+Server-side result sets behind /results/<result_id>.
+
+A /scrape request that asks for paging registers its listings under a
+result_id. "Load more" crawls extend the set, so the merged listing grows on
+the server and the browser fetches it a page at a time instead of holding
+and rendering all of it. Sets expire RESULT_SET_TTL after they were last
+used; past MAX_RESULT_SETS the least recently used go first.
+
+A set never changes once stored: its id is a hash of its content (and of
+the set it extends), so identical crawls get identical ids and /scrape
+bodies stay cacheable by ETag, and extending a set stores a new one
+instead of changing a set somebody else may be paging through.
+"""
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RESULT_SET_TTL = 1800
+MAX_RESULT_SETS = 500
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 200
+
+RESULT_SETS = metrics.Gauge('result_sets', 'Result sets held for paginated /results requests')
+
+
+class ResultStore:
+    def __init__(self, ttl=RESULT_SET_TTL, max_sets=MAX_RESULT_SETS):
+        self.ttl = ttl
+        self.max_sets = max_sets
+        self._sets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, result_id):
+        entry = self._sets.get(result_id)
+        if entry is None:
+            return None
+        if entry['expires'] < time.time():
+            del self._sets[result_id]
+            return None
+        entry['expires'] = time.time() + self.ttl
+        self._sets.move_to_end(result_id)
+        return entry
+
+    def add(self, properties, result_id=None):
+        """Store result_id's set extended by properties, or a new set; returns (new result_id, offset, total)
+
+        offset is the position of the first added property in the new set.
+        An unknown or expired result_id starts a new set.
+        """
+        digest = hashlib.sha256(json.dumps(properties, sort_keys=True, default=str).encode('utf-8'))
+        with self._lock:
+            base = self._get(result_id) if result_id else None
+            if base is not None:
+                digest.update(result_id.encode('ascii'))
+            new_id = digest.hexdigest()[:32]
+            offset = len(base['properties']) if base else 0
+            entry = self._get(new_id)
+            if entry is None:
+                entry = self._sets[new_id] = {
+                    'properties': (base['properties'] if base else []) + list(properties),
+                    'expires': time.time() + self.ttl,
+                }
+                while len(self._sets) > self.max_sets:
+                    self._sets.popitem(last=False)
+                RESULT_SETS.set(len(self._sets))
+            return new_id, offset, len(entry['properties'])
+
+    def page(self, result_id, page=1, page_size=DEFAULT_PAGE_SIZE):
+        """One page of a result set as a response dict, or None if the set has expired"""
+        if page < 1 or not 1 <= page_size <= MAX_PAGE_SIZE:
+            raise ValueError(f"page must be >= 1 and page_size between 1 and {MAX_PAGE_SIZE}")
+        with self._lock:
+            entry = self._get(result_id)
+            if entry is None:
+                return None
+            total = len(entry['properties'])
+            start = (page - 1) * page_size
+            properties = entry['properties'][start:start + page_size]
+        return {
+            'result_id': result_id,
+            'page': page,
+            'page_size': page_size,
+            'total': total,
+            'total_pages': math.ceil(total / page_size),
+            'properties': properties,
+        }
+
+    def __len__(self):
+        return len(self._sets)
@@ -0,0 +1,198 @@
+"""
+Demand-driven background refresh of popular /scrape queries.
+
+ResultCache keeps whole /scrape results per (source, city, pages) for a
+TTL. RefreshScheduler counts how often each combination is requested, with
+exponential decay so yesterday's hot query cools off, and a background
+thread re-crawls the most popular ones shortly before their cache entries
+expire. Refreshes draw from a global hourly crawl budget, so warming never
+turns into crawling everything all the time.
+"""
+import logging
+import math
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RESULT_TTL = 900
+REFRESH_AHEAD = 0.25
+POPULARITY_HALF_LIFE = 3600
+BUDGET_PER_HOUR = 30
+TOP_N = 10
+CHECK_INTERVAL = 15
+# Decayed request count a combination needs before it is refreshed: two
+# requests within a half-life, so a single request never keeps it warm
+MIN_REFRESH_SCORE = 1.5
+# Larger crawls are served from the cache but never refreshed in the background
+MAX_REFRESH_PAGES = 5
+
+CACHE_LOOKUPS = metrics.Counter('scrape_cache_lookups_total', 'Result cache lookups for /scrape', ['result'])
+REFRESHES = metrics.Counter('scrape_refreshes_total', 'Background re-crawls of popular queries', ['outcome'])
+REFRESH_BUDGET = metrics.Gauge('scrape_refresh_budget_tokens', 'Background crawls left in the refresh budget')
+
+
+class ResultCache:
+    """Whole /scrape results keyed by (source, city, pages)"""
+
+    def __init__(self, ttl=RESULT_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry['expires'] < time.time():
+            CACHE_LOOKUPS.labels(result='miss').inc()
+            return None
+        CACHE_LOOKUPS.labels(result='hit').inc()
+        return entry
+
+    def put(self, key, properties):
+        now = time.time()
+        with self._lock:
+            self._entries[key] = {'properties': properties, 'fetched_at': now, 'expires': now + self.ttl}
+
+    def expires_at(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry['expires'] if entry else None
+
+    def prune(self):
+        now = time.time()
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e['expires'] < now]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RefreshScheduler:
+    def __init__(self, cache, crawl, half_life=POPULARITY_HALF_LIFE, budget_per_hour=BUDGET_PER_HOUR,
+                 top_n=TOP_N, refresh_ahead=REFRESH_AHEAD, interval=CHECK_INTERVAL,
+                 min_score=MIN_REFRESH_SCORE, max_pages=MAX_REFRESH_PAGES):
+        self.cache = cache
+        self.crawl = crawl
+        self.half_life = half_life
+        self.budget_per_hour = budget_per_hour
+        self.top_n = top_n
+        self.refresh_ahead = refresh_ahead
+        self.interval = interval
+        self.min_score = min_score
+        self.max_pages = max_pages
+        self._scores = {}
+        self._tokens = float(budget_per_hour)
+        self._tokens_updated = time.time()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _decay(self, score, since, now):
+        return score * math.pow(0.5, (now - since) / self.half_life)
+
+    def record_request(self, key):
+        """Count one request for a (source, city, pages) combination; False if it is too big to refresh"""
+        if key[2] > self.max_pages:
+            return False
+        now = time.time()
+        with self._lock:
+            score, since = self._scores.get(key, (0.0, now))
+            self._scores[key] = (self._decay(score, since, now) + 1.0, now)
+        return True
+
+    def popular(self, n=None):
+        """[(key, score)] for the n most requested combinations"""
+        now = time.time()
+        with self._lock:
+            scored = [(key, self._decay(score, since, now)) for key, (score, since) in self._scores.items()]
+            # Forget combinations nobody has asked for in a long time
+            for key, score in scored:
+                if score < 0.01:
+                    del self._scores[key]
+        scored.sort(key=lambda item: -item[1])
+        return [(key, score) for key, score in scored if score >= 0.01][:n or self.top_n]
+
+    def _take_token(self):
+        now = time.time()
+        with self._lock:
+            self._tokens = min(self.budget_per_hour,
+                               self._tokens + (now - self._tokens_updated) * self.budget_per_hour / 3600.0)
+            self._tokens_updated = now
+            REFRESH_BUDGET.set(self._tokens)
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def due(self):
+        """Popular keys whose cache entry is missing or inside the refresh-ahead window, most popular first"""
+        now = time.time()
+        window = self.cache.ttl * self.refresh_ahead
+        due = []
+        for key, score in self.popular():
+            if score < self.min_score:
+                break
+            expires = self.cache.expires_at(key)
+            if expires is None or expires - now <= window:
+                due.append(key)
+        return due
+
+    def run_once(self):
+        """Refresh every due key the budget allows; return the number refreshed"""
+        refreshed = 0
+        for key in self.due():
+            if not self._take_token():
+                REFRESHES.labels(outcome='over_budget').inc()
+                break
+            source, city, pages = key
+            try:
+                properties = self.crawl(source, city, pages)
+                if properties:
+                    self.cache.put(key, properties)
+                    REFRESHES.labels(outcome='ok').inc()
+                    refreshed += 1
+                else:
+                    REFRESHES.labels(outcome='empty').inc()
+                logger.info("🔄 Refreshed %s/%s/%d: %d properties", source, city, pages, len(properties or []))
+            except Exception as e:
+                REFRESHES.labels(outcome='error').inc()
+                logger.warning("Refresh of %s failed: %s", key, e)
+        self.cache.prune()
+        return refreshed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Refresh scheduler pass failed")
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='refresh-scheduler')
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def state(self):
+        now = time.time()
+        return {
+            'budget_per_hour': self.budget_per_hour,
+            'budget_tokens': round(self._tokens, 2),
+            'cached_results': len(self.cache),
+            'popular': [
+                {
+                    'source': key[0], 'city': key[1], 'pages': key[2], 'score': round(score, 3),
+                    'expires_in': None if self.cache.expires_at(key) is None
+                    else round(self.cache.expires_at(key) - now, 1),
+                }
+                for key, score in self.popular()
+            ],
+        }
@@ -0,0 +1,85 @@
+"""
+Single-flight call coalescing.
+
+Concurrent callers asking for the same key share one execution: the first
+caller runs the function, the others block until it finishes and get the
+same result (or the same exception).
+
+    group = SingleFlight()
+    value, shared = group.do(url, fetch, url)
+
+AsyncSingleFlight does the same for coroutines on one event loop.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """Run func(*args, **kwargs) once per key at a time; returns (result, shared)
+
+        shared is True when this caller waited on somebody else's call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        """{key: number of callers waiting on it} for calls still running"""
+        with self._lock:
+            return {key: call.waiters for key, call in self._calls.items()}
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key, func, *args, **kwargs):
+        """Await func(*args, **kwargs) once per key at a time; returns (result, shared)
+
+        The call runs as its own task, so a caller that goes away (a client
+        disconnecting) does not cancel it for the others.
+        """
+        task = self._tasks.get(key)
+        shared = task is not None
+        if not shared:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        return await asyncio.shield(task), shared
+
+    def in_flight(self):
+        return list(self._tasks)
@@ -0,0 +1,250 @@
+"""
+Incrementally maintained market aggregates.
+
+Each listing's price per square foot is added to quantile sketches for
+every combination of city, locality, source and property type (including
+"any" for each), so GET /stats answers any filter by reading one sketch.
+The sketches are DDSketch-style log histograms: values land in buckets
+whose width grows with the value, quantiles are within RELATIVE_ACCURACY
+of the true value, and two sketches merge by adding bucket counts. Their
+size depends on the spread of prices, not on how many listings were added.
+
+Listings are keyed by url; when a listing is seen again its old value is
+taken out of the sketches before the new one goes in.
+"""
+import itertools
+import json
+import logging
+import math
+import os
+import threading
+
+from gazetteer import canonical_locality, get_locality, listing_locality_id, locality_id
+from normalize import normalize_locality, parse_area_sqft, parse_price, property_type
+
+logger = logging.getLogger(__name__)
+
+RELATIVE_ACCURACY = 0.01
+DIMENSIONS = ('city', 'locality', 'source', 'property_type')
+DEFAULT_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+
+class QuantileSketch:
+    """Mergeable log-bucketed histogram with relative-error quantiles"""
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+
+    def _index(self, value):
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def add(self, value, weight=1):
+        if value <= 0:
+            return
+        index = self._index(value)
+        count = self.buckets.get(index, 0) + weight
+        if count:
+            self.buckets[index] = count
+        else:
+            del self.buckets[index]
+        self.count += weight
+        self.total += value * weight
+
+    def remove(self, value):
+        self.add(value, -1)
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+
+    def quantile(self, q):
+        if self.count <= 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def summary(self, quantiles=DEFAULT_QUANTILES):
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 2) if self.count else None,
+            'percentiles': {
+                f"p{q * 100:g}": None if self.count <= 0 else round(self.quantile(q), 2)
+                for q in quantiles
+            },
+        }
+
+    def to_dict(self):
+        return {'relative_accuracy': self.relative_accuracy, 'count': self.count, 'total': self.total,
+                'buckets': dict(self.buckets)}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['relative_accuracy'])
+        sketch.buckets = {int(index): count for index, count in data['buckets'].items()}
+        sketch.count = data['count']
+        sketch.total = data['total']
+        return sketch
+
+
+def listing_dimensions(prop, source=None):
+    """(city, locality, source, property_type) for a scraped property
+
+    source should be the scraper name ('zameen', 'olx', ...); the listings'
+    own 'source' fields are display names and Zameen's do not have one.
+    """
+    return (
+        (prop.get('city') or '').strip().lower(),
+        listing_locality_id(prop) or normalize_locality(prop.get('location')),
+        (source or prop.get('source') or '').strip().lower(),
+        property_type(prop.get('title')),
+    )
+
+
+def resolve_locality(value, city=None):
+    """The locality dimension for a filter value: a gazetteer id, a name the gazetteer knows, or free text"""
+    value = value.strip()
+    if get_locality(value.lower()):
+        return value.lower()
+    return locality_id(value, city) or normalize_locality(value)
+
+
+def price_per_sqft(prop):
+    price = parse_price(prop.get('price'))
+    sqft = parse_area_sqft(prop.get('area'))
+    if not price or not sqft:
+        return None
+    return price / sqft
+
+
+def _rollups(dims):
+    """The 16 keys a listing contributes to: every subset of its dimensions, the rest as None"""
+    for mask in itertools.product((True, False), repeat=len(dims)):
+        yield tuple(value if keep else None for value, keep in zip(dims, mask))
+
+
+class MarketStats:
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self._sketches = {}
+        self._listings = {}
+        self._lock = threading.Lock()
+        # Bumped on every change, for /stats ETags
+        self.version = 0
+
+    def _sketch(self, key):
+        sketch = self._sketches.get(key)
+        if sketch is None:
+            sketch = self._sketches[key] = QuantileSketch(self.relative_accuracy)
+        return sketch
+
+    def add(self, prop, source=None):
+        """Fold one listing into the aggregates; returns False if it has no usable price or area"""
+        value = price_per_sqft(prop)
+        url = prop.get('url')
+        if value is None or not url:
+            return False
+        dims = listing_dimensions(prop, source)
+        with self._lock:
+            previous = self._listings.get(url)
+            if previous == (dims, value):
+                return True
+            if previous:
+                for key in _rollups(previous[0]):
+                    self._sketches[key].remove(previous[1])
+            for key in _rollups(dims):
+                self._sketch(key).add(value)
+            self._listings[url] = (dims, value)
+            self.version += 1
+        return True
+
+    def add_many(self, properties, source=None):
+        added = sum(1 for prop in properties if self.add(prop, source))
+        logger.debug("📊 Added %d listings to market stats", added)
+        return added
+
+    def query(self, quantiles=DEFAULT_QUANTILES, **filters):
+        """Summary of price per sqft for listings matching the given dimension values"""
+        key = []
+        for name in DIMENSIONS:
+            value = filters.get(name) or ''
+            if name == 'locality':
+                value = resolve_locality(value, filters.get('city'))
+            else:
+                value = value.strip().lower()
+            key.append(value or None)
+        key = tuple(key)
+        with self._lock:
+            sketch = self._sketches.get(key)
+            summary = sketch.summary(quantiles) if sketch else QuantileSketch().summary(quantiles)
+        summary['filters'] = {name: value for name, value in zip(DIMENSIONS, key) if value is not None}
+        return summary
+
+    def __len__(self):
+        return len(self._listings)
+
+    def save(self, path):
+        # Only copy under the lock; building and writing the JSON does not block add() and query()
+        with self._lock:
+            listings = list(self._listings.items())
+            sketches = [(key, sketch.to_dict()) for key, sketch in self._sketches.items()]
+        data = {
+            'relative_accuracy': self.relative_accuracy,
+            'listings': [[url, list(dims), value] for url, (dims, value) in listings],
+            'sketches': [[list(key), sketch] for key, sketch in sketches],
+        }
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        stats = cls()
+        if not os.path.exists(path):
+            return stats
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load market stats from %s: %s", path, e)
+            return stats
+        stats.relative_accuracy = data['relative_accuracy']
+        stats._listings = {url: (tuple(dims), value) for url, dims, value in data['listings']}
+        stats._sketches = {tuple(key): QuantileSketch.from_dict(sketch) for key, sketch in data['sketches']}
+        if stats._rekey_localities():
+            logger.info("📊 Moved market stats to gazetteer locality ids")
+        logger.info("📊 Loaded market stats for %d listings", len(stats._listings))
+        return stats
+
+    def _rekey_localities(self):
+        """Regroup listings saved under their location text by gazetteer locality id; True if any moved
+
+        The sketches are rebuilt from the listings, since a sketch keyed by the
+        old text cannot be split between the ids it now belongs to.
+        """
+        moved = False
+        for url, (dims, value) in self._listings.items():
+            locality = canonical_locality(dims[1], dims[0])
+            if locality != dims[1]:
+                self._listings[url] = ((dims[0], locality) + dims[2:], value)
+                moved = True
+        if moved:
+            self._sketches = {}
+            for dims, value in self._listings.values():
+                for key in _rollups(dims):
+                    self._sketch(key).add(value)
+        return moved
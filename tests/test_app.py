@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+pytest.importorskip('flask')
+for name, value in {'PRICE_HISTORY_DIR': '', 'STATS_PATH': '', 'REFRESH_SCHEDULER': '0',
+                    'PREFETCH_NEXT_PAGE': '0', 'HTML_ARCHIVE_DIR': ''}.items():
+    os.environ.setdefault(name, value)
+
+import app as app_module
+from cursors import encode_cursor
+
+
+@pytest.fixture
+def client(monkeypatch):
+    calls = []
+
+    def scraper(city, pages, start_page=1):
+        calls.append((city, start_page, pages))
+        return [{'title': f'{city} {start_page}', 'url': f'https://example.com/{city}/{start_page}'}]
+
+    for source in app_module.SCRAPERS:
+        monkeypatch.setitem(app_module.SCRAPERS, source, scraper)
+    client = app_module.app.test_client()
+    client.calls = calls
+    return client
+
+
+@pytest.mark.parametrize('body', [
+    {'source': 'property1', 'city': 'Nowhere'},
+    {'source': 'zameen', 'city': 'lahore'},
+    {'cursor': encode_cursor('property1', 'Nowhere', 2)},
+    {'cursor': encode_cursor('nowhere', 'Lahore', 2)},
+])
+def test_unknown_source_or_city_is_rejected_before_crawling(client, body):
+    response = client.post('/scrape', json=body)
+    assert response.status_code == 400
+    assert client.calls == []
+
+
+def test_cursor_continues_the_crawl(client):
+    response = client.post('/scrape', json={'cursor': encode_cursor('olx', 'Karachi', 3), 'pages': 2})
+    assert response.status_code == 200
+    assert response.get_json()['next_page'] == 5
+    assert client.calls == [('Karachi', 3, 2)]
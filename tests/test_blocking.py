@@ -0,0 +1,146 @@
+import pytest
+
+import blocking
+import fetching
+from blocking import BlockedPageError, CircuitBreaker, CircuitOpenError, check_result_page, classify_page
+
+PADDING = '<div class="filler">' + 'x' * blocking.MIN_PAGE_SIZE + '</div>'
+CHALLENGE_SCRIPT = '<script src="/cdn-cgi/challenge-platform/scripts/jsd/main.js"></script>'
+CAPTCHA_PAGE = '<html><head><title>Just a moment...</title></head><body>' + PADDING + '</body></html>'
+RESULTS_PAGE = '<html><head><title>Houses for sale in Lahore</title>' + CHALLENGE_SCRIPT + '</head><body>' + PADDING + '</body></html>'
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(blocking, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker(threshold=3, cooldown=300, max_cooldown=1200, probe_timeout=60)
+    monkeypatch.setattr(blocking, 'breaker', breaker)
+    monkeypatch.setattr(fetching, 'breaker', breaker)
+    return breaker
+
+
+@pytest.mark.parametrize('html, cards, verdict', [
+    (RESULTS_PAGE, 20, 'listings'),
+    (RESULTS_PAGE, 0, 'blocked'),
+    (CAPTCHA_PAGE, 0, 'blocked'),
+    ('<html><title>Lahore</title><body>' + PADDING + '</body></html>', 0, 'empty'),
+    ('<html></html>', 0, 'blocked'),
+])
+def test_classify_page(html, cards, verdict):
+    assert classify_page(html, cards) == verdict
+
+
+def test_challenge_script_on_a_real_page_is_not_a_block(breaker):
+    for _ in range(5):
+        assert check_result_page('https://www.zameen.com/Homes/Lahore-1-1.html', 'zameen', RESULTS_PAGE, 20) == 'listings'
+    assert breaker.state()['zameen.com']['state'] == 'closed'
+
+
+def test_challenge_script_without_cards_is_a_block(breaker):
+    with pytest.raises(BlockedPageError):
+        check_result_page('https://www.zameen.com/Homes/Lahore-1-1.html', 'zameen', RESULTS_PAGE, 0)
+    assert breaker.state()['zameen.com']['consecutive_blocks'] == 1
+
+
+def test_breaker_opens_after_threshold(breaker, clock):
+    for _ in range(3):
+        breaker.before_request('olx.com.pk')
+        breaker.record_block('olx.com.pk', 'HTTP 429')
+    with pytest.raises(CircuitOpenError) as e:
+        breaker.before_request('olx.com.pk')
+    assert e.value.retry_in == pytest.approx(300)
+
+
+def test_success_resets_the_count(breaker):
+    breaker.record_block('olx.com.pk')
+    breaker.record_block('olx.com.pk')
+    breaker.record_success('olx.com.pk')
+    breaker.record_block('olx.com.pk')
+    breaker.before_request('olx.com.pk')
+
+
+def open_breaker(breaker):
+    for _ in range(3):
+        breaker.record_block('olx.com.pk')
+
+
+def test_one_probe_after_cooldown_then_close(breaker, clock):
+    open_breaker(breaker)
+    clock.now += 301
+    breaker.before_request('olx.com.pk')
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request('olx.com.pk')
+    breaker.record_success('olx.com.pk')
+    breaker.before_request('olx.com.pk')
+    assert breaker.state()['olx.com.pk'] == {'state': 'closed', 'consecutive_blocks': 0, 'cooldown': 300, 'retry_in': 0}
+
+
+def test_blocked_probe_doubles_cooldown(breaker, clock):
+    open_breaker(breaker)
+    for cooldown in (600, 1200, 1200):
+        clock.now += 10000
+        breaker.before_request('olx.com.pk')
+        breaker.record_block('olx.com.pk')
+        assert breaker.state()['olx.com.pk']['cooldown'] == cooldown
+        assert breaker.state()['olx.com.pk']['state'] == 'open'
+
+
+def test_probe_that_never_reports_is_replaced(breaker, clock):
+    open_breaker(breaker)
+    clock.now += 301
+    breaker.before_request('olx.com.pk')
+    clock.now += 30
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request('olx.com.pk')
+    clock.now += 31
+    breaker.before_request('olx.com.pk')
+
+
+class FakeResponse:
+    def __init__(self, status_code, text=''):
+        self.status_code = status_code
+        self.text = text
+
+
+class FakeSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    def get(self, url, **kwargs):
+        return self.responses.pop(0)
+
+
+def test_fetch_rejects_challenge_titles_before_parsing(breaker):
+    with pytest.raises(BlockedPageError):
+        fetching.fetch('https://www.olx.com.pk/lahore/', 'olx', session=FakeSession(FakeResponse(200, CAPTCHA_PAGE)),
+                       result_page=True)
+    assert breaker.state()['olx.com.pk']['consecutive_blocks'] == 1
+
+
+def test_fetch_leaves_fingerprinted_pages_to_the_card_count(breaker):
+    response = fetching.fetch('https://www.olx.com.pk/lahore/', 'olx',
+                              session=FakeSession(FakeResponse(200, RESULTS_PAGE)), result_page=True)
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('status', [403, 429])
+def test_fetch_counts_block_statuses(breaker, status):
+    session = FakeSession(*[FakeResponse(status)] * 3)
+    for _ in range(3):
+        fetching.fetch('https://www.olx.com.pk/lahore/', 'olx', session=session)
+    with pytest.raises(CircuitOpenError):
+        fetching.fetch('https://www.olx.com.pk/lahore/', 'olx', session=session)
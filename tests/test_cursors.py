@@ -0,0 +1,79 @@
+import threading
+import time
+
+import pytest
+
+import cursors
+from cursors import PageCache, crawl_pages, decode_cursor, encode_cursor
+
+
+@pytest.mark.parametrize('source, city, page', [
+    ('zameen', 'Lahore', 2),
+    ('olx', 'Rawalpindi', 41),
+    ('property1', 'Islamabad', 1),
+])
+def test_cursor_round_trip(source, city, page):
+    cursor = encode_cursor(source, city, page)
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == (source, city, page)
+
+
+@pytest.mark.parametrize('cursor', [
+    'not a cursor',
+    '',
+    encode_cursor('zameen', 'Lahore', 0),
+    encode_cursor('zameen', 'Lahore', 'x'),
+])
+def test_malformed_cursors_raise_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_other_cursor_versions_are_rejected(monkeypatch):
+    monkeypatch.setattr(cursors, 'CURSOR_VERSION', 2)
+    cursor = encode_cursor('zameen', 'Lahore', 2)
+    monkeypatch.setattr(cursors, 'CURSOR_VERSION', 1)
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def scraper_for(calls):
+    def scraper(city, pages, start_page=1):
+        calls.append((start_page, pages))
+        return [f'{city} {page}' for page in range(start_page, start_page + pages)]
+    return scraper
+
+
+def test_crawl_pages_uses_leading_cached_pages():
+    cache = PageCache()
+    cache.put(('zameen', 'Lahore', 3), ['cached 3'])
+    calls = []
+    properties = crawl_pages(scraper_for(calls), 'zameen', 'Lahore', 3, 3, cache=cache)
+    assert properties == ['cached 3', 'Lahore 4', 'Lahore 5']
+    assert calls == [(4, 2)]
+
+
+def test_prefetched_page_is_served_from_cache():
+    cache = PageCache()
+    calls = []
+    scraper = scraper_for(calls)
+    assert cache.prefetch(('zameen', 'Lahore', 2), lambda: scraper('Lahore', 1, start_page=2))
+    assert not cache.prefetch(('zameen', 'Lahore', 2), lambda: scraper('Lahore', 1, start_page=2))
+    assert crawl_pages(scraper, 'zameen', 'Lahore', 2, 1, cache=cache) == ['Lahore 2']
+    assert calls == [(2, 1)]
+
+
+def test_crawl_pages_without_wait_does_not_block_on_prefetch():
+    cache = PageCache()
+    release = threading.Event()
+    cache.prefetch(('zameen', 'Lahore', 2), lambda: release.wait(5) and ['prefetched'])
+    started = time.time()
+    assert crawl_pages(scraper_for([]), 'zameen', 'Lahore', 2, 1, cache=cache, wait=False) == ['Lahore 2']
+    assert time.time() - started < 1
+    release.set()
+
+
+def test_expired_pages_are_dropped():
+    cache = PageCache(ttl=-1)
+    cache.put(('zameen', 'Lahore', 2), ['old'])
+    assert cache.get(('zameen', 'Lahore', 2)) is None
@@ -0,0 +1,134 @@
+import pytest
+
+import frontier
+from frontier import MAX_ATTEMPTS, RedisBackend, SQLiteBackend, Worker
+
+
+class FakeClock:
+    """Stands in for the time module so leases and rate buckets run on simulated seconds"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    monotonic = time
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(frontier, 'time', clock)
+    return clock
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteBackend(str(tmp_path / 'frontier.db'), shards=4)
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    return RedisBackend(client=fakeredis.FakeRedis(decode_responses=True), shards=4)
+
+
+def grants(backend, clock, rate, burst, seconds, step=0.1):
+    """Tokens granted to a caller asking every step seconds for the given simulated interval"""
+    granted = 0
+    end = clock.now + seconds
+    while clock.now < end:
+        if backend.acquire_rate_token('www.olx.com.pk', rate, burst) <= 0:
+            granted += 1
+        clock.now += step
+    return granted
+
+
+@pytest.mark.parametrize('rate, burst, seconds, expected', [
+    (0.2, 1, 5, 1),
+    (0.2, 1, 10.5, 3),
+    (0.5, 2, 10.5, 7),
+    (0.3, 1, 7, 3),
+])
+def test_rate_bucket_refills_at_rate(backend, clock, rate, burst, seconds, expected):
+    assert grants(backend, clock, rate, burst, seconds) == expected
+
+
+def test_backends_grant_the_same_tokens(tmp_path, monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    counts = []
+    for backend in (SQLiteBackend(str(tmp_path / 'frontier.db')),
+                    RedisBackend(client=fakeredis.FakeRedis(decode_responses=True))):
+        clock = FakeClock()
+        monkeypatch.setattr(frontier, 'time', clock)
+        counts.append(grants(backend, clock, 0.3, 2, 30, step=0.25))
+    assert counts[0] == counts[1] == 10
+
+
+def test_wait_is_time_until_next_token(backend, clock):
+    assert backend.acquire_rate_token('www.olx.com.pk', 0.2, 1) == 0
+    assert backend.acquire_rate_token('www.olx.com.pk', 0.2, 1) == pytest.approx(5)
+    clock.now += 2
+    assert backend.acquire_rate_token('www.olx.com.pk', 0.2, 1) == pytest.approx(3)
+
+
+def test_complete_needs_current_lease(backend, clock):
+    backend.add_tasks('job', [('zameen', 'Lahore', 1)])
+    task = backend.lease('job', 'a', lease_seconds=10)
+    clock.now += 11
+    stolen = backend.lease('job', 'b', lease_seconds=10)
+    assert stolen.id == task.id
+    assert not backend.complete('job', task, 'a', [{'title': 'stale'}])
+    assert backend.complete('job', stolen, 'b', [{'title': 'fresh'}])
+    assert backend.results('job') == [('zameen', 'Lahore', 1, [{'title': 'fresh'}])]
+
+
+def test_failed_tasks_are_retried_then_marked_failed(backend, clock):
+    backend.add_tasks('job', [('olx', 'Karachi', 2)])
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        task = backend.lease('job', 'a', lease_seconds=10)
+        assert task.attempts == attempt
+        backend.fail('job', task, 'a', 'HTTP 503')
+    assert backend.lease('job', 'a', lease_seconds=10) is None
+    assert backend.status('job') == {'failed': 1}
+
+
+def test_add_tasks_ignores_known_units(backend, clock):
+    backend.add_tasks('job', [('zameen', 'Lahore', 1), ('zameen', 'Lahore', 2)])
+    backend.add_tasks('job', [('zameen', 'Lahore', 2), ('zameen', 'Lahore', 3)])
+    assert backend.status('job') == {'pending': 3}
+
+
+def test_worker_retries_pages_that_raise(backend, clock):
+    backend.add_tasks('job', [('zameen', 'Lahore', 1), ('zameen', 'Lahore', 2)])
+    failures = {2: 1}
+
+    def scraper(city, pages, start_page=1):
+        if failures.get(start_page):
+            failures[start_page] -= 1
+            raise RuntimeError('server error')
+        return [{'title': f'{city} {start_page}'}]
+
+    worker = Worker(backend, worker_id='w1', rate_limits={}, scraper_for=lambda source: scraper)
+    worker.run('job', idle_timeout=0, poll_interval=0)
+    assert backend.status('job') == {'done': 2}
+    assert [page for _, _, page, _ in backend.results('job')] == [1, 2]
+
+
+def test_worker_throttles_every_request(clock):
+    class Backend:
+        calls = []
+
+        def acquire_rate_token(self, domain, rate, burst):
+            self.calls.append(domain)
+            return 0.0
+
+    worker = Worker.__new__(Worker)
+    worker.backend = Backend()
+    worker.rate_limits = {'www.olx.com.pk': (0.2, 1)}
+    worker._wait_for_rate_limit('https://www.olx.com.pk/lahore/q-house?page=3')
+    worker._wait_for_rate_limit('https://images.olx.com.pk/thumb.jpg')
+    assert Backend.calls == ['www.olx.com.pk']
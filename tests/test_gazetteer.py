@@ -0,0 +1,49 @@
+import pytest
+
+from gazetteer import canonical_locality, locality_id, match_locality
+
+
+@pytest.mark.parametrize('text, city, expected', [
+    # Spellings of one phase
+    ('D.H.A. Phase VI, Lahore', 'Lahore', 'lahore/dha-phase-6'),
+    ('Defence Phase 6', 'Lahore', 'lahore/dha-phase-6'),
+    ('DHA Phase-6', 'Lahore', 'lahore/dha-phase-6'),
+    ('Phase 6 DHA', 'Lahore', 'lahore/dha-phase-6'),
+    ('DHA Lahore', 'Lahore', 'lahore/dha'),
+    # A subdivision beats a longer name without a parent
+    ('Askari 10, Lahore Cantt', 'Lahore', 'lahore/askari-10'),
+    ('Lahore Cantt, Askari 10', 'Lahore', 'lahore/askari-10'),
+    ('Gulberg 3, near DHA Lahore', 'Lahore', 'lahore/gulberg-3'),
+    ('Johar Town Block R, Lahore', 'Lahore', 'lahore/johar-town-block-r'),
+    ('Lahore Cantt', 'Lahore', 'lahore/cantt'),
+    # Same depth: the longer name, then the first in the text
+    ('Bahria Orchard Phase 2, Bahria Town Sector C', 'Lahore', 'lahore/bahria-orchard-phase-2'),
+    ('Model Town Block A, Gulberg 2', 'Lahore', 'lahore/model-town-block-a'),
+    # The city decides between localities of the same name
+    ('DHA Phase 2', 'Rawalpindi', 'rawalpindi/dha-phase-2'),
+    ('Askari 14', 'Rawalpindi', 'rawalpindi/askari-14'),
+    ('Askari 14', 'Lahore', 'lahore/askari'),
+    # Islamabad sectors
+    ('Sector G-11/2, Islamabad', 'Islamabad', 'islamabad/g-11'),
+    ('F10 Markaz', 'Islamabad', 'islamabad/f-10'),
+    # Whole words only
+    ('Gulbergville', 'Lahore', None),
+    ('', 'Lahore', None),
+])
+def test_match_locality(text, city, expected):
+    match = match_locality(text, city)
+    assert (match.id if match else None) == expected
+
+
+def test_locality_id_without_city_searches_everywhere():
+    assert locality_id('Bahria Enclave Sector C') == 'islamabad/bahria-enclave-sector-c'
+
+
+@pytest.mark.parametrize('value, city, expected', [
+    ('dha phase 6, lahore', 'lahore', 'lahore/dha-phase-6'),
+    ('lahore/dha-phase-6', 'lahore', 'lahore/dha-phase-6'),
+    ('some street', 'lahore', 'some street'),
+    ('', 'lahore', ''),
+])
+def test_canonical_locality(value, city, expected):
+    assert canonical_locality(value, city) == expected
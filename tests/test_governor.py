@@ -0,0 +1,166 @@
+import threading
+import time
+
+import pytest
+
+from governor import CrawlGovernor, GovernorBusyError, parse_limits
+
+
+def run_in_thread(func, *args, **kwargs):
+    """Start func on a thread; returns a dict that gets 'result' or 'error' when it finishes"""
+    outcome = {}
+
+    def target():
+        try:
+            outcome['result'] = func(*args, **kwargs)
+        except Exception as e:
+            outcome['error'] = e
+
+    outcome['thread'] = thread = threading.Thread(target=target)
+    thread.start()
+    return outcome
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('condition not reached')
+        time.sleep(0.005)
+
+
+class Crawl:
+    """A crawl that blocks until released and counts how often it ran"""
+
+    def __init__(self, value='listings'):
+        self.value = value
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.release.wait(5)
+        return self.value
+
+
+def test_parse_limits():
+    assert parse_limits('zameen=2, olx=1,,property1=0,bad') == {'zameen': 2, 'olx': 1, 'property1': 1}
+    assert parse_limits(None) == {}
+
+
+def test_identical_crawls_share_one_run():
+    governor = CrawlGovernor(default_limit=2)
+    crawl = Crawl()
+    outcomes = [run_in_thread(governor.run, 'zameen', ('zameen', 'Lahore', 1, 1), crawl) for _ in range(5)]
+    wait_until(lambda: governor.state()['sources']['zameen']['running'][0]['waiters'] == 4)
+    crawl.release.set()
+    for outcome in outcomes:
+        outcome['thread'].join()
+    assert crawl.calls == 1
+    assert sorted(o['result'][1]['coalesced'] for o in outcomes) == [False] + [True] * 4
+    assert {o['result'][0] for o in outcomes} == {'listings'}
+
+
+def test_limit_queues_crawls_in_order():
+    governor = CrawlGovernor(default_limit=1)
+    first, second, third = Crawl('a'), Crawl('b'), Crawl('c')
+    running = run_in_thread(governor.run, 'olx', 'a', first)
+    wait_until(lambda: first.calls == 1)
+    queued = [run_in_thread(governor.run, 'olx', 'b', second, ticket='t-b')]
+    wait_until(lambda: governor.position('t-b') and governor.position('t-b')['state'] == 'queued')
+    queued.append(run_in_thread(governor.run, 'olx', 'c', third, ticket='t-c'))
+    wait_until(lambda: governor.position('t-c') and governor.position('t-c')['position'] == 2)
+    assert second.calls == third.calls == 0
+
+    first.release.set()
+    wait_until(lambda: second.calls == 1)
+    assert third.calls == 0
+    assert governor.position('t-c')['position'] == 1
+    second.release.set()
+    third.release.set()
+    for outcome in [running] + queued:
+        outcome['thread'].join()
+    assert queued[1]['result'][1]['queue_position'] == 2
+    assert governor.position('t-c') is None
+
+
+def test_sources_have_separate_limits():
+    governor = CrawlGovernor(limits={'olx': 1}, default_limit=2)
+    crawl = Crawl()
+    outcomes = [run_in_thread(governor.run, 'zameen', key, crawl) for key in ('a', 'b')]
+    wait_until(lambda: crawl.calls == 2)
+    with pytest.raises(GovernorBusyError):
+        governor.run('zameen', 'c', crawl, wait=False)
+    assert governor.run('olx', 'd', lambda: 'olx', wait=False)[0] == 'olx'
+    crawl.release.set()
+    for outcome in outcomes:
+        outcome['thread'].join()
+
+
+def test_wait_false_caller_is_turned_away_but_waiting_joiner_is_not():
+    governor = CrawlGovernor(default_limit=1)
+    blocker = Crawl()
+    holder = run_in_thread(governor.run, 'zameen', 'busy', blocker)
+    wait_until(lambda: blocker.calls == 1)
+
+    # The follower joins the flight started by a caller that will not wait
+    crawl = Crawl()
+    original = governor._crawl
+    joined = threading.Event()
+
+    def slow_crawl(*args):
+        joined.wait(2)
+        return original(*args)
+
+    governor._crawl = slow_crawl
+    refresh = run_in_thread(governor.run, 'zameen', 'key', crawl, wait=False)
+    wait_until(lambda: 'key' in governor._flights.in_flight())
+    user = run_in_thread(governor.run, 'zameen', 'key', crawl)
+    wait_until(lambda: governor._flights.in_flight().get('key') == 1)
+    joined.set()
+    refresh['thread'].join()
+    assert isinstance(refresh['error'], GovernorBusyError)
+
+    blocker.release.set()
+    crawl.release.set()
+    holder['thread'].join()
+    user['thread'].join()
+    assert user['result'][0] == 'listings'
+    assert crawl.calls == 1
+
+
+def test_full_queue_rejects_new_crawls():
+    governor = CrawlGovernor(default_limit=1, max_queue=1)
+    crawl = Crawl()
+    running = run_in_thread(governor.run, 'olx', 'a', crawl)
+    wait_until(lambda: crawl.calls == 1)
+    queued = run_in_thread(governor.run, 'olx', 'b', crawl)
+    wait_until(lambda: governor.state()['sources']['olx']['queued'])
+    with pytest.raises(GovernorBusyError):
+        governor.run('olx', 'c', crawl)
+    crawl.release.set()
+    running['thread'].join()
+    queued['thread'].join()
+
+
+def test_queue_timeout_gives_up_and_frees_the_place():
+    governor = CrawlGovernor(default_limit=1, queue_timeout=0.05)
+    crawl = Crawl()
+    running = run_in_thread(governor.run, 'olx', 'a', crawl)
+    wait_until(lambda: crawl.calls == 1)
+    with pytest.raises(GovernorBusyError):
+        governor.run('olx', 'b', crawl)
+    assert governor.state()['sources']['olx']['queued'] == []
+    crawl.release.set()
+    running['thread'].join()
+
+
+def test_failed_crawl_releases_its_slot():
+    governor = CrawlGovernor(default_limit=1)
+
+    def broken():
+        raise RuntimeError('upstream down')
+
+    with pytest.raises(RuntimeError):
+        governor.run('olx', 'a', broken)
+    assert governor.run('olx', 'b', lambda: 'ok', wait=False)[0] == 'ok'
@@ -0,0 +1,148 @@
+import os
+import threading
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import price_history
+from price_history import PriceHistoryStore
+
+# Observations as a store written before the gazetteer keyed them: by location text
+OLD_OBSERVATIONS = [
+    (1000, 'u1', 'lahore|dha phase 6, lahore', 2e7, 10),
+    (1000, 'u2', 'lahore|defence phase 6', 3e7, 10),
+    (1000, 'u3', 'lahore|some street', 1e7, 5),
+    (90000, 'u1', 'lahore|lahore/dha-phase-6', 2.2e7, 10),
+    (1000, 'u4', 'karachi|dha phase 6', 1e7, 5),
+]
+
+
+class Crash(Exception):
+    pass
+
+
+def old_store(path):
+    store = PriceHistoryStore(str(path))
+    store.append(OLD_OBSERVATIONS[:4])
+    store.append(OLD_OBSERVATIONS[4:])
+    return store
+
+
+def localities_by_url(store):
+    cols = store.columns()
+    return sorted((store.urls.values[u], store.localities.values[l])
+                  for u, l in zip(cols['url_id'].tolist(), cols['locality_id'].tolist()))
+
+
+EXPECTED = [
+    ('u1', 'lahore|lahore/dha-phase-6'),
+    ('u1', 'lahore|lahore/dha-phase-6'),
+    ('u2', 'lahore|lahore/dha-phase-6'),
+    ('u3', 'lahore|some street'),
+    ('u4', 'karachi|karachi/dha-phase-6'),
+]
+
+
+def test_open_moves_location_text_to_gazetteer_ids(tmp_path):
+    old_store(tmp_path)
+    store = PriceHistoryStore(str(tmp_path))
+    assert store.localities.values == ['lahore|lahore/dha-phase-6', 'lahore|some street', 'karachi|karachi/dha-phase-6']
+    assert localities_by_url(store) == EXPECTED
+    assert len(store._segment_names()) == 1
+
+
+def test_rekey_is_done_once(tmp_path):
+    old_store(tmp_path)
+    PriceHistoryStore(str(tmp_path))
+    segments = os.listdir(tmp_path / 'segments')
+    store = PriceHistoryStore(str(tmp_path))
+    assert os.listdir(tmp_path / 'segments') == segments
+    assert localities_by_url(store) == EXPECTED
+
+
+@pytest.mark.parametrize('crash_at', ['rename', 'dictionary', 'delete'])
+def test_interrupted_rekey_is_finished_on_next_open(tmp_path, monkeypatch, crash_at):
+    old_store(tmp_path)
+    real_rename, real_replace, real_rmtree = os.rename, os.replace, price_history.shutil.rmtree
+
+    def rename(src, dst):
+        if crash_at == 'rename':
+            raise Crash()
+        real_rename(src, dst)
+
+    def replace(src, dst):
+        if crash_at == 'dictionary':
+            raise Crash()
+        real_replace(src, dst)
+
+    def rmtree(path, **kwargs):
+        if crash_at == 'delete':
+            raise Crash()
+        real_rmtree(path, **kwargs)
+
+    monkeypatch.setattr(price_history.os, 'rename', rename)
+    monkeypatch.setattr(price_history.os, 'replace', replace)
+    monkeypatch.setattr(price_history.shutil, 'rmtree', rmtree)
+    with pytest.raises(Crash):
+        PriceHistoryStore(str(tmp_path))
+    monkeypatch.undo()
+
+    store = PriceHistoryStore(str(tmp_path))
+    assert localities_by_url(store) == EXPECTED
+    assert store._segment_dirs() == store._segment_names()
+
+
+def test_replaced_segments_are_hidden_before_they_are_deleted(tmp_path):
+    store = PriceHistoryStore(str(tmp_path))
+    store.append([(1000, 'u1', 'lahore|some street', 1e7, 5)])
+    store.append([(2000, 'u1', 'lahore|some street', 1.1e7, 5)])
+    names = store._segment_names()
+    store._write_segment(store._load(names), replaces=names)
+    assert len(store._segment_dirs()) == 3
+    assert len(store) == 2
+
+
+def test_concurrent_opens_rekey_once(tmp_path):
+    old_store(tmp_path)
+    stores = []
+    threads = [threading.Thread(target=lambda: stores.append(PriceHistoryStore(str(tmp_path)))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(stores) == 4
+    for store in stores:
+        assert localities_by_url(store) == EXPECTED
+
+
+def test_median_price_per_marla_groups_by_locality(tmp_path):
+    old_store(tmp_path)
+    store = PriceHistoryStore(str(tmp_path))
+    rows = {(row['locality'], row['bucket_start']): row for row in store.median_price_per_marla(city='Lahore')}
+    assert rows[('lahore/dha-phase-6', 0)]['listings'] == 2
+    assert rows[('lahore/dha-phase-6', 0)]['median_price_per_marla'] == pytest.approx(2.5e6)
+
+
+def test_compaction_merges_segments(tmp_path):
+    store = PriceHistoryStore(str(tmp_path), max_segments=3)
+    for ts in range(4):
+        store.append([(ts, 'u1', 'lahore|some street', 1e7 + ts, 5)])
+    assert len(store._segment_names()) == 1
+    assert store.history('u1') == [(ts, 1e7 + ts) for ts in range(4)]
+
+
+def test_interrupted_compaction_does_not_duplicate(tmp_path, monkeypatch):
+    store = PriceHistoryStore(str(tmp_path))
+    for ts in range(3):
+        store.append([(ts, 'u1', 'lahore|some street', 1e7, 5)])
+
+    def rmtree(path, **kwargs):
+        raise Crash()
+
+    monkeypatch.setattr(price_history.shutil, 'rmtree', rmtree)
+    with pytest.raises(Crash):
+        store.compact()
+    monkeypatch.undo()
+    assert len(PriceHistoryStore(str(tmp_path))) == 3
+    assert len(store._segment_dirs()) == 1
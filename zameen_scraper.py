@@ -1,19 +1,33 @@
 import requests
-from bs4 import BeautifulSoup
 import time
 import re
 from urllib.parse import urljoin
 import json
 import random
+import logging
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 
-# Configure retry strategy
-retry_strategy = Retry(
+import metrics
+from fetching import InstrumentedRetry, fetch
+from gazetteer import match_locality
+from blocking import BlockedPageError, CircuitOpenError, check_result_page
+from image_proxy import is_placeholder, validate_images
+from parsing import ListingStrainer, class_contains, free_tree, parse_listing_page
+from journal import open_journal
+from exporters import EXPORT_FORMATS, PAGE_CHUNK_SIZE, JsonExporter, get_exporter
+
+logger = logging.getLogger(__name__)
+
+# Configure retry strategy. 429s are not retried here: fetch() has to see them
+# so the circuit breaker counts them as blocks and backs off. Once retries
+# run out the last response is returned rather than raised, for the same reason.
+retry_strategy = InstrumentedRetry(
+    source='zameen',
     total=3,
     backoff_factor=1,
-    status_forcelist=[429, 500, 502, 503, 504],
-    allowed_methods=["HEAD", "GET", "OPTIONS"]
+    status_forcelist=[500, 502, 503, 504],
+    allowed_methods=["HEAD", "GET", "OPTIONS"],
+    raise_on_status=False,
 )
 
 adapter = HTTPAdapter(max_retries=retry_strategy)
@@ -87,6 +101,48 @@ def extract_area_from_text(text):
     
     return 'N/A'
 
+CARD_SELECTORS = [
+    'li[role="article"]',
+    'article[class*="card"]',
+    'div[class*="property-card"]',
+    'div[class*="listing-card"]',
+    'div[class*="card"]',
+]
+
+def is_card_tag(name, attrs):
+    """True for tags CARD_SELECTORS can match, used to parse only the cards"""
+    if name == 'li':
+        return attrs.get('role') == 'article'
+    if name in ('article', 'div'):
+        return class_contains(attrs, 'card')
+    return False
+
+CARD_STRAINER = ListingStrainer(is_card_tag)
+
+def find_property_cards(soup):
+    """Find property cards on a results page"""
+    cards = []
+    for selector in CARD_SELECTORS:
+        found_cards = soup.select(selector)
+        if found_cards:
+            cards = found_cards
+            logger.debug("  Found %d cards with selector: %s", len(cards), selector)
+            break
+    
+    if not cards:
+        all_divs = soup.find_all('div', recursive=True)
+        potential_cards = []
+        for div in all_divs:
+            div_text = div.get_text().lower()
+            if all(keyword in div_text for keyword in ['pk', 'crore', 'marla', 'kanal']):
+                if len(div.get_text()) > 50:
+                    potential_cards.append(div)
+        if potential_cards:
+            cards = potential_cards[:20]
+            logger.debug("  Found %d potential property divs", len(cards))
+    
+    return cards
+
 def extract_property_data(card, city_name):
     """Extract property data from a card"""
     try:
@@ -149,16 +205,9 @@ def extract_property_data(card, city_name):
                     location = location_text
                     break
         
-        if location == 'N/A':
-            location_patterns = [
-                r'([A-Za-z\s]+(?:Phase|Sector|Block|Town|City)[\s\d,]+[A-Za-z\s]*)',
-                r'(?:Location|Address)[:\s]*([^,]+(?:,[^,]+){0,2})',
-            ]
-            for pattern in location_patterns:
-                match = re.search(pattern, card_text, re.IGNORECASE)
-                if match:
-                    location = clean_text(match.group(1))
-                    break
+        locality = match_locality(location if location != 'N/A' else card_text, city_name)
+        if location == 'N/A' and locality:
+            location = f"{locality.name}, {city_name}"
         
         # Extract AREA
         area = 'N/A'
@@ -184,7 +233,9 @@ def extract_property_data(card, city_name):
         image = None
         img = card.find('img')
         if img:
-            image = img.get('src') or img.get('data-src')
+            # src is often a lazy-load placeholder with the real photo in data-src
+            sources = [img.get(attr) for attr in ('src', 'data-src', 'data-original')]
+            image = next((s for s in sources if s and not is_placeholder(s)), None)
             if image:
                 if image.startswith('//'):
                     image = 'https:' + image
@@ -207,6 +258,7 @@ def extract_property_data(card, city_name):
             'title': title if title and len(title) > 5 else 'N/A',
             'price': price,
             'location': location,
+            'locality_id': locality.id if locality else None,
             'area': area,
             'image': image,
             'url': url,
@@ -214,17 +266,40 @@ def extract_property_data(card, city_name):
         }
         
     except Exception as e:
-        print(f"Error extracting property: {e}")
+        logger.warning("Error extracting property: %s", e)
         return None
 
-def scrape_zameen_city(city_name, pages=1, delay=2):
-    """Main function to scrape Zameen.com for a specific city"""
+def extract_properties(cards, city_name):
+    """Properties worth keeping among a result page's cards"""
+    properties = []
+    for i, card in enumerate(cards[:20]):
+        prop = extract_property_data(card, city_name)
+        if prop and prop['title'] != 'N/A' and prop['price'] != 'N/A':
+            properties.append(prop)
+            logger.debug("  ✓ Property %d: %s... | %s", i + 1, prop['title'][:50], prop['price'])
+    return properties
+
+def parse_result_page(html, city_name):
+    """Properties on an already fetched result page, without touching the network"""
+    soup, cards = parse_listing_page(html, 'zameen', city_name, CARD_STRAINER, find_property_cards)
+    properties = extract_properties(cards, city_name)
+    free_tree(soup)
+    return properties
+
+def iter_zameen_city(city_name, pages=1, delay=2, start_page=1, raise_errors=False):
+    """Yield Zameen.com properties for a city as each result page is extracted
+
+    Each page's parse tree is freed before its properties are yielded, so
+    memory does not grow with the number of pages.
+
+    With raise_errors a page that is blocked or fails to load raises
+    instead of being skipped, for callers that retry pages themselves.
+    """
     if city_name not in CITIES:
-        print(f"City {city_name} not found in CITIES dictionary")
-        return []
+        logger.warning("City %s not found in CITIES dictionary", city_name)
+        return
     
     base_url = CITIES[city_name]
-    all_properties = []
     
     # Rotate user agent
     headers = {
@@ -236,90 +311,102 @@ def scrape_zameen_city(city_name, pages=1, delay=2):
         'Upgrade-Insecure-Requests': '1',
     }
     
-    for page in range(1, pages + 1):
+    for page in range(start_page, start_page + pages):
         if page == 1:
             page_url = base_url
         else:
             page_url = re.sub(r'-\d+\.html$', f'-{page}.html', base_url)
         
+        page_properties = []
         try:
-            print(f"🌐 Scraping {city_name} - Page {page}: {page_url}")
+            logger.debug("🌐 Scraping %s - Page %d: %s", city_name, page, page_url)
             
-            response = requests.get(page_url, headers=headers, timeout=20)
+            # Captcha pages and empty shells raise here, before the div fallback gets to scan them
+            response = fetch(page_url, 'zameen', city_name, session=http, result_page=True, headers=headers, timeout=20)
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Find property cards
-            cards = []
-            card_selectors = [
-                'li[role="article"]',
-                'article[class*="card"]',
-                'div[class*="property-card"]',
-                'div[class*="listing-card"]',
-                'div[class*="card"]',
-            ]
-            
-            for selector in card_selectors:
-                found_cards = soup.select(selector)
-                if found_cards:
-                    cards = found_cards
-                    print(f"  Found {len(cards)} cards with selector: {selector}")
-                    break
+            # Parse only the property cards
+            soup, cards = parse_listing_page(response.text, 'zameen', city_name, CARD_STRAINER, find_property_cards)
+            check_result_page(page_url, 'zameen', response.text, len(cards))
             
-            if not cards:
-                all_divs = soup.find_all('div', recursive=True)
-                potential_cards = []
-                for div in all_divs:
-                    div_text = div.get_text().lower()
-                    if all(keyword in div_text for keyword in ['pk', 'crore', 'marla', 'kanal']):
-                        if len(div.get_text()) > 50:
-                            potential_cards.append(div)
-                if potential_cards:
-                    cards = potential_cards[:20]
-                    print(f"  Found {len(cards)} potential property divs")
+            metrics.CARDS_FOUND.labels(source='zameen', city=city_name).inc(len(cards[:20]))
             
             # Process cards
-            for i, card in enumerate(cards[:20]):
-                prop = extract_property_data(card, city_name)
-                if prop and prop['title'] != 'N/A' and prop['price'] != 'N/A':
-                    all_properties.append(prop)
-                    print(f"  ✓ Property {i+1}: {prop['title'][:50]}... | {prop['price']}")
+            with metrics.timed('extract', 'zameen', city_name):
+                page_properties = extract_properties(cards, city_name)
+            kept = len(page_properties)
             
-            print(f"  ✅ Extracted {len([p for p in cards[:20] if p])} properties from page {page}")
-            time.sleep(delay)
+            metrics.CARDS_KEPT.labels(source='zameen', city=city_name).inc(kept)
+            logger.info("✅ %s page %d: kept %d of %d cards", city_name, page, kept, len(cards[:20]))
+            free_tree(soup)
+            del soup, cards, response
             
+        except (BlockedPageError, CircuitOpenError) as e:
+            # More requests now would only prolong the block
+            metrics.PAGES_FAILED.labels(source='zameen', city=city_name).inc()
+            logger.warning("🚧 Stopping %s crawl at page %d: %s", city_name, page, e)
+            if raise_errors:
+                raise
+            break
         except Exception as e:
-            print(f"❌ Error scraping page {page}: {e}")
+            metrics.PAGES_FAILED.labels(source='zameen', city=city_name).inc()
+            logger.error("❌ Error scraping page %d: %s", page, e)
+            if raise_errors:
+                raise
             continue
-    
-    return all_properties
+        
+        validate_images(page_properties)
+        yield from page_properties
+        time.sleep(delay)
+
+def scrape_zameen_city(city_name, pages=1, delay=2, start_page=1, raise_errors=False):
+    """Main function to scrape Zameen.com for a specific city"""
+    return list(iter_zameen_city(city_name, pages, delay, start_page, raise_errors))
 
-def scrape_multiple_cities(cities_to_scrape=None, pages_per_city=2):
-    """Scrape multiple cities"""
+def scrape_multiple_cities(cities_to_scrape=None, pages_per_city=2, journal=None):
+    """Scrape multiple cities
+    
+    With a journal (a CrawlJournal or a path), every completed page is
+    written to it and pages already in it are reloaded instead of fetched,
+    so a restarted crawl picks up where the last one stopped.
+    """
     if cities_to_scrape is None:
         cities_to_scrape = list(CITIES.keys())
     
+    journal, owned = open_journal(journal)
     all_results = {}
     
-    for city in cities_to_scrape:
-        print(f"\n{'='*60}")
-        print(f"🚀 Starting scrape for {city}")
-        print('='*60)
-        
-        properties = scrape_zameen_city(city, pages=pages_per_city)
-        all_results[city] = properties
-        
-        print(f"\n✅ Completed {city}: Found {len(properties)} properties")
-        time.sleep(3)
+    try:
+        for city in cities_to_scrape:
+            logger.info("🚀 Starting scrape for %s", city)
+            
+            if journal is None:
+                properties = scrape_zameen_city(city, pages=pages_per_city)
+            else:
+                properties = []
+                for page in range(1, pages_per_city + 1):
+                    properties.extend(journal.crawl_page(
+                        'zameen', city, page,
+                        lambda: scrape_zameen_city(city, pages=1, start_page=page)))
+            all_results[city] = properties
+            
+            logger.info("✅ Completed %s: Found %d properties", city, len(properties))
+            time.sleep(3)
+    finally:
+        if owned:
+            journal.close()
     
     return all_results
 
 def save_to_json(data, filename='zameen_properties.json'):
     """Save scraped data to JSON file"""
+    if isinstance(data, list):
+        with JsonExporter(filename) as exporter:
+            exporter.write_many(data)
+        return
     with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    print(f"💾 Data saved to {filename}")
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    logger.info("💾 Data saved to %s", filename)
 
 def display_results(properties):
     """Display scraped properties"""
@@ -340,21 +427,36 @@ def display_results(properties):
 
 # If run directly
 if __name__ == "__main__":
-    import sys
+    import argparse
+    
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     
-    if len(sys.argv) > 1:
-        city = sys.argv[1]
-        pages = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    parser = argparse.ArgumentParser(description='Scrape Zameen.com listings for a city')
+    parser.add_argument('city', nargs='?', help='Lahore, Karachi, Rawalpindi or Islamabad')
+    parser.add_argument('pages', nargs='?', type=int, default=2, help='number of pages (default 2)')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, help='stream results to a file in this format')
+    parser.add_argument('--output', help='output file (default zameen_<city>_<timestamp>.<format>)')
+    args = parser.parse_args()
+    
+    if args.city:
+        city = args.city
+        pages = args.pages
     else:
         print("Available cities: Lahore, Karachi, Rawalpindi, Islamabad")
         city = input("Enter city name: ").strip()
         pages = int(input("Enter number of pages (default 2): ") or "2")
     
-    properties = scrape_zameen_city(city, pages=pages)
-    display_results(properties)
-    
-    if properties:
-        save = input("\nSave to JSON? (y/n): ").lower()
-        if save == 'y':
-            filename = f"zameen_{city.lower()}_{time.strftime('%Y%m%d_%H%M%S')}.json"
-            save_to_json(properties, filename)
\ No newline at end of file
+    if args.format:
+        # Stream listings to disk as they are scraped, a page's worth per chunk
+        filename = args.output or f"zameen_{city.lower()}_{time.strftime('%Y%m%d_%H%M%S')}.{args.format}"
+        with get_exporter(args.format, filename, chunk_size=PAGE_CHUNK_SIZE) as exporter:
+            exporter.write_many(iter_zameen_city(city, pages=pages))
+    else:
+        properties = scrape_zameen_city(city, pages=pages)
+        display_results(properties)
+        
+        if properties:
+            save = input("\nSave to JSON? (y/n): ").lower()
+            if save == 'y':
+                filename = f"zameen_{city.lower()}_{time.strftime('%Y%m%d_%H%M%S')}.json"
+                save_to_json(properties, filename)